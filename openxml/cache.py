@@ -0,0 +1,66 @@
+'''
+A small least-recently-used cache, bounded by number of entries and by
+(approximate) size in bytes. It may be used from several threads.
+'''
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    '''Maps keys to values, dropping the least recently used entries once
+    there are more than maxitems, or their sizes add up to more than
+    maxbytes. Either bound may be None.'''
+
+    def __init__(self, maxitems=None, maxbytes=None):
+        self.maxitems = maxitems
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=0):
+        '''Add an entry of the given size. An entry bigger than maxbytes on
+        its own isn't kept at all.'''
+        with self._lock:
+            self._discard(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while ((self.maxitems is not None and len(self._entries) > self.maxitems) or
+                   (self.maxbytes is not None and self.bytes > self.maxbytes)):
+                oldest, (value, size) = self._entries.popitem(last=False)
+                self.bytes -= size
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        if key in self._entries:
+            value, size = self._entries.pop(key)
+            self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
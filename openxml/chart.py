@@ -0,0 +1,161 @@
+'''
+Native DrawingML charts, shared by docx and pptx.
+
+A chart is a part of its own (c:chartSpace), referenced from the document
+or slide by relationship. The data is written into the chart as literal
+values, so no embedded workbook is needed; the series may be any sequences
+of numbers, including NumPy arrays.
+
+    >>> d.add_line_chart([('Sales', [1, 4, 9]), ('Costs', [2, 3, 4])],
+    ...                  categories=['Jan', 'Feb', 'Mar'], title='Q1')
+'''
+
+from namespaces import nsprefixes
+from compact import escape, _attr
+
+chartreltype = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/chart'
+chartcontenttype = 'application/vnd.openxmlformats-officedocument.drawingml.chart+xml'
+
+# Chart sizes are given in pixels, as picture sizes are
+emuperpixel = 12667
+
+_CHARTSPACE_OPEN = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<c:chartSpace xmlns:c="%s" xmlns:a="%s" xmlns:r="%s">'
+                    '<c:roundedCorners val="0"/><c:chart>' %
+                    (nsprefixes['c'], nsprefixes['a'], nsprefixes['r']))
+_CHARTSPACE_CLOSE = '<c:plotVisOnly val="1"/></c:chart></c:chartSpace>'
+
+_AXES = ('<c:catAx><c:axId val="1"/><c:scaling><c:orientation val="minMax"/></c:scaling>'
+         '<c:delete val="0"/><c:axPos val="%s"/><c:tickLblPos val="nextTo"/>'
+         '<c:crossAx val="2"/><c:crosses val="autoZero"/><c:auto val="1"/>'
+         '<c:lblAlgn val="ctr"/><c:lblOffset val="100"/></c:catAx>'
+         '<c:valAx><c:axId val="2"/><c:scaling><c:orientation val="minMax"/></c:scaling>'
+         '<c:delete val="0"/><c:axPos val="%s"/><c:majorGridlines/>'
+         '<c:numFmt formatCode="General" sourceLinked="0"/><c:tickLblPos val="nextTo"/>'
+         '<c:crossAx val="1"/><c:crosses val="autoZero"/><c:crossBetween val="between"/></c:valAx>')
+
+def _series(series):
+    '''Return a list of (name, values) from a single sequence of numbers, a
+    list of sequences (e.g. the rows of a 2-D array), a list of (name,
+    values) pairs or a dict. A name needn't be a string: (2020, values)
+    names a series 2020.'''
+    if hasattr(series, 'items'):
+        return sorted(series.items())
+    if hasattr(series, 'tolist'):
+        # NumPy: iterating over plain lists is much quicker
+        series = series.tolist()
+    series = list(series)
+    if not series:
+        raise ValueError('A chart needs at least one series')
+    first = series[0]
+    if isinstance(first, tuple) and len(first) == 2 and hasattr(first[1], '__iter__'):
+        return series
+    if hasattr(first, '__iter__'):
+        return [('Series %d' % (i + 1), values) for i, values in enumerate(series)]
+    return [('Series 1', series)]
+
+def _numlit(out, values):
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    out.append('<c:numLit><c:formatCode>General</c:formatCode><c:ptCount val="%d"/>' % len(values))
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        value = float(value)
+        if value != value or value in (float('inf'), float('-inf')):
+            # Missing data: leave a gap
+            continue
+        out.append('<c:pt idx="%d"><c:v>%r</c:v></c:pt>' % (i, value))
+    out.append('</c:numLit>')
+
+def _strlit(out, values):
+    out.append('<c:strLit><c:ptCount val="%d"/>' % len(values))
+    for i, value in enumerate(values):
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        out.append('<c:pt idx="%d"><c:v>%s</c:v></c:pt>' % (i, escape(value)))
+    out.append('</c:strLit>')
+
+def chartspace(kind, series, categories=None, title=None, legend=None, horizontal=False):
+    '''Return the XML of a chart part. kind is 'line' or 'bar'; see
+    _series() for the forms series may take. categories label the points,
+    which are numbered otherwise. The legend is shown if there is more than
+    one series, unless legend says otherwise. Bar charts are drawn as
+    columns, or as horizontal bars if horizontal is set.'''
+    if kind not in ('line', 'bar'):
+        raise ValueError('Chart kind "%s" not implemented. Valid kinds: line, bar.' % kind)
+    series = _series(series)
+    if categories is not None:
+        if hasattr(categories, 'tolist'):
+            categories = categories.tolist()
+        categories = list(categories)
+    out = [_CHARTSPACE_OPEN]
+    if title:
+        out.append('<c:title><c:tx><c:rich><a:bodyPr/><a:p><a:r><a:t>%s</a:t></a:r></a:p>'
+                   '</c:rich></c:tx><c:overlay val="0"/></c:title>'
+                   '<c:autoTitleDeleted val="0"/>' % escape(title))
+    else:
+        out.append('<c:autoTitleDeleted val="1"/>')
+    out.append('<c:plotArea><c:layout/>')
+    if kind == 'line':
+        out.append('<c:lineChart><c:grouping val="standard"/><c:varyColors val="0"/>')
+    else:
+        out.append('<c:barChart><c:barDir val="%s"/><c:grouping val="clustered"/>'
+                   '<c:varyColors val="0"/>' % ('bar' if horizontal else 'col'))
+    for i, (name, values) in enumerate(series):
+        out.append('<c:ser><c:idx val="%d"/><c:order val="%d"/><c:tx><c:v>%s</c:v></c:tx>' %
+                   (i, i, escape(name if isinstance(name, basestring) else unicode(name))))
+        if kind == 'line':
+            out.append('<c:marker><c:symbol val="none"/></c:marker>')
+        else:
+            out.append('<c:invertIfNegative val="0"/>')
+        if categories is not None:
+            out.append('<c:cat>')
+            _strlit(out, categories)
+            out.append('</c:cat>')
+        out.append('<c:val>')
+        _numlit(out, values)
+        out.append('</c:val>')
+        if kind == 'line':
+            out.append('<c:smooth val="0"/>')
+        out.append('</c:ser>')
+    if kind == 'line':
+        out.append('<c:marker val="1"/><c:axId val="1"/><c:axId val="2"/></c:lineChart>')
+        out.append(_AXES % ('b', 'l'))
+    else:
+        out.append('<c:gapWidth val="150"/><c:axId val="1"/><c:axId val="2"/></c:barChart>')
+        out.append(_AXES % (('l', 'b') if horizontal else ('b', 'l')))
+    out.append('</c:plotArea>')
+    if legend is None:
+        legend = len(series) > 1
+    if legend:
+        out.append('<c:legend><c:legendPos val="r"/><c:overlay val="0"/></c:legend>')
+    out.append(_CHARTSPACE_CLOSE)
+    return ''.join(out)
+
+def _graphic(relid):
+    return ('<a:graphic xmlns:a="%s"><a:graphicData uri="%s">'
+            '<c:chart xmlns:c="%s" xmlns:r="%s" r:id="%s"/></a:graphicData></a:graphic>' %
+            (nsprefixes['a'], nsprefixes['c'], nsprefixes['c'], nsprefixes['r'], _attr(relid)))
+
+def inlinexml(relid, number, width, height, jc='center'):
+    '''Return a WordprocessingML paragraph showing chart relid inline, at
+    width x height pixels.'''
+    return ('<w:p xmlns:w="%s"><w:pPr><w:jc w:val="%s"/></w:pPr><w:r><w:drawing>'
+            '<wp:inline xmlns:wp="%s" distT="0" distB="0" distL="0" distR="0">'
+            '<wp:extent cx="%d" cy="%d"/><wp:effectExtent l="0" t="0" r="0" b="0"/>'
+            '<wp:docPr id="%d" name="Chart %d"/><wp:cNvGraphicFramePr/>%s'
+            '</wp:inline></w:drawing></w:r></w:p>' %
+            (nsprefixes['w'], _attr(jc), nsprefixes['wp'], width * emuperpixel,
+             height * emuperpixel, 1000 + number, number, _graphic(relid)))
+
+def framexml(relid, number, shapeid, x, y, width, height):
+    '''Return a PresentationML graphic frame showing chart relid at (x, y),
+    width x height pixels.'''
+    return ('<p:graphicFrame xmlns:p="%s"><p:nvGraphicFramePr>'
+            '<p:cNvPr id="%d" name="Chart %d"/><p:cNvGraphicFramePr/><p:nvPr/>'
+            '</p:nvGraphicFramePr><p:xfrm><a:off xmlns:a="%s" x="%d" y="%d"/>'
+            '<a:ext xmlns:a="%s" cx="%d" cy="%d"/></p:xfrm>%s</p:graphicFrame>' %
+            (nsprefixes['p'], shapeid, number, nsprefixes['a'], x * emuperpixel,
+             y * emuperpixel, nsprefixes['a'], width * emuperpixel,
+             height * emuperpixel, _graphic(relid)))
@@ -0,0 +1,321 @@
+'''
+A lightweight model for the body of a WordprocessingML document.
+
+Paragraphs, runs, tables and breaks are held as small __slots__ records and
+serialized straight to UTF-8 bytes from precomputed tag fragments, instead of
+building an lxml element per run and cell and walking the tree again in
+etree.tostring(). The output matches what the element builders in docx.py
+produce.
+
+lxml is only imported when somebody asks for the element tree (see
+Body.totree()), e.g. to run search() or replace() over the document.
+'''
+
+import re
+from namespaces import nsprefixes
+
+# Characters which cannot appear in an XML 1.0 document at all, escaped or not
+_invalidchars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def escape(text, quote=False):
+    '''Escape a piece of text for use as XML character data (or as an
+    attribute value if quote is set), returning UTF-8 bytes.'''
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    if _invalidchars.search(text):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    if quote and '"' in text:
+        text = text.replace('"', '&quot;')
+    return text.encode('utf-8')
+
+def _attr(value):
+    return escape(value, quote=True)
+
+DOCUMENT_OPEN = '<w:document xmlns:w="%s"><w:body>' % nsprefixes['w']
+DOCUMENT_CLOSE = '</w:body></w:document>'
+
+_RPR = {
+    '': '<w:rPr/>',
+}
+
+def _rpr(style):
+    '''Return the (cached) rPr fragment for a 'bui' style string.'''
+    try:
+        return _RPR[style]
+    except KeyError:
+        props = ''
+        if 'b' in style:
+            props += '<w:b/>'
+        if 'u' in style:
+            props += '<w:u w:val="single"/>'
+        if 'i' in style:
+            props += '<w:i/>'
+        fragment = _RPR[style] = '<w:rPr>' + props + '</w:rPr>' if props else '<w:rPr/>'
+        return fragment
+
+class Node(object):
+    '''Base class for compact body records.'''
+    __slots__ = ()
+
+    def write(self, out):
+        '''Append the serialized record to the list of byte strings `out`.'''
+        raise NotImplementedError
+
+    def tobytes(self):
+        out = []
+        self.write(out)
+        return ''.join(out)
+
+class Run(Node):
+    '''A run of text with an optional 'bui' style string.'''
+    __slots__ = ('text', 'style', 'breakbefore')
+
+    def __init__(self, text, style='', breakbefore=False):
+        self.text = text
+        self.style = style
+        self.breakbefore = breakbefore
+
+    def write(self, out):
+        out.append('<w:r>')
+        out.append(_rpr(self.style))
+        if self.breakbefore:
+            out.append('<w:lastRenderedPageBreak/>')
+        if self.text:
+            out.append('<w:t>')
+            out.append(escape(self.text))
+            out.append('</w:t>')
+        else:
+            out.append('<w:t/>')
+        out.append('</w:r>')
+
+class Paragraph(Node):
+    '''A paragraph: a style, an alignment and a list of runs.'''
+    __slots__ = ('runs', 'style', 'jc')
+
+    def __init__(self, runs, style='BodyText', jc='left'):
+        self.runs = runs
+        self.style = style
+        self.jc = jc
+
+    def normalize(self):
+        '''Drop empty runs and merge adjacent runs with the same style;
+        returns the number of runs eliminated.'''
+        runs = []
+        for run in self.runs:
+            if not run.text:
+                continue
+            if (runs and run.style == runs[-1].style
+                    and run.breakbefore == runs[-1].breakbefore):
+                runs[-1] = Run(runs[-1].text + run.text, run.style, run.breakbefore)
+            else:
+                runs.append(run)
+        if not runs and self.runs:
+            # Keep one empty run, as paragraph('') would make
+            runs = self.runs[:1]
+        eliminated = len(self.runs) - len(runs)
+        self.runs = runs
+        return eliminated
+
+    def write(self, out):
+        out.append('<w:p><w:pPr><w:pStyle w:val="')
+        out.append(_attr(self.style))
+        out.append('"/><w:jc w:val="')
+        out.append(_attr(self.jc))
+        out.append('"/></w:pPr>')
+        for run in self.runs:
+            run.write(out)
+        out.append('</w:p>')
+
+class Heading(Node):
+    '''A heading paragraph, as made by docx.heading().'''
+    __slots__ = ('text', 'style')
+
+    def __init__(self, text, style):
+        self.text = text
+        self.style = style
+
+    def write(self, out):
+        out.append('<w:p><w:pPr><w:pStyle w:val="')
+        out.append(_attr(self.style))
+        out.append('"/></w:pPr><w:r>')
+        if self.text:
+            out.append('<w:t>')
+            out.append(escape(self.text))
+            out.append('</w:t>')
+        else:
+            out.append('<w:t/>')
+        out.append('</w:r></w:p>')
+
+class Raw(Node):
+    '''Pre-serialized XML, spliced into the output as-is.'''
+    __slots__ = ('xml',)
+
+    def __init__(self, xml):
+        self.xml = xml
+
+    def write(self, out):
+        out.append(self.xml)
+
+class Element(Node):
+    '''An lxml element, only serialized when the body is.'''
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def write(self, out):
+        from lxml import etree
+        out.append(etree.tostring(self.element, encoding='utf-8'))
+
+_PAGEBREAK = Raw('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+_SECTIONBREAK = {
+    'portrait': Raw('<w:p><w:pPr><w:sectPr><w:pgSz w:w="12240" w:h="15840"/></w:sectPr></w:pPr></w:p>'),
+    'landscape': Raw('<w:p><w:pPr><w:sectPr><w:pgSz w:h="12240" w:w="15840" w:orient="landscape"/></w:sectPr></w:pPr></w:p>'),
+}
+
+def pagebreak(type='page', orient='portrait'):
+    '''Compact equivalent of docx.pagebreak().'''
+    validtypes = ['page', 'section']
+    if type not in validtypes:
+        raise ValueError('Page break style "%s" not implemented. Valid styles: %s.' % (type, validtypes))
+    if type == 'page':
+        return _PAGEBREAK
+    return _SECTIONBREAK.get(orient, Raw('<w:p><w:pPr><w:sectPr/></w:pPr></w:p>'))
+
+def paragraph(paratext, style='BodyText', breakbefore=False, jc='left'):
+    '''Compact equivalent of docx.paragraph(), taking the same arguments.'''
+    if isinstance(paratext, list):
+        runs = []
+        for pt in paratext:
+            if isinstance(pt, (list, tuple)):
+                runs.append(Run(pt[0], pt[1], breakbefore))
+            else:
+                runs.append(Run(pt, '', breakbefore))
+    else:
+        runs = [Run(paratext, '', breakbefore)]
+    return Paragraph(runs, style, jc)
+
+def heading(headingtext, headinglevel, lang='en'):
+    '''Compact equivalent of docx.heading().'''
+    lmap = {
+        'en': 'Heading',
+        'it': 'Titolo',
+    }
+    return Heading(headingtext, lmap[lang] + str(headinglevel))
+
+def _cell(out, content, wattr, shading, align):
+    out.append('<w:tc><w:tcPr><w:tcW ')
+    out.append(wattr)
+    out.append('/>')
+    if shading:
+        out.append('<w:shd w:val="clear" w:color="auto" w:fill="FFFFFF" w:themeFill="text2" w:themeFillTint="99"/>')
+    out.append('</w:tcPr>')
+    if not isinstance(content, (list, tuple)):
+        content = [content,]
+    for c in content:
+        if isinstance(c, Node):
+            c.write(out)
+        elif hasattr(c, 'tag'):
+            Element(c).write(out)
+        else:
+            paragraph(c, jc=align).write(out)
+    out.append('</w:tc>')
+
+def table(contents, heading=True, colw=None, cwunit='dxa', tblw=0, twunit='auto', borders={}, celstyle=None):
+    '''Compact equivalent of docx.table(), taking the same arguments.
+
+    The table is serialized immediately; cells may hold strings, compact
+    records or lxml elements.'''
+    columns = len(contents[0])
+    out = ['<w:tbl><w:tblPr><w:tblStyle w:val=""/><w:tblW w:w="%s" w:type="%s"/>' %
+           (_attr(str(tblw)), _attr(str(twunit)))]
+    if len(borders.keys()):
+        out.append('<w:tblBorders>')
+        for b in ['top', 'left', 'bottom', 'right', 'insideH', 'insideV']:
+            if b in borders.keys() or 'all' in borders.keys():
+                k = 'all' if 'all' in borders.keys() else b
+                out.append('<w:' + b)
+                for a in borders[k].keys():
+                    out.append(' w:%s="%s"' % (a, _attr(unicode(borders[k][a]))))
+                out.append('/>')
+        out.append('</w:tblBorders>')
+    out.append('<w:tblLook w:val="0400"/></w:tblPr><w:tblGrid>')
+    for i in range(columns):
+        out.append('<w:gridCol w:w="%s"/>' % (_attr(str(colw[i])) if colw else '2390'))
+    out.append('</w:tblGrid>')
+    if colw:
+        wattrs = ['w:w="%s" w:type="%s"' % (_attr(str(w)), _attr(cwunit)) for w in colw]
+    else:
+        wattrs = ['w:w="0" w:type="auto"'] * columns
+    if celstyle:
+        aligns = [s.get('align', 'left') for s in celstyle]
+    else:
+        aligns = ['left'] * columns
+    # Heading Row
+    if heading:
+        out.append('<w:tr><w:trPr><w:cnfStyle w:val="000000100000"/></w:trPr>')
+        for i, content in enumerate(contents[0]):
+            _cell(out, content, wattrs[i], True, 'center')
+        out.append('</w:tr>')
+    # Contents Rows
+    for contentrow in contents[1 if heading else 0:]:
+        out.append('<w:tr>')
+        for i, content in enumerate(contentrow):
+            _cell(out, content, wattrs[i], False, aligns[i])
+        out.append('</w:tr>')
+    out.append('</w:tbl>')
+    return Raw(''.join(out))
+
+class Body(object):
+    '''A list of compact records standing in for the w:body element.'''
+
+    def __init__(self, nodes=None):
+        self.nodes = nodes if nodes is not None else []
+
+    def append(self, node):
+        if not isinstance(node, Node):
+            # An lxml element, e.g. from docx.picture()
+            node = Element(node)
+        self.nodes.append(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def copy(self):
+        '''Return a body which shares its records with this one. Records
+        are never changed in place, so the two can be added to (or
+        normalized) independently.'''
+        return Body(list(self.nodes))
+
+    def normalize(self):
+        '''Merge adjacent runs with the same style in every paragraph;
+        returns the number of runs eliminated.'''
+        eliminated = 0
+        for i, node in enumerate(self.nodes):
+            if isinstance(node, Paragraph):
+                # Normalize a copy: the paragraph may be shared with a fork
+                node = self.nodes[i] = Paragraph(node.runs, node.style, node.jc)
+                eliminated += node.normalize()
+        return eliminated
+
+    def write(self, out):
+        for node in self.nodes:
+            node.write(out)
+
+    def tobytes(self):
+        '''Serialize a complete word/document.xml part.'''
+        out = [DOCUMENT_OPEN]
+        self.write(out)
+        out.append(DOCUMENT_CLOSE)
+        return ''.join(out)
+
+    def totree(self):
+        '''Build the lxml element tree for the document.'''
+        from lxml import etree
+        return etree.fromstring(self.tobytes())
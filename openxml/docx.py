@@ -15,12 +15,21 @@ except ImportError:
     import Image
 import zipfile
 import shutil
+import copy
 import re
 import time
 import os
 from os.path import join
 import tempfile
 from namespaces import nsprefixes
+import opc
+import compact
+from compact import Body as CompactBody
+from cache import LRUCache
+import chart
+from imaging import ImagePolicy
+from limits import LimitedZipFile
+import mediacache
 
 log = logging.getLogger(__name__)
 
@@ -31,49 +40,225 @@ if not os.path.isdir(template_dir):
     template_dir = join(os.path.dirname(__file__),'docx_template') # dev
 
 class Document(object):
-    def __init__(self):
-        self.relationshiplist = relationshiplist()
-        self.tmpdir = tempfile.mkdtemp()
-        self.template_dir = os.path.join(self.tmpdir, 'template')
-        shutil.copytree(template_dir, self.template_dir) # we copy our template files to a temp location
+    def __init__(self, memory_budget=None):
+        # Template parts are only referenced here, and read when we save
+        self.template_dir = template_dir
+        self.package = opc.Package.fromdir(template_dir, partcontenttypes,
+                                           memory_budget=memory_budget)
+        self.relationshiplist = opc.Relationships()
+        for relationship in relationshiplist():
+            self.relationshiplist.append(relationship)
+        self.compact = False
+        self._document = None
+        self.image_policy = None
+        # Fragment XML spliced in at save, and the ids of their relationships
+        self._fragmentxml = []
+        self._fragmentrids = {}
         return
     
     @classmethod
-    def create(cls):
-        doc = cls()
-        doc.document = newdocument()
-        doc.body = doc.document.xpath('/w:document/w:body', namespaces=nsprefixes)[0]
+    def create(cls, compact=False, memory_budget=None, verify_media=False, image_policy=None):
+        '''Create a new, empty document.
+
+        If compact is set the body is kept as a compact.Body of lightweight
+        records, serialized straight to bytes on save; the lxml tree is only
+        built if the `document` attribute is accessed.
+
+        memory_budget is the number of bytes of pictures to hold in memory
+        before spilling them to temporary files, see media.py. Picture files
+        are read when the document is saved; with verify_media set, saving
+        raises IOError if one has changed since it was added.
+
+        image_policy is the ImagePolicy to prepare pictures with, see
+        imaging.py.'''
+        doc = cls(memory_budget)
+        doc.package.media.verify = verify_media
+        doc.image_policy = image_policy
+        if compact:
+            doc.compact = True
+            doc.body = CompactBody()
+        else:
+            doc.document = newdocument()
+        return doc
+
+    def fork(self):
+        '''Return an independent copy of the document as built so far, e.g.
+        to finish a common beginning in several different ways.
+
+        The template parts and pictures are shared rather than copied. A
+        compact body shares its records; an lxml body is copied, as lxml
+        elements can't be shared between trees.'''
+        doc = copy.copy(self)
+        doc.package = self.package.copy()
+        self.package.media.share()
+        doc.relationshiplist = self.relationshiplist.copy()
+        doc._fragmentxml = list(self._fragmentxml)
+        doc._fragmentrids = dict(self._fragmentrids)
+        if self.compact:
+            doc.body = self.body.copy()
+        else:
+            doc.document = copy.deepcopy(self.document)
         return doc
 
+    def _get_document(self):
+        if self._document is None and self.compact:
+            # Somebody wants the tree: build it, and carry on in lxml from here
+            self._document = self.body.totree()
+            self.body = self._document.xpath('/w:document/w:body', namespaces=nsprefixes)[0]
+            self.compact = False
+        return self._document
+
+    def _set_document(self, document):
+        self._document = document
+        self.body = document.xpath('/w:document/w:body', namespaces=nsprefixes)[0]
+        self.compact = False
+
+    document = property(_get_document, _set_document)
+
     def add_break(self, *args, **kwargs):
-        self.body.append(pagebreak(*args, **kwargs))
+        if self.compact:
+            self.body.append(compact.pagebreak(*args, **kwargs))
+        else:
+            self.body.append(pagebreak(*args, **kwargs))
         return
 
     def add_para(self, *args, **kwargs):
-        self.body.append(paragraph(*args, **kwargs))
+        if self.compact:
+            self.body.append(compact.paragraph(*args, **kwargs))
+        else:
+            self.body.append(paragraph(*args, **kwargs))
         return
 
     def add_table(self, *args, **kwargs):
-        self.body.append(table(*args, **kwargs))
+        if self.compact:
+            self.body.append(compact.table(*args, **kwargs))
+        else:
+            self.body.append(table(*args, **kwargs))
         return 
 
-    def add_picture(self, picname, *args, **kwargs):
+    def add_picture(self, picname, picdescription='No Description', pixelwidth=None,
+                    pixelheight=None, nochangeaspect=True, nochangearrowheads=True,
+                    align='center', scale=1, data=None, policy=None):
+        '''Add a picture from the file picname, or from data (a byte string
+        or file-like object) if given, in which case picname only supplies
+        the name and extension.
+
+        policy (by default the document's image_policy) is an ImagePolicy
+        to downscale and recompress the picture with, in the background.'''
         extension = os.path.splitext(picname)[1]
         if extension not in ['.jpg', '.jpeg', '.png']:
             raise ValueError
-        self.relationshiplist, pic_para = picture(
-            self.relationshiplist, picname, template=self.template_dir, *args, **kwargs)
-        self.body.append(pic_para)
+        partname = self.package.add_media(picname, 'word/media', data)
+        picrelid = self.relationshiplist.add(nsprefixes['i'], partname[len('word/'):])
+        part = self.package.get_part(partname)
+        # Check if the user has specified a size
+        if not pixelwidth or not pixelheight:
+            # If not, get info from the picture itself
+            pixelwidth,pixelheight = mediacache.size(part.media)
+        policy = policy or self.image_policy
+        if policy is not None:
+            part.prepare(policy, (pixelwidth * scale * chart.emuperpixel,
+                                  pixelheight * scale * chart.emuperpixel))
+        self.body.append(picturepara(picrelid, os.path.basename(picname), pixelwidth,
+            pixelheight, picdescription, nochangeaspect, nochangearrowheads, align, scale))
         return
         
     def add_heading(self, heading_text, heading_level):
-        self.body.append(heading(heading_text, heading_level))
+        if self.compact:
+            self.body.append(compact.heading(heading_text, heading_level))
+        else:
+            self.body.append(heading(heading_text, heading_level))
+        return
+
+    def add_line_chart(self, series, categories=None, title=None, width=600, height=360,
+                       legend=None):
+        '''Add a native line chart, width x height pixels. series is a
+        sequence of numbers (e.g. a NumPy array), a list of them, or a list
+        of (name, values) pairs; see chart.chartspace().'''
+        self._add_chart('line', series, categories, title, width, height, legend=legend)
+        return
+
+    def add_bar_chart(self, series, categories=None, title=None, width=600, height=360,
+                      legend=None, horizontal=False):
+        '''Add a native bar chart; see add_line_chart().'''
+        self._add_chart('bar', series, categories, title, width, height, legend=legend,
+                        horizontal=horizontal)
         return
 
-    def save(self, filename, *args, **kwargs):
+    def _add_chart(self, kind, series, categories, title, width, height, **kwargs):
+        partname = self.package.newpartname('word/charts/chart%d', '.xml')
+        self.package.add_part(opc.Part(partname, chart.chartcontenttype,
+            data=chart.chartspace(kind, series, categories, title, **kwargs)))
+        relid = self.relationshiplist.add(chart.chartreltype, partname[len('word/'):])
+        number = int(partname[len('word/charts/chart'):-len('.xml')])
+        xml = chart.inlinexml(relid, number, width, height)
+        if self.compact:
+            self.body.append(compact.Raw(xml))
+        else:
+            self.body.append(etree.fromstring(xml))
+
+    def add_fragment(self, name):
+        '''Add a block of content registered with register_fragment(). It is
+        built and serialized once per process (while it stays in
+        fragmentcache), and spliced into the document as it is when saved,
+        so search() and replace() on the document tree don't see it.'''
+        fragment = fragmentcache.get(name)
+        if fragment is None:
+            fragment = _buildfragment(name)
+            fragmentcache.put(name, fragment, fragment.size)
+        rids = self._fragmentrids.get(name)
+        if rids is None:
+            rids = []
+            for reltype, target, media in fragment.rels:
+                if isinstance(media, opc.Part):
+                    # Each document gets its own copy, e.g. of a chart
+                    root, ext = os.path.splitext(media.partname)
+                    partname = self.package.newpartname(re.sub(r'\d+$', '', root) + '%d', ext)
+                    self.package.add_part(opc.Part(partname, media.content_type, data=media.data))
+                    target = partname[len('word/'):]
+                elif media is not None:
+                    if isinstance(media, basestring):
+                        partname = self.package.add_media(media, 'word/media')
+                    else:
+                        partname = self.package.add_media('fragment.' + media[0], 'word/media', media[1])
+                    target = partname[len('word/'):]
+                rids.append(self.relationshiplist.add(reltype, target))
+            self._fragmentrids[name] = rids
+        xml = fragment.xml(rids)
+        if self.compact:
+            self.body.append(compact.Raw(xml))
+        else:
+            self.body.append(etree.Comment(_FRAGMENT % len(self._fragmentxml)))
+            self._fragmentxml.append(xml)
+        return
+
+    def normalize(self):
+        '''Merge adjacent runs with identical formatting, see normalize().
+        Returns the number of elements eliminated.'''
+        if self.compact:
+            return self.body.normalize()
+        return normalize(self.document)
+
+    def save(self, filename, profile='default', timestamp=None, **trees):
+        '''Save the document to filename (or a file-like object).
+
+        See savedocx() for the profiles and timestamp: pass e.g.
+        opc.EPOCH for output which only depends on the content. coreprops,
+        appprops and websettings trees may be passed to replace the
+        defaults.'''
         suffix = '.docx'
-        if filename[-5:] != suffix: filename = filename + suffix
-        return savedocx(document=self.document, template=self.  template_dir, output=filename, wordrelationships=wordrelationships(self.relationshiplist), *args, **kwargs)
+        if isinstance(filename, basestring) and filename[-5:] != suffix:
+            filename = filename + suffix
+        if self.compact:
+            document = self.body.tobytes()
+        elif self._fragmentxml:
+            document = etree.tostring(self.document, xml_declaration=True, encoding='UTF-8',
+                                      standalone=True)
+            document = _fragmentre.sub(lambda m: self._fragmentxml[int(m.group(1))], document)
+        else:
+            document = self.document
+        return writedocx(self.package.copy(), document, self.relationshiplist.copy(),
+                         filename, profile, timestamp=timestamp, **trees)
         
     def get_file_object(self, *args, **kwargs):
         '''Get the document as a file-like object.'''
@@ -88,10 +273,105 @@ class Document(object):
         return self.get_file_object(*args, **kwargs).read()
  
     def close(self):
-        shutil.rmtree(self.tmpdir)
+        '''Release the pictures held in memory or in temporary files.'''
+        self.package.close()
+        return
+
+# Builders registered with register_fragment(), and the fragments built by them
+_fragmentbuilders = {}
+fragmentcache = LRUCache(maxitems=256, maxbytes=16 << 20)
+
+# Placeholder comments for fragments in an lxml body
+_FRAGMENT = 'openxml-fragment:%d'
+_fragmentre = re.compile(r'<!--openxml-fragment:(\d+)-->')
+# Stand-ins for relationship ids while a fragment is serialized
+_RIDSENTINEL = u'\ue000%d\ue001'
+_ridsentinelre = re.compile(u'\ue000(\\d+)\ue001'.encode('utf-8'))
+
+class Fragment(object):
+    '''A serialized block of body content: byte segments with relationship
+    ids in between. slots gives the index in rels of the id after each
+    segment; rels holds a (type, target, media) for each relationship,
+    media being None, the path of a picture, (extension, data) or, for
+    another part such as a chart, an opc.Part holding its data.'''
+
+    def __init__(self, segments, slots, rels):
+        self.segments = segments
+        self.slots = slots
+        self.rels = rels
+        self.size = sum([len(segment) for segment in segments])
+        for reltype, target, media in rels:
+            if isinstance(media, tuple):
+                self.size += len(media[1])
+            elif isinstance(media, opc.Part):
+                self.size += len(media.data)
+
+    def xml(self, rids):
+        '''Return the XML with the given relationship ids filled in.'''
+        out = [self.segments[0]]
+        for i, slot in enumerate(self.slots):
+            out.append(rids[slot])
+            out.append(self.segments[i + 1])
+        return ''.join(out)
+
+def register_fragment(name, builder):
+    '''Register a named block of content which recurs across documents, such
+    as a disclaimer or a logo header, for Document.add_fragment(). builder
+    is called with a new, empty Document and adds the content to it.'''
+    _fragmentbuilders[name] = builder
+    fragmentcache.discard(name)
+    return
 
-def opendocx(file):
-    '''Open a docx file, return a document XML tree'''
+def _buildfragment(name):
+    doc = Document.create()
+    try:
+        _fragmentbuilders[name](doc)
+        # Splice in the fragments the builder added in turn, so that their
+        # relationships are carried over with the others
+        for comment in list(doc.body.iter(etree.Comment)):
+            match = _fragmentre.match(etree.tostring(comment))
+            if match is not None:
+                nested = etree.fromstring('<w:body xmlns:w="%s">%s</w:body>'
+                    % (nsprefixes['w'], doc._fragmentxml[int(match.group(1))]))
+                parent = comment.getparent()
+                index = parent.index(comment)
+                parent[index:index + 1] = list(nested)
+        r = '{%s}' % nsprefixes['r']
+        rids = []
+        for element in doc.body.iter():
+            for attr, value in element.attrib.items():
+                if attr.startswith(r) and value in doc.relationshiplist:
+                    if value not in rids:
+                        rids.append(value)
+                    element.set(attr, _RIDSENTINEL % rids.index(value))
+        xml = ''.join([etree.tostring(child, encoding='utf-8') for child in doc.body])
+        pieces = _ridsentinelre.split(xml)
+        rels = []
+        for rid in rids:
+            reltype, target = doc.relationshiplist.get(rid)
+            part = doc.package.get_part(opc.resolve('word/document.xml', target))
+            media = None
+            if isinstance(part, opc.MediaPart):
+                if part.media.path is not None:
+                    media = part.media.path
+                else:
+                    media = (opc.extension(part.partname), part.media.read())
+            elif part is not None:
+                media = opc.Part(part.partname, part.content_type, data=part.blob())
+            rels.append((reltype, target, media))
+    finally:
+        doc.close()
+    return Fragment(pieces[0::2], [int(n) for n in pieces[1::2]], rels)
+
+def opendocx(file, limits=None):
+    '''Open a docx file, return a document XML tree. For a file which can't
+    be trusted, give limits (a limits.Limits) on what reading it may take.'''
+    if limits is not None:
+        mydoc = LimitedZipFile(file, limits)
+        try:
+            return mydoc.parse('word/document.xml')
+        finally:
+            mydoc.close()
     mydoc = zipfile.ZipFile(file)
     xmlcontent = mydoc.read('word/document.xml')
     document = etree.fromstring(xmlcontent)
@@ -227,23 +507,25 @@ def paragraph(paratext,style='BodyText',breakbefore=False,jc='left'):
     # Return the combined paragraph
     return paragraph
 
+# Content types of the parts which aren't covered by a Default for their extension
+partcontenttypes = {
+    'word/theme/theme1.xml':'application/vnd.openxmlformats-officedocument.theme+xml',
+    'word/fontTable.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.fontTable+xml',
+    'docProps/core.xml':'application/vnd.openxmlformats-package.core-properties+xml',
+    'docProps/app.xml':'application/vnd.openxmlformats-officedocument.extended-properties+xml',
+    'word/document.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml',
+    'word/settings.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.settings+xml',
+    'word/numbering.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml',
+    'word/styles.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml',
+    'word/webSettings.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.webSettings+xml'
+    }
+
 def contenttypes():
     # FIXME - doesn't quite work...read from string as temp hack...
     #types = makeelement('Types',nsprefix='ct')
     types = etree.fromstring('''<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"></Types>''')
-    parts = {
-        '/word/theme/theme1.xml':'application/vnd.openxmlformats-officedocument.theme+xml',
-        '/word/fontTable.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.fontTable+xml',
-        '/docProps/core.xml':'application/vnd.openxmlformats-package.core-properties+xml',
-        '/docProps/app.xml':'application/vnd.openxmlformats-officedocument.extended-properties+xml',
-        '/word/document.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml',
-        '/word/settings.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.settings+xml',
-        '/word/numbering.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml',
-        '/word/styles.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml',
-        '/word/webSettings.xml':'application/vnd.openxmlformats-officedocument.wordprocessingml.webSettings+xml'
-        }
-    for part in parts:
-        types.append(makeelement('Override',nsprefix=None,attributes={'PartName':part,'ContentType':parts[part]}))
+    for part in partcontenttypes:
+        types.append(makeelement('Override',nsprefix=None,attributes={'PartName':'/'+part,'ContentType':partcontenttypes[part]}))
     # Add support for filetypes
     filetypes = {'rels':'application/vnd.openxmlformats-package.relationships+xml','xml':'application/xml','jpeg':'image/jpeg','gif':'image/gif','png':'image/png'}
     for extension in filetypes:
@@ -401,33 +683,38 @@ def picture(relationshiplist, picname, picdescription='No Description', pixelwid
     # http://openxmldeveloper.org/articles/462.aspx
     # Create an image. Size may be specified, otherwise it will based on the
     # pixel size of image. Return a paragraph containing the picture'''
-    # Copy the file into the media dir
-
-    media_dir = join(template,'word','media')
-
-    if not os.path.isdir(media_dir):
-        os.mkdir(media_dir)
-    new_picname = join(media_dir,os.path.basename(picname))
-    shutil.copyfile(picname, new_picname)
-    picname = new_picname
-    
     # Check if the user has specified a size
     if not pixelwidth or not pixelheight:
         # If not, get info from the picture itself
         pixelwidth,pixelheight = Image.open(picname).size[0:2]
+    # The file isn't copied: the relationship stands for it until savedocx()
+    # reads it from where it is
+    target = opc.filetarget(picname)
     picname = os.path.basename(picname)
+
+    reltype = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+    if isinstance(relationshiplist, opc.Relationships):
+        # A Document's relationshiplist hands out its own ids, and gives
+        # the same picture the same one
+        picrelid = relationshiplist.add(reltype, target)
+    else:
+        # Set relationship ID to the first available
+        picrelid = 'rId'+str(len(relationshiplist)+1)
+        relationshiplist.append([reltype, target])
+    para = picturepara(picrelid, picname, pixelwidth, pixelheight, picdescription,
+                       nochangeaspect, nochangearrowheads, align, scale)
+    return relationshiplist,para
+
+def picturepara(picrelid, picname, pixelwidth, pixelheight, picdescription='No Description',
+                nochangeaspect=True, nochangearrowheads=True, align='center', scale=1):
+    '''Return a paragraph containing the image with relationship id picrelid,
+    displayed at the given pixel size times scale'''
     # OpenXML measures on-screen objects in English Metric Units
     # 1cm = 36000 EMUs
     emuperpixel = 12667
     width = str(int(pixelwidth * emuperpixel * scale))
     height = str(int(pixelheight * emuperpixel * scale))
-
-    # Set relationship ID to the first available
     picid = '2'
-    picrelid = 'rId'+str(len(relationshiplist)+1)
-    relationshiplist.append([
-        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image',
-        'media/'+picname])
 
     # There are 3 main elements inside a picture
     # 1. The Blipfill - specifies how the image fills the picture area (stretch, tile, etc.)
@@ -494,7 +781,7 @@ def picture(relationshiplist, picname, picdescription='No Description', pixelwid
     run.append(drawing)
     para = paragraph(paratext='', jc=align)
     para.append(run)
-    return relationshiplist,para
+    return para
 
 
 def search(document,search):
@@ -538,6 +825,75 @@ def clean(document):
 
     return newdocument
 
+def normalize(document):
+    '''Merge adjacent runs with identical formatting, in a single pass.
+
+    Empty text elements and runs are dropped, empty run properties are
+    removed, and a text-only run whose properties match those of the run
+    right before it is folded into that run. Differences in revision ids
+    (rsid* attributes) don't prevent a merge.
+
+    The document is modified in place; returns the number of elements
+    eliminated.'''
+    w = nsprefixes['w']
+    rtag = '{%s}r' % w
+    ttag = '{%s}t' % w
+    rprtag = '{%s}rPr' % w
+    spaceattr = '{http://www.w3.org/XML/1998/namespace}space'
+    eliminated = 0
+
+    def runkey(run, rpr):
+        attrs = sorted((k, v) for k, v in run.attrib.items() if 'rsid' not in k)
+        if rpr is None:
+            return attrs, None
+        return attrs, etree.tostring(rpr)
+
+    prev = None     # Last text run we could merge into
+    prevkey = None
+    for run in list(document.iter(rtag)):
+        parent = run.getparent()
+        rpr = None
+        textonly = True
+        for child in list(run):
+            if child.tag == rprtag:
+                if not len(child) and not child.attrib:
+                    run.remove(child)
+                    eliminated += 1
+                else:
+                    rpr = child
+            elif child.tag == ttag:
+                if not child.text:
+                    run.remove(child)
+                    eliminated += 1
+            elif not isinstance(child.tag, basestring):
+                # Comments and processing instructions
+                continue
+            else:
+                textonly = False
+        content = len(run) - (rpr is not None)
+        if not content:
+            parent.remove(run)
+            eliminated += 1 + (rpr is not None)
+            continue
+        key = runkey(run, rpr)
+        if (textonly and prev is not None and run.getprevious() is prev
+                and prevkey == key):
+            # Fold our text into the last text element of the previous run
+            target = prev[-1]
+            for t in run.iterchildren(ttag):
+                target.text += t.text
+                eliminated += 1
+            if target.text != target.text.strip():
+                target.set(spaceattr, 'preserve')
+            parent.remove(run)
+            eliminated += 1 + (rpr is not None)
+            continue
+        if run[-1].tag == ttag:
+            prev, prevkey = run, key
+        else:
+            prev, prevkey = None, None
+    return eliminated
+
 def findTypeParent(element, tag):
     """ Finds fist parent of element of the given type
 
@@ -793,9 +1149,52 @@ def getdocumenttext(document):
             paratextlist.append(paratext)
     return paratextlist
 
-def coreproperties(title='No Title',subject='No Subject',creator='No Creator',keywords=[],lastmodifiedby=None):
+def iterparagraphs(file, limits=None):
+    '''Yield the text of each paragraph of a docx file (a filename or
+    file-like object) as the list of its pieces: the text of each w:t, and
+    '\t' for each tab. word/document.xml is parsed incrementally, and each
+    paragraph discarded once it has been read, so memory use doesn't grow
+    with the size of the document. limits are as for opendocx().'''
+    w = nsprefixes['w']
+    t, tab = '{%s}t' % w, '{%s}tab' % w
+    if limits is None:
+        docxfile = zipfile.ZipFile(file)
+        parse = etree.iterparse
+    else:
+        docxfile = LimitedZipFile(file, limits)
+        parse = limits.iterparse
+    try:
+        source = docxfile.open('word/document.xml')
+        try:
+            for event, para in parse(source, tag='{%s}p' % w):
+                pieces = []
+                for element in para.iter(t, tab):
+                    if element.tag == t:
+                        if element.text:
+                            pieces.append(element.text)
+                    else:
+                        pieces.append(u'\t')
+                yield pieces
+                para.clear()
+                while para.getprevious() is not None:
+                    del para.getparent()[0]
+        finally:
+            source.close()
+    finally:
+        docxfile.close()
+
+def iterdocumenttext(file, limits=None):
+    '''Streaming counterpart of getdocumenttext(opendocx(file)): yield the
+    text of each non-empty paragraph.'''
+    for pieces in iterparagraphs(file, limits):
+        if pieces:
+            yield u''.join(pieces)
+
+def coreproperties(title='No Title',subject='No Subject',creator='No Creator',keywords=[],lastmodifiedby=None,timestamp=None):
     '''Create core properties (common document properties referred to in the 'Dublin Core' specification).
-    See appproperties() for other stuff.'''
+    See appproperties() for other stuff. The creation and modification times
+    are timestamp (a datetime or seconds since the epoch, in UTC) if given,
+    or now.'''
     coreprops = makeelement('coreProperties',nsprefix='cp')
     coreprops.append(makeelement('title',tagtext=title,nsprefix='dc'))
     coreprops.append(makeelement('subject',tagtext=subject,nsprefix='dc'))
@@ -807,7 +1206,11 @@ def coreproperties(title='No Title',subject='No Subject',creator='No Creator',ke
     coreprops.append(makeelement('revision',tagtext='1',nsprefix='cp'))
     coreprops.append(makeelement('category',tagtext='Examples',nsprefix='cp'))
     coreprops.append(makeelement('description',tagtext='Examples',nsprefix='dc'))
-    currenttime = time.strftime('%Y-%m-%dT%H:%M:%SZ')
+    timestamp = opc.totimestamp(timestamp)
+    if timestamp is None:
+        currenttime = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    else:
+        currenttime = timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
     # Document creation and modify times
     # Prob here: we have an attribute who name uses one namespace, and that
     # attribute's value uses another namespace.
@@ -880,36 +1283,185 @@ def wordrelationships(relationshiplist):
         count += 1
     return relationships
 
-def savedocx(document, output, wordrelationships, coreprops=coreproperties(),
-                appprops=appproperties(),contenttypes=contenttypes(),
-                websettings=websettings(),
-                template=template_dir):
-    '''Save a modified document'''
-    assert os.path.isdir(template)
-    docxfile = zipfile.ZipFile(output,mode='w',compression=zipfile.ZIP_DEFLATED)
-
-    # Serialize our trees into out zip file
-    treesandfiles = {document:'word/document.xml',
-                     coreprops:'docProps/core.xml',
-                     appprops:'docProps/app.xml',
-                     contenttypes:'[Content_Types].xml',
-                     websettings:'word/webSettings.xml',
-                     wordrelationships:'word/_rels/document.xml.rels'}
-    for tree in treesandfiles:
-        log.info('Saving: '+treesandfiles[tree]    )
-        treestring = etree.tostring(tree, pretty_print=True)
-        docxfile.writestr(treesandfiles[tree],treestring)
-
-    # Add & compress support files
-    files_to_ignore = ['.DS_Store'] # nuisance from some os's
-    for dirpath, dirnames, filenames in os.walk(template):
-        for filename in filenames:
-            if filename in files_to_ignore: continue
-            doc_file = os.path.join(dirpath, filename)
-            archivename = doc_file[len(template)+1:]
-            docxfile.write(doc_file, archivename)
+# Parts which the 'compact' save profile may prune
+prunableparts = {
+    'numbering': 'word/numbering.xml',
+    'styles': 'word/styles.xml',
+    'fonts': 'word/fontTable.xml',
+}
+
+def _findrefs(xml):
+    '''Scan serialized WordprocessingML for the styles, fonts and numbering
+    it refers to. Works on bytes so it doesn't care which prefix the
+    serializer picked for the w namespace.'''
+    styles = set(re.findall(r'<(?:\w+:)?(?:pStyle|rStyle|tblStyle)\s[^>]*?\bval="([^"]*)"', xml))
+    fonts = set()
+    themefonts = False
+    for rfonts in re.findall(r'<(?:\w+:)?rFonts\s[^>]*>', xml):
+        for attr, value in re.findall(r'\b(\w+)="([^"]*)"', rfonts):
+            if attr in ('ascii', 'hAnsi', 'eastAsia', 'cs'):
+                fonts.add(value)
+            elif attr.endswith('Theme') or attr == 'cstheme':
+                themefonts = True
+    numbering = re.search(r'<(?:\w+:)?numPr\b', xml) is not None
+    return styles, fonts, themefonts, numbering
+
+def compactpackage(package, documentxml):
+    '''Shrink a package for the 'compact' save profile, in place.
+
+    Styles and fonts which documentxml (the serialized word/document.xml)
+    doesn't use are pruned, numbering.xml is removed if nothing uses list
+    numbering, and the remaining XML parts lose their indentation.
+    Relationships to removed parts go with them.
+
+    Returns a dict with the part names removed and the number of
+    (uncompressed) bytes saved.'''
+    w = nsprefixes['w']
+    parser = etree.XMLParser(remove_blank_text=True)
+    overrides = {}
+    dropped = []
+    styles, fonts, themefonts, numbering = _findrefs(documentxml)
+
+    def parse(partname):
+        return etree.fromstring(package.get_part(partname).blob(), parser)
+
+    # Styles: keep the defaults, everything referenced, and whatever those
+    # are based on or linked to.
+    stylesroot = parse(prunableparts['styles'])
+    bystyleid = {}
+    keep = set(styles)
+    for style in stylesroot.iterchildren('{%s}style' % w):
+        bystyleid[style.get('{%s}styleId' % w)] = style
+        if style.get('{%s}default' % w) in ('1', 'true', 'on'):
+            keep.add(style.get('{%s}styleId' % w))
+    pending = list(keep)
+    while pending:
+        style = bystyleid.get(pending.pop())
+        if style is None:
+            continue
+        for link in ('basedOn', 'link', 'next'):
+            for el in style.iterchildren('{%s}%s' % (w, link)):
+                target = el.get('{%s}val' % w)
+                if target not in keep:
+                    keep.add(target)
+                    pending.append(target)
+    for styleid, style in bystyleid.items():
+        if styleid not in keep:
+            stylesroot.remove(style)
+    stylesxml = etree.tostring(stylesroot, xml_declaration=True, encoding='UTF-8', standalone=True)
+    overrides[prunableparts['styles']] = stylesxml
+
+    # Numbering and fonts may also be referenced from the styles we kept
+    stylerefs = _findrefs(stylesxml)
+    fonts.update(stylerefs[1])
+    themefonts = themefonts or stylerefs[2]
+    numbering = numbering or stylerefs[3]
+    if not numbering:
+        dropped.append(prunableparts['numbering'])
+
+    if themefonts:
+        for latin in parse('word/theme/theme1.xml').iter('{%s}latin' % nsprefixes['a']):
+            if latin.get('typeface'):
+                fonts.add(latin.get('typeface'))
+    fontroot = parse(prunableparts['fonts'])
+    for font in list(fontroot.iterchildren('{%s}font' % w)):
+        if font.get('{%s}name' % w) not in fonts:
+            fontroot.remove(font)
+    if len(fontroot):
+        overrides[prunableparts['fonts']] = etree.tostring(fontroot, xml_declaration=True, encoding='UTF-8', standalone=True)
+    else:
+        dropped.append(prunableparts['fonts'])
+
+    saved = 0
+    for partname in dropped:
+        saved += len(package.get_part(partname).blob())
+        package.remove_part(partname)
+    for part in package:
+        if part.partname in overrides:
+            data = overrides[part.partname]
+        elif part.element is None and part.partname.endswith('.xml'):
+            # Everything else we ship gets its indentation stripped
+            data = etree.tostring(etree.fromstring(part.blob(), parser), xml_declaration=True, encoding='UTF-8', standalone=True)
+        else:
+            continue
+        saved += len(part.blob()) - len(data)
+        part.element, part.data, part.path = None, data, None
+    log.info('Compact profile removed %s, saving %d bytes', dropped, saved)
+    return {'removed': dropped, 'bytes_saved': saved}
+
+def writedocx(package, document, relationships, output, profile='default',
+              contenttypes=None, timestamp=None, **trees):
+    '''Add the document, its relationships and the properties parts to a
+    package of template parts, and write it to output. The coreprops,
+    appprops and websettings trees may be given. See savedocx().'''
+    if profile not in ('default', 'compact'):
+        raise ValueError('Unknown save profile "%s". Valid profiles: default, compact.' % profile)
+    # Fresh trees for every save, rather than sharing them between documents
+    coreprops = trees.get('coreprops')
+    if coreprops is None:
+        coreprops = coreproperties(timestamp=timestamp)
+    appprops = trees.get('appprops')
+    if appprops is None:
+        appprops = appproperties()
+    web = trees.get('websettings')
+    if web is None:
+        web = websettings()
+    if profile == 'compact' and isinstance(document, etree._Element):
+        document = etree.tostring(document)
+    if isinstance(document, etree._Element):
+        documentpart = opc.Part('word/document.xml', partcontenttypes['word/document.xml'], element=document)
+    else:
+        # Already serialized, e.g. a compact document body
+        documentpart = opc.Part('word/document.xml', partcontenttypes['word/document.xml'], data=document)
+    documentpart.rels = relationships
+    package.add_part(documentpart)
+    # Pictures added with picture()
+    package.add_files('word/document.xml', relationships, 'word/media')
+    # In this order, so that the parts are always written in the same order
+    treesandfiles = [(coreprops, 'docProps/core.xml'),
+                     (appprops, 'docProps/app.xml'),
+                     (web, 'word/webSettings.xml')]
+    for tree, partname in treesandfiles:
+        package.add_part(opc.Part(partname, partcontenttypes[partname], element=tree))
+
+    report = None
+    if profile == 'compact':
+        report = compactpackage(package, document)
+        if contenttypes is not None:
+            # Don't touch the caller's tree, take a copy
+            contenttypes = copy.deepcopy(contenttypes)
+            for override in list(contenttypes):
+                if override.get('PartName', '')[1:] in report['removed']:
+                    contenttypes.remove(override)
+    package.save(output, pretty_print=profile != 'compact', contenttypes=contenttypes,
+                 timestamp=timestamp)
     log.info('Saved new file to: %r', output)
-    docxfile.close()
-    return
+    return report
+
+def savedocx(document, output, wordrelationships, coreprops=None,
+                appprops=None,contenttypes=None,
+                websettings=None,
+                template=template_dir, profile='default', timestamp=None):
+    '''Save a modified document. `document` may be an element tree or the
+    already serialized word/document.xml; wordrelationships is a tree as
+    made by wordrelationships(). The parts in the template directory are
+    added as they are. Content types are derived from the parts, unless a
+    contenttypes tree is given.
+
+    With profile='compact', XML is written without indentation and the
+    numbering, styles and fonts the document doesn't use are pruned (see
+    compactpackage()); a dict is returned with the list of parts removed and
+    the number of (uncompressed) bytes saved.
+
+    If a timestamp (a datetime, or seconds since the epoch) is given, it is
+    used for the zip entries and the default core properties, so that the
+    same document always gives the same bytes.'''
+    assert os.path.isdir(template)
+    package = opc.Package.fromdir(template, partcontenttypes, cache=template == template_dir)
+    relationships = opc.Relationships()
+    for relationship in wordrelationships:
+        relationships.add(relationship.get('Type'), relationship.get('Target'), relationship.get('Id'))
+    return writedocx(package, document, relationships, output, profile, contenttypes, timestamp,
+                     coreprops=coreprops, appprops=appprops, websettings=websettings)
 
 
@@ -0,0 +1,136 @@
+'''
+Extract the text of every .docx and .pptx file under a directory, on a
+pool of processes.
+
+    python -m openxml.extract DIR [--workers N] [--format jsonl|text]
+                                  [--unordered] [--output FILE]
+
+Each file gives one line of output. With --format jsonl (the default) it is
+a JSON object with the path, size, seconds taken and text: a list of
+paragraphs for a .docx, a list of each slide's texts for a .pptx. With
+--format text it is the path and the text, tab-separated. Lines come in the
+order of the files, or as soon as each is done with --unordered.
+
+Files which can't be read are logged and skipped. Bytes in a path which
+aren't valid in the file system encoding come out as U+FFFD. A summary, with files/sec
+and MB/sec, is logged at the end.
+'''
+
+import os
+import sys
+import time
+import json
+import logging
+import optparse
+import multiprocessing
+import docx
+import pptx
+
+log = logging.getLogger(__name__)
+
+extensions = ('.docx', '.pptx')
+
+def findfiles(directory):
+    '''Yield the paths of the .docx and .pptx files under directory, in a
+    stable order.'''
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            # ~$ files are Office's lock files
+            if filename.lower().endswith(extensions) and not filename.startswith('~$'):
+                yield os.path.join(dirpath, filename)
+
+def pathtext(path):
+    '''Return a path as text for the output.'''
+    if isinstance(path, unicode):
+        return path
+    return path.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+
+def extractfile(path):
+    '''Return (path, record, error) for one file: the record to output, or
+    None and a description of what went wrong.'''
+    start = time.time()
+    try:
+        size = os.path.getsize(path)
+        if path.lower().endswith('.docx'):
+            text = list(docx.iterdocumenttext(path))
+        else:
+            deck = pptx.open(path)
+            try:
+                text = [texts for number, texts, pictures in deck.iterslides()]
+            finally:
+                deck.close()
+    except Exception as e:
+        return path, None, '%s: %s' % (e.__class__.__name__, e)
+    record = {'path': pathtext(path), 'size': size, 'seconds': round(time.time() - start, 6), 'text': text}
+    return path, record, None
+
+def formatrecord(record, format):
+    if format == 'jsonl':
+        return json.dumps(record)
+    if record['path'].lower().endswith('.pptx'):
+        text = u' '.join([u' '.join(texts) for texts in record['text']])
+    else:
+        text = u' '.join(record['text'])
+    # Keep one file to a line
+    text = u' '.join(text.split())
+    return (u'%s\t%s' % (record['path'], text)).encode('utf-8')
+
+def run(directory, output, workers=None, format='jsonl', ordered=True, chunksize=8):
+    '''Extract the text of the files under directory, writing a line per
+    file to output. Returns (files, errors, bytes, seconds).'''
+    start = time.time()
+    files = errors = size = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        if ordered:
+            results = pool.imap(extractfile, findfiles(directory), chunksize)
+        else:
+            results = pool.imap_unordered(extractfile, findfiles(directory), chunksize)
+        for path, record, error in results:
+            if error is not None:
+                errors += 1
+                log.warning('Skipped %s: %s', path, error)
+                continue
+            files += 1
+            size += record['size']
+            output.write(formatrecord(record, format))
+            output.write('\n')
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return files, errors, size, time.time() - start
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='python -m openxml.extract DIR [options]')
+    parser.add_option('-w', '--workers', type='int', default=None,
+                      help='number of worker processes (default: one per CPU)')
+    parser.add_option('-f', '--format', choices=['jsonl', 'text'], default='jsonl',
+                      help='output format: jsonl (default) or text')
+    parser.add_option('-u', '--unordered', action='store_true', default=False,
+                      help='write each file as soon as it is done')
+    parser.add_option('-o', '--output', default=None,
+                      help='file to write to (default: standard output)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        parser.error('give one directory to extract from')
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    output = sys.stdout
+    if options.output:
+        output = open(options.output, 'wb')
+    try:
+        files, errors, size, seconds = run(args[0], output, options.workers, options.format,
+                                           not options.unordered)
+    finally:
+        if options.output:
+            output.close()
+    seconds = max(seconds, 1e-6)
+    log.info('%d files (%d skipped), %.1f MB in %.2fs: %.1f files/sec, %.2f MB/sec',
+             files, errors, size / 1e6, seconds, files / seconds, size / 1e6 / seconds)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
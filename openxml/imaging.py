@@ -0,0 +1,129 @@
+'''
+Downscaling and recompression of pictures as they are added.
+
+An ImagePolicy works out, from the size a picture is displayed at and a
+target resolution, how many pixels it needs, and re-encodes pictures which
+have more (JPEG at the given quality, PNG optimized). The work is done on a
+pool of threads shared by the process, so that the pictures of a document
+are processed in parallel while it is built; saving waits for them.
+Results are kept in mediacache, so a picture is only processed once per
+policy and displayed size. A picture shown at several sizes is prepared
+for the largest of them.
+
+    >>> d = Document.create(image_policy=ImagePolicy(dpi=150))
+'''
+
+import threading
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+import mediacache
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+# Number of threads in the pool, or None for one per CPU
+workers = None
+_pool = []
+_poollock = threading.Lock()
+
+# English Metric Units per inch
+emuperinch = 914400
+
+_resample = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+# The transposes which undo each EXIF orientation
+_orientations = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.TRANSPOSE],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_90, Image.FLIP_LEFT_RIGHT],
+    8: [Image.ROTATE_90],
+}
+
+def upright(image):
+    '''Return image turned the way its EXIF orientation says it is shown,
+    as re-encoding it leaves the EXIF behind.'''
+    for method in _orientations.get(mediacache.orientation(image), []):
+        image = image.transpose(method)
+    return image
+
+def pool():
+    '''Return the process-wide thread pool, starting it if need be.'''
+    if not _pool:
+        with _poollock:
+            # Another thread may have started it while we waited
+            if not _pool:
+                _pool.append(ThreadPool(workers))
+    return _pool[0]
+
+class ImagePolicy(object):
+    '''How to prepare pictures for a document: at most dpi pixels per inch
+    of displayed size, and no more than max_size (width, height) pixels if
+    that is given. JPEGs are written at jpeg_quality; PNGs are optimized if
+    optimize_png is set. Pictures are never scaled up, and are kept as they
+    are if re-encoding doesn't make them smaller.'''
+
+    def __init__(self, dpi=150, max_size=None, jpeg_quality=85, optimize_png=True):
+        self.dpi = dpi
+        self.max_size = max_size
+        self.jpeg_quality = jpeg_quality
+        self.optimize_png = optimize_png
+
+    def targetsize(self, size, extent):
+        '''Return the pixel size for a picture of size pixels displayed at
+        extent (width, height in EMUs), or None if it is small enough.'''
+        width, height = size
+        ratio = 1.0
+        if self.dpi:
+            ratio = min(ratio, float(extent[0]) * self.dpi / emuperinch / width,
+                        float(extent[1]) * self.dpi / emuperinch / height)
+        if self.max_size:
+            ratio = min(ratio, float(self.max_size[0]) / width,
+                        float(self.max_size[1]) / height)
+        if ratio >= 1:
+            return None
+        return max(1, int(round(width * ratio))), max(1, int(round(height * ratio)))
+
+    def process(self, data, extent):
+        '''Return the prepared picture for data (the bytes of a picture
+        displayed at extent), or None to keep it as it is.'''
+        image = Image.open(StringIO(data))
+        format = image.format
+        if format not in ('JPEG', 'PNG'):
+            return None
+        if format == 'JPEG':
+            image = upright(image)
+        size = self.targetsize(image.size, extent)
+        if size is not None:
+            image = image.resize(size, _resample)
+        out = StringIO()
+        if format == 'JPEG':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            image.save(out, 'JPEG', quality=self.jpeg_quality, optimize=True)
+        else:
+            image.save(out, 'PNG', optimize=self.optimize_png)
+        result = out.getvalue()
+        if len(result) >= len(data):
+            return None
+        return result
+
+    def submit(self, blob, extent):
+        '''Start preparing a media.Blob on the pool; returns an AsyncResult
+        whose get() gives the prepared bytes, or None.'''
+        return pool().apply_async(_process, (self, blob, extent))
+
+def _process(policy, blob, extent):
+    # mediacache.size() is the size once upright, which process() works on
+    key = (mediacache.digest(blob), policy.targetsize(mediacache.size(blob), extent),
+           policy.jpeg_quality, policy.optimize_png)
+    value = mediacache.get(key, _MISSING)
+    if value is _MISSING:
+        value = policy.process(blob.read(), extent)
+        mediacache.put(key, value)
+    return value
+
+_MISSING = object()
@@ -0,0 +1,304 @@
+'''
+Find out what makes a .docx, .pptx or .xlsx file big or slow to open.
+
+    python -m openxml.inspector FILE [--json] [--top N] [--max-size BYTES]
+
+reports:
+
+- the compressed and uncompressed size, and compression ratio, of each part
+- the number of elements in each XML part
+- media parts with the same content (by SHA-1), and the bytes they waste
+- relationships which their part never refers to, relationships to parts
+  which aren't there, and parts which no relationship leads to
+- run fragmentation: adjacent text runs with the same formatting, which
+  could be one run (see docx.normalize())
+
+With --json the report is a JSON object instead, for scripts and CI; with
+--max-size the exit status is 1 if the file is bigger than BYTES.
+
+(It isn't called inspect: with the package's implicit relative imports, that
+would hide the standard library module of the same name.)
+'''
+
+import os
+import sys
+import copy
+import json
+import hashlib
+import optparse
+import zipfile
+import posixpath
+from lxml import etree
+from namespaces import nsprefixes
+import opc
+
+# Relationship types (the last part of them) which the source part must
+# refer to by id; the others (styles, themes, layouts...) are implied
+referencedtypes = set(['image', 'chart', 'hyperlink', 'oleObject', 'package', 'slide',
+                       'slideMaster', 'notesMaster', 'handoutMaster', 'header', 'footer',
+                       'video', 'audio', 'media', 'worksheet', 'diagramData',
+                       'diagramLayout', 'diagramQuickStyle', 'diagramColors'])
+
+# (source part type, relationship type) pairs which are implied even so: a
+# layout belongs to its master, and notes to their slide and notes master
+impliedtypes = set([('slideLayout', 'slideMaster'), ('notesSlide', 'slide'),
+                    ('notesSlide', 'notesMaster')])
+
+# (run, run properties, text) tags for run fragmentation
+_runtags = [('{%s}%s' % (nsprefixes[ns], 'r'), '{%s}%s' % (nsprefixes[ns], 'rPr'),
+             '{%s}%s' % (nsprefixes[ns], 't')) for ns in ('w', 'a')]
+
+def _ratio(uncompressed, compressed):
+    if not compressed:
+        return None
+    return round(float(uncompressed) / compressed, 2)
+
+def _parttype(contenttype):
+    '''Return the short type of a part from its content type, e.g.
+    'slideLayout' for ...presentationml.slideLayout+xml.'''
+    return (contenttype or '').rsplit('.', 1)[-1].split('+')[0]
+
+def _source(relsname):
+    '''Return the part name a .rels part belongs to ('' for the package).'''
+    directory, filename = posixpath.split(relsname)
+    return posixpath.join(posixpath.dirname(directory), filename[:-len('.rels')])
+
+def _runkey(run, props):
+    '''Return what a run's formatting is compared by, leaving out revision
+    ids (rsid* attributes) as docx.normalize() does.'''
+    attrs = sorted((k, v) for k, v in run.attrib.items() if 'rsid' not in k)
+    if not props:
+        return attrs, None
+    props = props[0]
+    if any('rsid' in key for element in props.iter() for key in element.attrib):
+        props = copy.deepcopy(props)
+        for element in props.iter():
+            for key in [key for key in element.attrib if 'rsid' in key]:
+                del element.attrib[key]
+    return attrs, etree.tostring(props, method='c14n')
+
+def _mergeable(tree, run, rpr, text):
+    '''Return (runs, mergeable): the number of runs, and of runs with just
+    text and the same formatting as the run before them.'''
+    runs = mergeable = 0
+    for element in tree.iter(run):
+        runs += 1
+        previous = element.getprevious()
+        if previous is None or previous.tag != run:
+            continue
+        keys = []
+        for r in (previous, element):
+            children = list(r)
+            props = [child for child in children if child.tag == rpr]
+            if len(children) - len(props) != 1 or children[-1].tag != text:
+                break
+            keys.append(_runkey(r, props))
+        if len(keys) == 2 and keys[0] == keys[1]:
+            mergeable += 1
+    return runs, mergeable
+
+def inspectpackage(file):
+    '''Return the report for a package (a filename or file-like object) as
+    a dict; see the module docstring.'''
+    # Parsers can't be shared between threads: make one per call
+    parser = etree.XMLParser(resolve_entities=False, huge_tree=True)
+    zf = zipfile.ZipFile(file)
+    try:
+        infos = dict((info.filename, info) for info in zf.infolist())
+        contenttypes = {}
+        defaults = {}
+        if '[Content_Types].xml' in infos:
+            for el in etree.fromstring(zf.read('[Content_Types].xml'), parser):
+                if el.tag == '{%s}Override' % nsprefixes['ct']:
+                    contenttypes[el.get('PartName', '').lstrip('/')] = el.get('ContentType')
+                elif el.tag == '{%s}Default' % nsprefixes['ct']:
+                    defaults[el.get('Extension', '').lower()] = el.get('ContentType')
+        parts = []
+        # Only the relationship parts are kept, and of the other XML parts
+        # the ids they refer to relationships by
+        rels = {}
+        referencedids = {}
+        rtag = '{%s}' % nsprefixes['r']
+        digests = {}
+        fragmentation = []
+        for info in zf.infolist():
+            name = info.filename
+            if name.endswith('/'):
+                continue
+            data = zf.read(name)
+            part = {'name': name, 'compressed': info.compress_size,
+                    'uncompressed': info.file_size,
+                    'ratio': _ratio(info.file_size, info.compress_size),
+                    'stored': info.compress_type == zipfile.ZIP_STORED,
+                    'content_type': contenttypes.get(name, defaults.get(opc.extension(name))),
+                    'elements': None}
+            if name.endswith(('.xml', '.rels')) or name == '[Content_Types].xml':
+                try:
+                    tree = etree.fromstring(data, parser)
+                except etree.XMLSyntaxError:
+                    part['error'] = 'not well-formed XML'
+                else:
+                    part['elements'] = 0
+                    ids = set()
+                    for element in tree.iter():
+                        part['elements'] += 1
+                        for key, value in element.attrib.items():
+                            if key.startswith(rtag) or key.endswith('}relid'):
+                                ids.add(value)
+                    if name.endswith('.rels'):
+                        rels[name] = tree
+                    else:
+                        referencedids[name] = ids
+                    for run, rpr, text in _runtags:
+                        runs, mergeable = _mergeable(tree, run, rpr, text)
+                        if runs:
+                            fragmentation.append({'part': name, 'runs': runs,
+                                                  'mergeable': mergeable})
+            else:
+                digests.setdefault(hashlib.sha1(data).hexdigest(), []).append(name)
+            parts.append(part)
+
+        duplicates = []
+        for digest, names in sorted(digests.items()):
+            if len(names) > 1:
+                size = infos[names[0]].file_size
+                duplicates.append({'sha1': digest, 'size': size, 'parts': sorted(names),
+                                   'wasted': size * (len(names) - 1)})
+
+        # Relationships: unused ones, missing targets, and unreachable parts
+        unused = []
+        missing = []
+        reltargets = {}
+        for name in sorted(rels):
+            source = _source(name)
+            referenced = referencedids.get(source)
+            sourcetype = _parttype(contenttypes.get(source, defaults.get(opc.extension(source))))
+            targets = reltargets.setdefault(source, [])
+            for rel in rels[name]:
+                if rel.tag != '{%s}Relationship' % nsprefixes['pr']:
+                    continue
+                entry = {'source': source, 'id': rel.get('Id'), 'type': rel.get('Type'),
+                         'target': rel.get('Target')}
+                reltype = (entry['type'] or '').rsplit('/', 1)[-1]
+                if (referenced is not None and reltype in referencedtypes and
+                        (sourcetype, reltype) not in impliedtypes and
+                        entry['id'] not in referenced):
+                    unused.append(entry)
+                if rel.get('TargetMode') == 'External':
+                    continue
+                target = entry['target'] or ''
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = opc.resolve(source, target)
+                if target not in infos:
+                    missing.append(entry)
+                targets.append(target)
+        reached = set()
+        pending = ['']
+        while pending:
+            for target in reltargets.get(pending.pop(), []):
+                if target not in reached:
+                    reached.add(target)
+                    pending.append(target)
+        unreferenced = sorted([part['name'] for part in parts
+                               if part['name'] not in reached
+                               and part['name'] != '[Content_Types].xml'
+                               and not part['name'].endswith('.rels')])
+    finally:
+        zf.close()
+
+    if isinstance(file, basestring):
+        size = os.path.getsize(file)
+    else:
+        size = sum([part['compressed'] for part in parts])
+    compressed = sum([part['compressed'] for part in parts])
+    uncompressed = sum([part['uncompressed'] for part in parts])
+    return {'file': file if isinstance(file, basestring) else None,
+            'size': size, 'compressed': compressed, 'uncompressed': uncompressed,
+            'ratio': _ratio(uncompressed, compressed),
+            'parts': sorted(parts, key=lambda part: (-part['compressed'], part['name'])),
+            'duplicate_media': duplicates,
+            'wasted_bytes': sum([duplicate['wasted'] for duplicate in duplicates]),
+            'unused_relationships': unused,
+            'missing_targets': missing,
+            'unreferenced_parts': unreferenced,
+            'run_fragmentation': fragmentation,
+            'mergeable_runs': sum([entry['mergeable'] for entry in fragmentation])}
+
+def formatreport(report, top=20):
+    '''Return the report as text, showing the top biggest parts.'''
+    lines = []
+    lines.append('%s: %d bytes, %d parts, %d bytes uncompressed (ratio %s)' % (
+        report['file'] or 'package', report['size'], len(report['parts']),
+        report['uncompressed'], report['ratio']))
+    lines.append('')
+    lines.append('%12s %12s %6s %9s  %s' % ('compressed', 'uncompressed', 'ratio', 'elements',
+                                             'part'))
+    for part in report['parts'][:top]:
+        lines.append('%12d %12d %6s %9s  %s%s' % (
+            part['compressed'], part['uncompressed'], part['ratio'] or '-',
+            part['elements'] if part['elements'] is not None else '-', part['name'],
+            ' (stored)' if part['stored'] else ''))
+    if len(report['parts']) > top:
+        rest = report['parts'][top:]
+        lines.append('%12d %12d %6s %9s  ... %d more parts' % (
+            sum([part['compressed'] for part in rest]),
+            sum([part['uncompressed'] for part in rest]), '', '', len(rest)))
+    if report['duplicate_media']:
+        lines.append('')
+        lines.append('Duplicate media (%d bytes wasted):' % report['wasted_bytes'])
+        for duplicate in report['duplicate_media']:
+            lines.append('  %d bytes x %d: %s' % (duplicate['size'], len(duplicate['parts']),
+                                                 ', '.join(duplicate['parts'])))
+    for key, title in (('unused_relationships', 'Relationships never referred to'),
+                       ('missing_targets', 'Relationships to missing parts')):
+        if report[key]:
+            lines.append('')
+            lines.append('%s:' % title)
+            for entry in report[key]:
+                reltype = (entry['type'] or 'no type').rsplit('/', 1)[-1]
+                lines.append('  %s %s -> %s (%s)' % (entry['source'] or '(package)', entry['id'],
+                                                    entry['target'], reltype))
+    if report['unreferenced_parts']:
+        lines.append('')
+        lines.append('Parts no relationship leads to:')
+        for name in report['unreferenced_parts']:
+            lines.append('  %s' % name)
+    fragmented = [entry for entry in report['run_fragmentation'] if entry['mergeable']]
+    if fragmented:
+        lines.append('')
+        lines.append('Run fragmentation (%d runs could be merged with the one before):'
+                     % report['mergeable_runs'])
+        for entry in sorted(fragmented, key=lambda entry: -entry['mergeable'])[:top]:
+            lines.append('  %s: %d of %d runs' % (entry['part'], entry['mergeable'], entry['runs']))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='python -m openxml.inspector FILE [options]')
+    parser.add_option('-j', '--json', action='store_true', default=False,
+                      help='write the report as JSON')
+    parser.add_option('-t', '--top', type='int', default=20,
+                      help='number of parts to list (default: 20)')
+    parser.add_option('--max-size', type='int', default=None,
+                      help='exit with status 1 if the file is bigger than this many bytes')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('give one file to inspect')
+    try:
+        report = inspectpackage(args[0])
+    except (IOError, zipfile.BadZipfile) as e:
+        sys.stderr.write('%s: %s\n' % (args[0], e))
+        return 2
+    if options.json:
+        sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
+    else:
+        sys.stdout.write(formatreport(report, options.top).encode('utf-8') + '\n')
+    if options.max_size is not None and report['size'] > options.max_size:
+        sys.stderr.write('%s is %d bytes, over the limit of %d\n'
+                         % (args[0], report['size'], options.max_size))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
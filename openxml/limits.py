@@ -0,0 +1,262 @@
+'''
+Ceilings on the work done reading a package, for files which can't be
+trusted (uploads, say) and which might otherwise take over a worker's
+memory and CPU: zip bombs, parts of several GB, or XML nested or repeated
+without end.
+
+    >>> document = docx.opendocx(upload, limits=Limits(max_part_size=50 << 20))
+    >>> deck = pptx.open(upload, limits=Limits())
+
+Every limit is enforced as the data streams in, so reading stops as soon as
+one is passed, with a LimitExceeded (a ValueError) saying which:
+
+    max_part_size   bytes decompressed from one part
+    max_total_size  bytes decompressed from the whole package, counting
+                    each time a part is read
+    max_ratio       decompressed bytes per compressed byte of a part, once
+                    more than ratio_floor bytes have come out of it
+    max_depth       nesting of XML elements
+    max_elements    XML elements in one part
+    max_pixels      width times height of a picture, checked from its
+                    header before it is decoded
+
+The sizes written in the zip are checked before anything is decompressed,
+but aren't relied on, as they can't be trusted either. A limit of None
+isn't enforced. XML is parsed without loading DTDs, expanding entities or
+using the network.
+'''
+
+import zipfile
+from StringIO import StringIO
+from lxml import etree
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+# Bytes to read at a time when a whole part is asked for
+CHUNK = 1 << 16
+
+# Most that is read of a picture to find its size (leaving room for EXIF)
+HEADER = 1 << 20
+
+# Newer PILs refuse enormous pictures themselves
+_bombs = tuple([e for e in [getattr(Image, 'DecompressionBombError', None)] if e])
+
+class LimitExceeded(ValueError):
+    '''A package went over one of its Limits. limit is the name of the
+    limit, e.g. 'max_part_size'.'''
+
+    def __init__(self, limit, message):
+        ValueError.__init__(self, message)
+        self.limit = limit
+
+class Limits(object):
+    '''Ceilings for reading a package; see the module docstring. The
+    defaults leave room for any ordinary document.'''
+
+    def __init__(self, max_part_size=256 << 20, max_total_size=1 << 30, max_ratio=100,
+                 max_depth=256, max_elements=10000000, max_pixels=100000000,
+                 ratio_floor=1 << 20):
+        self.max_part_size = max_part_size
+        self.max_total_size = max_total_size
+        self.max_ratio = max_ratio
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_pixels = max_pixels
+        # Small parts of repetitive XML compress far better than max_ratio
+        # quite innocently
+        self.ratio_floor = ratio_floor
+
+    def iterparse(self, source, tag=None):
+        '''Parse XML from a file-like object incrementally, as
+        etree.iterparse() does, yielding (event, element) at the end of each
+        element (with a tag in tag, if that is given).'''
+        if isinstance(tag, basestring):
+            tag = (tag,)
+        tags = None if tag is None else set(tag)
+        depth = count = 0
+        for event, element in etree.iterparse(source, events=('start', 'end'),
+                                              resolve_entities=False, load_dtd=False,
+                                              no_network=True, huge_tree=False):
+            if event == 'start':
+                depth += 1
+                count += 1
+                if self.max_depth is not None and depth > self.max_depth:
+                    raise LimitExceeded('max_depth', 'XML is nested more than %d elements deep'
+                                        % self.max_depth)
+                if self.max_elements is not None and count > self.max_elements:
+                    raise LimitExceeded('max_elements', 'XML has more than %d elements'
+                                        % self.max_elements)
+            else:
+                depth -= 1
+                if tags is None or element.tag in tags:
+                    yield event, element
+
+    def parse(self, source):
+        '''Parse XML from a file-like object or byte string; return the root
+        element.'''
+        if isinstance(source, str):
+            source = StringIO(source)
+        root = None
+        for event, element in self.iterparse(source):
+            root = element
+        return root
+
+    def imagesize(self, data):
+        '''Return the (width, height) of a picture (bytes or a file-like
+        object), reading no more than its header.'''
+        if isinstance(data, str):
+            data = StringIO(data)
+        try:
+            size = Image.open(data).size
+        except _bombs as e:
+            raise LimitExceeded('max_pixels', str(e))
+        if self.max_pixels is not None and size[0] * size[1] > self.max_pixels:
+            raise LimitExceeded('max_pixels', 'A %d x %d picture has more than %d pixels'
+                                % (size[0], size[1], self.max_pixels))
+        return size
+
+class LimitedEntry(object):
+    '''A part of a LimitedZipFile being read, which counts what comes out
+    of it against the limits.'''
+
+    def __init__(self, zipped, info):
+        self.zipped = zipped
+        self.name = info.filename
+        self.compressed = info.compress_size
+        self.size = 0
+        self._source = zipped.zip.open(info)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            pieces = []
+            while True:
+                data = self.read(CHUNK)
+                if not data:
+                    return ''.join(pieces)
+                pieces.append(data)
+        data = self._source.read(size)
+        self._count(len(data))
+        return data
+
+    def _count(self, n):
+        limits = self.zipped.limits
+        self.size += n
+        if limits.max_part_size is not None and self.size > limits.max_part_size:
+            raise LimitExceeded('max_part_size', '%s decompresses to more than %d bytes'
+                                % (self.name, limits.max_part_size))
+        if (limits.max_ratio is not None and self.size > limits.ratio_floor
+                and self.size > limits.max_ratio * max(self.compressed, 1)):
+            raise LimitExceeded('max_ratio', '%s decompresses to more than %d times its size'
+                                % (self.name, limits.max_ratio))
+        self.zipped.add(n)
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class LimitedZipFile(object):
+    '''A package opened for reading within limits: like a read-only
+    zipfile.ZipFile, whose open() and read() count what they decompress,
+    with parse() and iterparse() for XML parts and imagesize() for
+    pictures.'''
+
+    def __init__(self, file, limits=None):
+        self.limits = limits or Limits()
+        self.zip = zipfile.ZipFile(file)
+        self.total = 0
+        try:
+            declared = 0
+            for info in self.zip.infolist():
+                # What the zip claims: a bomb which admits to it fails here
+                self._check(info, info.file_size)
+                declared += info.file_size
+            self._checktotal(declared)
+        except:
+            self.zip.close()
+            raise
+
+    def _check(self, info, size):
+        limits = self.limits
+        if limits.max_part_size is not None and size > limits.max_part_size:
+            raise LimitExceeded('max_part_size', '%s decompresses to more than %d bytes'
+                                % (info.filename, limits.max_part_size))
+        if (limits.max_ratio is not None and size > limits.ratio_floor
+                and size > limits.max_ratio * max(info.compress_size, 1)):
+            raise LimitExceeded('max_ratio', '%s decompresses to more than %d times its size'
+                                % (info.filename, limits.max_ratio))
+
+    def _checktotal(self, total):
+        if self.limits.max_total_size is not None and total > self.limits.max_total_size:
+            raise LimitExceeded('max_total_size', 'The package decompresses to more than %d bytes'
+                                % self.limits.max_total_size)
+
+    def add(self, n):
+        '''Count n more bytes decompressed from the package.'''
+        self.total += n
+        self._checktotal(self.total)
+
+    def namelist(self):
+        return self.zip.namelist()
+
+    def infolist(self):
+        return self.zip.infolist()
+
+    def getinfo(self, name):
+        return self.zip.getinfo(name)
+
+    def open(self, name):
+        '''Return a LimitedEntry for reading a part.'''
+        return LimitedEntry(self, self.zip.getinfo(name))
+
+    def read(self, name):
+        '''Return the content of a part.'''
+        entry = self.open(name)
+        try:
+            return entry.read()
+        finally:
+            entry.close()
+
+    def parse(self, name):
+        '''Parse an XML part; return its root element.'''
+        entry = self.open(name)
+        try:
+            return self.limits.parse(entry)
+        finally:
+            entry.close()
+
+    def iterparse(self, name, tag=None):
+        '''Parse an XML part incrementally; see Limits.iterparse().'''
+        entry = self.open(name)
+        try:
+            for event, element in self.limits.iterparse(entry, tag):
+                yield event, element
+        finally:
+            entry.close()
+
+    def imagesize(self, name):
+        '''Return the (width, height) of a picture part, decompressing no
+        more of it than its header.'''
+        entry = self.open(name)
+        try:
+            # PIL wants to seek, so give it the start of the picture
+            return self.limits.imagesize(StringIO(entry.read(HEADER)))
+        finally:
+            entry.close()
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
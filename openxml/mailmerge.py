@@ -0,0 +1,165 @@
+'''
+Compile a .docx template once, then render it for many records.
+
+    >>> from openxml.mailmerge import compiletemplate
+    >>> t = compiletemplate('letter.docx')
+    >>> t.slots
+    ['name', 'address']
+    >>> t.render({'name': 'Tom', 'address': 'London'}, 'tom.docx')
+
+compiletemplate() finds the placeholders in word/document.xml, including
+placeholders which Word has split over several runs, and serializes the
+document once as a list of static byte segments with slots in between.
+Rendering escapes the values and joins the segments; the other parts of the
+package are compressed once at compile time and copied as they are. No lxml
+work happens per record.
+'''
+
+import re
+import zipfile
+import zlib
+import bisect
+from lxml import etree
+from namespaces import nsprefixes
+from compact import escape
+import opc
+
+# Private use characters, which a real document is very unlikely to contain
+_SENTINEL = u'\ue000%d\ue001'
+_sentinelre = re.compile(u'\ue000(\\d+)\ue001'.encode('utf-8'))
+
+def _paragraphslots(paragraph, searchre, names):
+    '''Rewrite the text elements of a paragraph so that every placeholder is
+    replaced by a sentinel in the text element where it starts.'''
+    w = nsprefixes['w']
+    texts = [t for t in paragraph.iter('{%s}t' % w)]
+    if not texts:
+        return
+    starts = []
+    pos = 0
+    for t in texts:
+        starts.append(pos)
+        pos += len(t.text or u'')
+    joined = u''.join([t.text or u'' for t in texts])
+    matches = list(searchre.finditer(joined))
+    if not matches:
+        return
+    pieces = [[] for t in texts]
+
+    def emit(start, end):
+        # Hand out joined[start:end] to the text elements it came from
+        while start < end:
+            i = bisect.bisect_right(starts, start) - 1
+            stop = min(end, starts[i + 1]) if i + 1 < len(starts) else end
+            pieces[i].append(joined[start:stop])
+            start = stop
+
+    pos = 0
+    for match in matches:
+        emit(pos, match.start())
+        i = bisect.bisect_right(starts, match.start()) - 1
+        if searchre.groups:
+            name = match.group(1)
+        else:
+            name = match.group()
+        pieces[i].append(_SENTINEL % len(names))
+        names.append(name)
+        texts[i].set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+        pos = match.end()
+    emit(pos, len(joined))
+    for t, piece in zip(texts, pieces):
+        t.text = u''.join(piece)
+
+def _deflate(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def _writedeflated(zf, zinfo, compressed):
+    '''Add an entry whose data has already been deflated to an open ZipFile,
+    as ZipFile.writestr() would have written it.'''
+    size, crc, compress_size, data = compressed
+    entry = opc.ZipEntryWriter(zf, zinfo.filename, zipfile.ZIP_DEFLATED, size, zinfo.date_time)
+    entry.writecompressed(data, size, crc)
+    entry.close()
+
+class CompiledTemplate(object):
+    '''A docx template split into static segments and named slots. See
+    compiletemplate().'''
+
+    def __init__(self, segments, slots, parts):
+        self.segments = segments
+        self.slots = slots
+        self.parts = parts
+
+    def documentxml(self, values, default=None):
+        '''Return word/document.xml for one record. values maps slot names
+        to text (or to numbers and other values, which are turned into text
+        with unicode()); slots without a value get `default`, or raise
+        KeyError if that isn't set.'''
+        segments = self.segments
+        out = [segments[0]]
+        for i, name in enumerate(self.slots):
+            try:
+                value = values[name]
+            except KeyError:
+                if default is None:
+                    raise
+                value = default
+            if not isinstance(value, basestring):
+                value = unicode(value)
+            out.append(escape(value))
+            out.append(segments[i + 1])
+        return ''.join(out)
+
+    def render(self, values, output, default=None):
+        '''Write the document for one record to output (a filename or a
+        file-like object).'''
+        documentxml = self.documentxml(values, default)
+        docxfile = zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED,
+                                   allowZip64=True)
+        for zinfo, compressed in self.parts:
+            if compressed is None:
+                # With the template's timestamp, like the other parts, so
+                # that the same record always gives the same bytes
+                info = zipfile.ZipInfo(zinfo.filename, zinfo.date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o600 << 16
+                docxfile.writestr(info, documentxml)
+            else:
+                _writedeflated(docxfile, zinfo, compressed)
+        docxfile.close()
+        return
+
+def compiletemplate(file, search=r'\{\{\s*(\w+)\s*\}\}'):
+    '''Compile a docx template (a filename or file-like object).
+
+    search is the regular expression matching a placeholder; if it has a
+    group, the group is the slot name, otherwise the whole match is.
+    Placeholders may be split over any number of runs, as long as they
+    don't cross a paragraph.
+
+    @return CompiledTemplate'''
+    w = nsprefixes['w']
+    searchre = re.compile(search)
+    source = zipfile.ZipFile(file)
+    document = etree.fromstring(source.read('word/document.xml'))
+    names = []
+    for paragraph in document.iter('{%s}p' % w):
+        _paragraphslots(paragraph, searchre, names)
+    documentxml = etree.tostring(document, xml_declaration=True, encoding='UTF-8', standalone=True)
+    # Split on the sentinels: the odd entries are slot numbers, in order
+    pieces = _sentinelre.split(documentxml)
+    segments = pieces[0::2]
+    if [int(n) for n in pieces[1::2]] != list(range(len(names))):
+        raise ValueError('Template already contains placeholder sentinels')
+
+    parts = []
+    for zinfo in source.infolist():
+        if zinfo.filename == 'word/document.xml':
+            parts.append((zinfo, None))
+        else:
+            data = source.read(zinfo.filename)
+            compressed = _deflate(data)
+            parts.append((zinfo, (len(data), zlib.crc32(data) & 0xffffffff, len(compressed), compressed)))
+    source.close()
+    return CompiledTemplate(segments, names, parts)
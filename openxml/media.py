@@ -0,0 +1,209 @@
+'''
+Storage for the media (pictures, mostly) of a package until it is saved.
+
+Files on disk are only referenced: nothing is read until the package is
+saved, when they are streamed straight into the zip. With verify set, a file
+which has changed since it was added raises IOError at save time rather than
+silently going into the package.
+
+Byte strings and streams are kept in memory while they are small. Blobs over
+the spill threshold, or which would take the store over its memory budget,
+are spilled to an anonymous temporary file, and streamed from there into the
+zip when the package is saved. Memoryviews are referenced as they are, with no
+copy; the caller must not change them before saving.
+
+The defaults below apply to every new MediaStore, and may be changed for the
+whole process; global_budget, if set, caps the memory held by all stores
+together (a store which is never closed stops counting once it is garbage
+collected). Stores may be used from several threads: forks of a document share
+one store, and may be built and saved at the same time.
+'''
+
+import os
+import shutil
+import weakref
+import threading
+import tempfile
+from StringIO import StringIO
+
+# Blobs bigger than this always go to disk
+default_spill_threshold = 1 << 20
+# In-memory bytes per store, after which everything goes to disk
+default_memory_budget = 32 << 20
+# In-memory bytes across all stores, or None for no limit
+global_budget = None
+
+# Every live store, whose in-memory bytes count against global_budget
+_stores = weakref.WeakSet()
+# Guards _stores and the in-memory bytes they add up to, and the users of
+# shared stores
+_lock = threading.Lock()
+
+CHUNK = 1 << 16
+
+def globalinmemory():
+    '''Return the bytes held in memory by all the stores of the process.'''
+    return sum([store.inmemory for store in list(_stores)])
+
+class _ViewReader(object):
+    '''A minimal file-like object over a memoryview.'''
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size < 0 else self.pos + size
+        data = self.view[self.pos:end].tobytes()
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        return
+
+class _FileReader(object):
+    '''A file-like object over a temporary file which other readers may be
+    reading at the same time: each reader keeps its own position, and
+    seeks to it under the blob's lock for every read.'''
+
+    def __init__(self, file, lock):
+        self.file = file
+        self.lock = lock
+        self.pos = 0
+
+    def read(self, size=-1):
+        with self.lock:
+            self.file.seek(self.pos)
+            data = self.file.read() if size < 0 else self.file.read(size)
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        return
+
+class Blob(object):
+    '''The content of one media part: a byte string or memoryview (data), a
+    temporary file (file) or a reference to a file on disk (path). stat is
+    the (size, mtime) to check the file against, if verifying.'''
+
+    def __init__(self, size, data=None, file=None, path=None, stat=None):
+        self.size = size
+        self.data = data
+        self.file = file
+        self.path = path
+        self.stat = stat
+        if file is not None:
+            self._lock = threading.Lock()
+
+    def open(self):
+        '''Return a new file-like object positioned at the start of the blob;
+        the caller closes it.'''
+        if self.path is not None:
+            f = open(self.path, 'rb')
+            if self.stat is not None:
+                st = os.fstat(f.fileno())
+                if (st.st_size, st.st_mtime) != self.stat:
+                    f.close()
+                    raise IOError('%s has changed since it was added' % self.path)
+            return f
+        if isinstance(self.data, memoryview):
+            return _ViewReader(self.data)
+        if self.data is not None:
+            return StringIO(self.data)
+        # Not a dup() of the file: that would share one offset between readers
+        return _FileReader(self.file, self._lock)
+
+    def read(self):
+        f = self.open()
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+class MediaStore(object):
+    '''Holds the blobs of one package. See the module docstring.'''
+
+    def __init__(self, memory_budget=None, spill_threshold=None, verify=False):
+        if memory_budget is None:
+            memory_budget = default_memory_budget
+        if spill_threshold is None:
+            spill_threshold = default_spill_threshold
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.verify = verify
+        self.inmemory = 0
+        self.spilled = 0
+        self._files = []
+        self._users = 1
+        # Guards the counters and files of the store, which forks share
+        self._storelock = threading.Lock()
+        with _lock:
+            _stores.add(self)
+
+    def _keep(self, data):
+        '''Return a blob holding data in memory if it fits in the budgets,
+        counting it, or None.'''
+        size = len(data)
+        if size > self.spill_threshold:
+            return None
+        with self._storelock:
+            if self.inmemory + size > self.memory_budget:
+                return None
+            with _lock:
+                if global_budget is not None and globalinmemory() + size > global_budget:
+                    return None
+                self.inmemory += size
+        return Blob(size, data=data)
+
+    def _spill(self, source, initial=''):
+        f = tempfile.TemporaryFile()
+        f.write(initial)
+        shutil.copyfileobj(source, f, CHUNK)
+        f.flush()
+        size = f.tell()
+        with self._storelock:
+            self._files.append(f)
+            self.spilled += size
+        return Blob(size, file=f)
+
+    def add_data(self, data):
+        '''Add a blob from a byte string or memoryview.'''
+        if isinstance(data, memoryview):
+            return Blob(len(data), data=data)
+        return self._keep(data) or self._spill(StringIO(data))
+
+    def add_file(self, path, verify=None):
+        '''Add a reference to a file, which is read when the package is
+        saved. verify defaults to the store's setting.'''
+        st = os.stat(path)
+        if verify is None:
+            verify = self.verify
+        return Blob(st.st_size, path=path, stat=(st.st_size, st.st_mtime) if verify else None)
+
+    def add_stream(self, stream):
+        '''Add a blob from a file-like object, read from its current
+        position to the end.'''
+        # We don't know the size up front: read up to the threshold first
+        head = stream.read(self.spill_threshold + 1)
+        return self._keep(head) or self._spill(stream, head)
+
+    def share(self):
+        '''Register another user of the store, e.g. a forked document; the
+        store is only released once every user has closed it.'''
+        with _lock:
+            self._users += 1
+        return self
+
+    def close(self):
+        '''Release the memory and temporary files held by the store, once
+        every user of it has closed it.'''
+        with _lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+        with self._storelock:
+            with _lock:
+                self.inmemory = 0
+            for f in self._files:
+                f.close()
+            self._files = []
@@ -0,0 +1,187 @@
+'''
+A process-wide cache of what we learn about pictures, so that the logos and
+charts which go into thousands of documents are only measured and processed
+once.
+
+Pictures are identified by the SHA-1 of their content. For a file the
+digest is remembered by path, size and modification time, so an unchanged
+file is only read once. Processed pictures (see imaging.py) are kept in
+`processed`, an LRU cache bounded by processed.maxbytes, and also on disk
+under `directory` if that is set, for later processes to use. On disk they
+are kept to `maxdiskbytes`, if that is set, by removing the least recently
+used.
+'''
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from cache import LRUCache
+from media import CHUNK
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+# Directory for the on-disk tier of processed pictures, or None
+directory = None
+# Bytes of processed pictures to keep on disk, or None for no limit
+maxdiskbytes = None
+
+processed = LRUCache(maxbytes=64 << 20)
+_digests = LRUCache(maxitems=10000)
+_sizes = LRUCache(maxitems=10000)
+
+_MISSING = object()
+
+# Bytes on disk, if known, and the lock which guards them
+_diskbytes = [None]
+_disklock = threading.Lock()
+
+def _hash(blob):
+    sha = hashlib.sha1()
+    f = blob.open()
+    try:
+        while True:
+            buf = f.read(CHUNK)
+            if not buf:
+                break
+            sha.update(buf)
+    finally:
+        f.close()
+    return sha.hexdigest()
+
+def digest(blob):
+    '''Return the content digest of a media.Blob.'''
+    if blob.path is None:
+        return _hash(blob)
+    st = os.stat(blob.path)
+    key = (os.path.realpath(blob.path), st.st_size, st.st_mtime)
+    value = _digests.get(key)
+    if value is None:
+        value = _hash(blob)
+        _digests.put(key, value)
+    return value
+
+def orientation(image):
+    '''Return the EXIF orientation (1 to 8) of a PIL image, or None.'''
+    try:
+        return (image._getexif() or {}).get(0x0112)
+    except Exception:
+        # No EXIF, or EXIF which PIL can't make sense of
+        return None
+
+def size(blob):
+    '''Return the (width, height) in pixels of the picture in a media.Blob,
+    the way it is shown: turned on its side if its EXIF orientation says so.
+    Only pictures from files are remembered: for the others, reading the
+    header is cheaper than working out the digest.'''
+    key = digest(blob) if blob.path is not None else None
+    value = _sizes.get(key) if key is not None else None
+    if value is None:
+        f = blob.open()
+        try:
+            image = Image.open(f)
+            value = image.size[0:2]
+            if orientation(image) in (5, 6, 7, 8):
+                value = value[::-1]
+        finally:
+            f.close()
+        if key is not None:
+            _sizes.put(key, value)
+    return value
+
+def _diskpath(key):
+    return os.path.join(directory, hashlib.sha1(repr(key)).hexdigest() + '.picture')
+
+def get(key, default=None):
+    '''Return the processed picture for key, from memory or disk. None
+    means the picture is best left as it is.'''
+    value = processed.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    if directory is None:
+        return default
+    path = _diskpath(key)
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return default
+    try:
+        mtime = os.fstat(f.fileno()).st_mtime
+        value = f.read() or None
+    finally:
+        f.close()
+    # Access time orders the disk tier for eviction
+    try:
+        os.utime(path, (time.time(), mtime))
+    except OSError:
+        # Pruned meanwhile
+        pass
+    processed.put(key, value, len(value or ''))
+    return value
+
+def put(key, value):
+    '''Remember the processed picture (or None) for key.'''
+    processed.put(key, value, len(value or ''))
+    if directory is None:
+        return
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Somebody else may have just made it
+            if not os.path.isdir(directory):
+                raise
+    # Write to a temporary file first, so readers never see half a picture
+    fd, path = tempfile.mkstemp(dir=directory)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(value or '')
+        finally:
+            f.close()
+        os.rename(path, _diskpath(key))
+    except:
+        _remove(path)
+        raise
+    if maxdiskbytes is not None:
+        with _disklock:
+            if _diskbytes[0] is not None:
+                _diskbytes[0] += len(value or '')
+            full = _diskbytes[0] is None or _diskbytes[0] > maxdiskbytes
+        if full:
+            prune()
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Somebody else got there first
+        pass
+
+def prune():
+    '''Remove the least recently used processed pictures from disk, down
+    to maxdiskbytes.'''
+    if directory is None or not os.path.isdir(directory):
+        return
+    entries = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.picture'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_atime, st.st_size, path))
+    total = sum([size for atime, size, path in entries])
+    if maxdiskbytes is not None:
+        for atime, size, path in sorted(entries):
+            if total <= maxdiskbytes:
+                break
+            _remove(path)
+            total -= size
+    with _disklock:
+        _diskbytes[0] = total
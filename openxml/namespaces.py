@@ -9,6 +9,7 @@ nsprefixes = {
     'v':'urn:schemas-microsoft-com:vml',
     'w':'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
     'p':'http://schemas.openxmlformats.org/presentationml/2006/main',
+    'x':'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
     'sl': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout',
     'w10':'urn:schemas-microsoft-com:office:word',
     'wne':'http://schemas.microsoft.com/office/word/2006/wordml',
@@ -18,6 +19,7 @@ nsprefixes = {
     'pd':'http://schemas.openxmlformats.org/drawingml/2006/presentationDrawing',
     'a':'http://schemas.openxmlformats.org/drawingml/2006/main',
     'pic':'http://schemas.openxmlformats.org/drawingml/2006/picture',
+    'c':'http://schemas.openxmlformats.org/drawingml/2006/chart',
     # Properties (core and extended)
     'cp':"http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
     'dc':"http://purl.org/dc/elements/1.1/",
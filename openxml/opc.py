@@ -0,0 +1,649 @@
+'''
+Open Packaging Conventions: the zip container shared by .docx and .pptx files.
+
+A Package is a set of Parts. Each Part has a part name (its path inside the
+zip, without the leading slash), a content type, and its own Relationships to
+other parts. [Content_Types].xml and the _rels/*.rels files are derived from
+the registered parts when the package is saved, so nothing has to keep them
+in sync by hand.
+
+Saving is deterministic when a timestamp is given: every zip entry then
+carries it, rather than the current time or the modification time of a
+template file, and parts are written in the order they were added, so the
+same content gives the same bytes.
+'''
+
+import os
+import copy
+import time
+import datetime
+import zlib
+import zipfile
+import urllib
+import posixpath
+from lxml import etree
+from namespaces import nsprefixes
+import media
+
+# Content types by file extension, written as Default entries
+defaultcontenttypes = {
+    'rels': 'application/vnd.openxmlformats-package.relationships+xml',
+    'xml': 'application/xml',
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'png': 'image/png',
+    }
+
+# Formats which are compressed already, and so are stored in the zip as-is
+storedextensions = set(['jpeg', 'jpg', 'gif', 'png'])
+
+# A fixed timestamp for deterministic output: the earliest a zip can hold
+EPOCH = datetime.datetime(1980, 1, 1)
+
+def totimestamp(timestamp):
+    '''Return a timestamp given as a datetime or as seconds since the epoch
+    as a (UTC) datetime, or None for None.'''
+    if timestamp is None or isinstance(timestamp, datetime.datetime):
+        return timestamp
+    return datetime.datetime.utcfromtimestamp(timestamp)
+
+class ZipFile(zipfile.ZipFile):
+    '''A ZipFile whose entries all get the same date_time, if one is given,
+    rather than the current time (or a file's modification time).'''
+
+    def __init__(self, file, mode='r', compression=zipfile.ZIP_STORED, allowZip64=False,
+                 timestamp=None):
+        zipfile.ZipFile.__init__(self, file, mode, compression, allowZip64)
+        self.date_time = None
+        timestamp = totimestamp(timestamp)
+        if timestamp is not None:
+            if timestamp < EPOCH:
+                raise ValueError('Zip files can\'t hold times before 1980')
+            self.date_time = timestamp.timetuple()[:6]
+
+    def writestr(self, zinfo_or_arcname, bytes, compress_type=None):
+        if self.date_time is not None and not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo = zipfile.ZipInfo(zinfo_or_arcname, self.date_time)
+            zinfo.compress_type = self.compression
+            zinfo.external_attr = 0o600 << 16
+            zinfo_or_arcname = zinfo
+        zipfile.ZipFile.writestr(self, zinfo_or_arcname, bytes, compress_type)
+
+    def write(self, filename, arcname=None, compress_type=None):
+        if self.date_time is None:
+            return zipfile.ZipFile.write(self, filename, arcname, compress_type)
+        f = open(filename, 'rb')
+        try:
+            writestream(self, arcname or filename, f, os.fstat(f.fileno()).st_size, compress_type)
+        finally:
+            f.close()
+
+def relsname(partname):
+    '''Return the name of the relationships part for a part, or for the
+    package itself if partname is empty.'''
+    directory, filename = posixpath.split(partname)
+    return posixpath.join(directory, '_rels', filename + '.rels')
+
+def resolve(source, target):
+    '''Resolve a relationship target relative to its source part name.'''
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+def filetarget(path):
+    '''Return a relationship target standing for a file on disk, which
+    Package.add_files() replaces with a part holding the file.'''
+    return 'file://' + urllib.pathname2url(os.path.abspath(path))
+
+def extension(partname):
+    return posixpath.splitext(partname)[1][1:].lower()
+
+class ZipEntryWriter(object):
+    '''Writes one entry of an open ZipFile from pieces of data as they come,
+    as ZipFile.write() does for a file on disk. Nothing else may be written
+    to the zip until close().
+
+    If the size is known to be over 2GB it should be given, to make room for
+    ZIP64 sizes; otherwise close() raises zipfile.LargeZipFile if the entry
+    turns out too big. date_time defaults to the zip's timestamp, or now.'''
+
+    def __init__(self, zf, arcname, compress_type=None, size=None, date_time=None):
+        zinfo = zipfile.ZipInfo(arcname, date_time or getattr(zf, 'date_time', None) or
+                                time.localtime(time.time())[:6])
+        zinfo.external_attr = 0o600 << 16
+        if compress_type is None:
+            compress_type = zf.compression
+        zinfo.compress_type = compress_type
+        zinfo.file_size = size or 0
+        # Overwritten with the real values once the data is written
+        zinfo.CRC = zinfo.compress_size = 0
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        # Compressed size can be larger than uncompressed size
+        self.zip64 = zf._allowZip64 and (size or 0) * 1.05 > zipfile.ZIP64_LIMIT
+        zf.fp.write(zinfo.FileHeader(self.zip64))
+        if compress_type == zipfile.ZIP_DEFLATED:
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        else:
+            self.compressor = None
+        self.zf = zf
+        self.zinfo = zinfo
+        self.crc = self.file_size = self.compress_size = 0
+
+    def write(self, buf):
+        self.file_size += len(buf)
+        self.crc = zlib.crc32(buf, self.crc) & 0xffffffff
+        if self.compressor:
+            buf = self.compressor.compress(buf)
+        self.compress_size += len(buf)
+        self.zf.fp.write(buf)
+
+    def writecompressed(self, buf, size, crc):
+        '''Write the whole of the entry's data, already compressed with its
+        compress_type (raw deflate, with no zlib header): size and crc are
+        those of the data before compression.'''
+        if self.file_size:
+            raise ValueError('writecompressed() must write the whole entry')
+        self.compressor = None
+        self.file_size = size
+        self.crc = crc
+        self.compress_size = len(buf)
+        self.zf.fp.write(buf)
+
+    def close(self):
+        zf, zinfo = self.zf, self.zinfo
+        if self.compressor:
+            buf = self.compressor.flush()
+            self.compress_size += len(buf)
+            zf.fp.write(buf)
+        zinfo.CRC = self.crc
+        zinfo.file_size = self.file_size
+        zinfo.compress_size = self.compress_size
+        # Go back and write the header again, now with the real sizes and CRC
+        position = zf.fp.tell()
+        zf.fp.seek(zinfo.header_offset, 0)
+        zf.fp.write(zinfo.FileHeader(self.zip64))
+        zf.fp.seek(position, 0)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+def writestream(zf, arcname, stream, size, compress_type=None):
+    '''Copy a file-like object of known size into an open ZipFile in chunks,
+    as ZipFile.write() does for a file on disk.'''
+    entry = ZipEntryWriter(zf, arcname, compress_type, size)
+    while True:
+        buf = stream.read(media.CHUNK)
+        if not buf:
+            break
+        entry.write(buf)
+    entry.close()
+
+class Relationships(object):
+    '''The relationships from one part (or the package) to others.
+
+    Relationships are looked up by id, or by (type, target), in constant time;
+    adding the same type and target twice returns the existing id, unless an
+    id is given (as when reading a .rels file).'''
+
+    def __init__(self):
+        self._byid = {}
+        self._bytarget = {}
+        self._order = []
+        self._next = 1
+
+    def add(self, reltype, target, rid=None):
+        '''Add a relationship, returning its id.'''
+        key = (reltype, target)
+        if rid is None and key in self._bytarget:
+            return self._bytarget[key]
+        if rid is None:
+            while 'rId%d' % self._next in self._byid:
+                self._next += 1
+            rid = 'rId%d' % self._next
+            self._next += 1
+        elif rid in self._byid:
+            raise ValueError('Relationship id "%s" is already in use' % rid)
+        self._byid[rid] = key
+        self._bytarget.setdefault(key, rid)
+        self._order.append(rid)
+        return rid
+
+    def append(self, relationship):
+        '''Add a [type, target] pair, as relationshiplist() entries are.'''
+        self.add(relationship[0], relationship[1])
+
+    def get(self, rid):
+        '''Return the (type, target) of a relationship id.'''
+        return self._byid[rid]
+
+    def find(self, reltype, target):
+        '''Return the id of a relationship, or None.'''
+        return self._bytarget.get((reltype, target))
+
+    def remove(self, rid):
+        key = self._byid.pop(rid)
+        if self._bytarget.get(key) == rid:
+            del self._bytarget[key]
+        self._order.remove(rid)
+
+    def retarget(self, rid, target):
+        '''Point a relationship at another target, keeping its id and place.'''
+        key = self._byid[rid]
+        if self._bytarget.get(key) == rid:
+            del self._bytarget[key]
+        key = self._byid[rid] = (key[0], target)
+        self._bytarget.setdefault(key, rid)
+
+    def __contains__(self, rid):
+        return rid in self._byid
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        '''Iterate over (id, type, target) tuples, in the order added.'''
+        for rid in self._order:
+            reltype, target = self._byid[rid]
+            yield rid, reltype, target
+
+    def copy(self):
+        new = Relationships()
+        new._byid = dict(self._byid)
+        new._bytarget = dict(self._bytarget)
+        new._order = list(self._order)
+        new._next = self._next
+        return new
+
+    def toelement(self):
+        relationships = etree.Element('{%s}Relationships' % nsprefixes['pr'],
+                                      nsmap={None: nsprefixes['pr']})
+        for rid, reltype, target in self:
+            relationship = etree.SubElement(relationships, '{%s}Relationship' % nsprefixes['pr'])
+            relationship.set('Id', rid)
+            relationship.set('Type', reltype)
+            relationship.set('Target', target)
+        return relationships
+
+    def toxml(self, pretty_print=True):
+        return etree.tostring(self.toelement(), xml_declaration=True, encoding='UTF-8',
+                              standalone=True, pretty_print=pretty_print)
+
+    @classmethod
+    def fromxml(cls, xml):
+        '''Read relationships from a .rels file's content, keeping their ids.'''
+        return cls.fromelement(etree.fromstring(xml))
+
+    @classmethod
+    def fromelement(cls, root):
+        '''Read relationships from a parsed .rels file.'''
+        relationships = cls()
+        for relationship in root:
+            if relationship.tag == '{%s}Relationship' % nsprefixes['pr']:
+                relationships.add(relationship.get('Type'), relationship.get('Target'),
+                                  relationship.get('Id'))
+        return relationships
+
+class Part(object):
+    '''A part of a package. Its content is one of: an lxml element
+    (serialized when saved), a byte string, or the path of a file which is
+    streamed into the zip when saved.'''
+
+    def __init__(self, partname, content_type, element=None, data=None, path=None):
+        self.partname = partname
+        self.content_type = content_type
+        self.element = element
+        self.data = data
+        self.path = path
+        self.rels = Relationships()
+
+    def blob(self, pretty_print=True):
+        '''Return the content of the part as bytes.'''
+        if self.element is not None:
+            return etree.tostring(self.element, xml_declaration=True, encoding='UTF-8',
+                                  standalone=True, pretty_print=pretty_print)
+        if self.data is not None:
+            return self.data
+        f = open(self.path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def write(self, zf, pretty_print=True):
+        '''Write the part into an open ZipFile.'''
+        if self.element is None and self.data is None:
+            zf.write(self.path, self.partname)
+        else:
+            zf.writestr(self.partname, self.blob(pretty_print))
+
+    def copy(self):
+        new = copy.copy(self)
+        new.rels = self.rels.copy()
+        return new
+
+class MediaPart(Part):
+    '''A part whose content is a media.Blob: held in memory, in a temporary
+    file, or referenced on disk. Formats which are compressed already are
+    stored in the zip without deflating them again.
+
+    pending may be set to a result (with a get() method, such as a
+    multiprocessing AsyncResult) giving new content for the part, or None to
+    keep it; see Package.wait() and prepare().'''
+
+    def __init__(self, partname, content_type, blob):
+        Part.__init__(self, partname, content_type)
+        self.media = blob
+        self.pending = None
+        # The content as added, and the extent it has been prepared for
+        self.original = blob
+        self.extent = None
+
+    def prepare(self, policy, extent):
+        '''Have an imaging.ImagePolicy prepare the content in the
+        background for display at extent (width, height in EMUs), unless it
+        has been for an extent at least as big already. It is always
+        prepared from the original content, for the largest extent asked
+        for so far.'''
+        if self.extent is not None:
+            if extent[0] <= self.extent[0] and extent[1] <= self.extent[1]:
+                return
+            extent = max(extent[0], self.extent[0]), max(extent[1], self.extent[1])
+        self.extent = extent
+        self.pending = policy.submit(self.original, extent)
+
+    def blob(self, pretty_print=True):
+        return self.media.read()
+
+    def write(self, zf, pretty_print=True):
+        if extension(self.partname) in storedextensions:
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zf.compression
+        if isinstance(self.media.data, str):
+            zf.writestr(self.partname, self.media.data, compress_type)
+            return
+        stream = self.media.open()
+        try:
+            writestream(zf, self.partname, stream, self.media.size, compress_type)
+        finally:
+            stream.close()
+
+# Template directories don't change while we run, so only scan them once
+_templatecache = {}
+
+class Package(object):
+    '''A set of parts and the package-level relationships (_rels/.rels).
+
+    Media content is held in a media.MediaStore, which is shared by copies of
+    the package; memory_budget, spill_threshold and verify are passed to it.'''
+
+    def __init__(self, memory_budget=None, spill_threshold=None, verify=False):
+        self.parts = {}
+        self._order = []
+        self.rels = Relationships()
+        self.defaults = dict(defaultcontenttypes)
+        self.media = media.MediaStore(memory_budget, spill_threshold, verify)
+        self._media = {}
+        self._counters = {}
+
+    def add_part(self, part):
+        '''Register a part, replacing any existing part with the same name.'''
+        if part.partname not in self.parts:
+            self._order.append(part.partname)
+        self.parts[part.partname] = part
+        return part
+
+    def get_part(self, partname):
+        return self.parts.get(partname)
+
+    def __contains__(self, partname):
+        return partname in self.parts
+
+    def __iter__(self):
+        for partname in self._order:
+            yield self.parts[partname]
+
+    def remove_part(self, partname):
+        '''Remove a part, along with any relationships which point at it.'''
+        del self.parts[partname]
+        self._order.remove(partname)
+        self._media = dict((k, v) for k, v in self._media.items() if v != partname)
+        for source, rels in [('', self.rels)] + [(p.partname, p.rels) for p in self]:
+            for rid, reltype, target in list(rels):
+                if resolve(source, target) == partname:
+                    rels.remove(rid)
+
+    def newpartname(self, template, suffix=''):
+        '''Return an unused part name from a template such as
+        'word/media/image%d', counting from 1, plus a suffix.'''
+        n = self._counters.get(template, 0)
+        while True:
+            n += 1
+            partname = template % n + suffix
+            if partname not in self.parts:
+                self._counters[template] = n
+                return partname
+
+    def add_file(self, partname, path):
+        '''Add a part referencing a file on disk, which is read when the
+        package is saved.'''
+        content_type = self.defaults.get(extension(partname), 'application/octet-stream')
+        return self.add_part(MediaPart(partname, content_type, self.media.add_file(path)))
+
+    def add_files(self, source, relationships, directory):
+        '''Add the files which relationships from the part named source stand
+        for (see filetarget()) as media in directory, and point the
+        relationships at the parts.'''
+        for rid, reltype, target in list(relationships):
+            if target.startswith('file://'):
+                partname = self.add_media(urllib.url2pathname(target[len('file://'):]), directory)
+                relationships.retarget(rid, posixpath.relpath(partname, posixpath.dirname(source)))
+
+    def add_media(self, filename, directory, data=None):
+        '''Add an image (or other media) file, returning its part name.
+
+        A file is only referenced, and read when the package is saved; the
+        same file is only added once. If data is given (a byte string,
+        memoryview or file-like object) it is used as the content, and
+        filename only supplies the extension.'''
+        if data is None:
+            key = os.path.realpath(filename)
+            if key in self._media:
+                return self._media[key]
+            blob = self.media.add_file(filename)
+        else:
+            key = None
+            if isinstance(data, (str, memoryview)):
+                blob = self.media.add_data(data)
+            else:
+                blob = self.media.add_stream(data)
+        ext = os.path.splitext(filename)[1][1:].lower()
+        partname = self.newpartname(posixpath.join(directory, 'image%d'), '.' + ext)
+        self.add_part(MediaPart(partname, self.defaults.get(ext, 'application/octet-stream'), blob))
+        if key is not None:
+            self._media[key] = partname
+        return partname
+
+    def contenttypes(self, parts=None):
+        '''Build [Content_Types].xml from the registered parts, or from the
+        given parts.'''
+        ct = nsprefixes['ct']
+        types = etree.Element('{%s}Types' % ct, nsmap={None: ct})
+        extensions = set(['rels', 'xml'])
+        overrides = []
+        if parts is None:
+            parts = self
+        for part in parts:
+            ext = extension(part.partname)
+            if self.defaults.get(ext) == part.content_type:
+                extensions.add(ext)
+            else:
+                overrides.append(part)
+        for ext in sorted(extensions):
+            default = etree.SubElement(types, '{%s}Default' % ct)
+            default.set('Extension', ext)
+            default.set('ContentType', self.defaults[ext])
+        for part in overrides:
+            override = etree.SubElement(types, '{%s}Override' % ct)
+            override.set('PartName', '/' + part.partname)
+            override.set('ContentType', part.content_type)
+        return types
+
+    def wait(self):
+        '''Wait for the media parts whose content is still being prepared,
+        and take their new content.'''
+        for part in self:
+            if isinstance(part, MediaPart) and part.pending is not None:
+                data = part.pending.get()
+                part.pending = None
+                if data is not None:
+                    part.media = self.media.add_data(data)
+
+    def copy(self):
+        '''Return a copy of the package which can be changed independently.
+        Part content isn't copied, parts and relationships are.'''
+        self.wait()
+        new = copy.copy(self)
+        new.parts = dict((name, part.copy()) for name, part in self.parts.items())
+        new._order = list(self._order)
+        new.rels = self.rels.copy()
+        new.defaults = dict(self.defaults)
+        new._media = dict(self._media)
+        new._counters = dict(self._counters)
+        return new
+
+    def close(self):
+        '''Release the media held by the package (and its copies).'''
+        self.media.close()
+
+    def save(self, output, pretty_print=True, contenttypes=None, timestamp=None):
+        '''Write the package to output, a filename or a file-like object.
+
+        contenttypes may be given to override the generated
+        [Content_Types].xml. timestamp (a datetime, or seconds since the
+        epoch) is given to every zip entry, see ZipFile.'''
+        self.wait()
+        if contenttypes is None:
+            contenttypes = self.contenttypes()
+        zf = ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED, timestamp=timestamp)
+        zf.writestr('[Content_Types].xml', etree.tostring(contenttypes,
+            xml_declaration=True, encoding='UTF-8', standalone=True, pretty_print=pretty_print))
+        if len(self.rels):
+            zf.writestr(relsname(''), self.rels.toxml(pretty_print))
+        for part in self:
+            part.write(zf, pretty_print)
+            if len(part.rels):
+                zf.writestr(relsname(part.partname), part.rels.toxml(pretty_print))
+        zf.close()
+        return
+
+    @classmethod
+    def fromdir(cls, directory, contenttypes=None, cache=True, **kwargs):
+        '''Make a package from the files in a template directory.
+
+        Files are registered as parts by path and only read when the package
+        is saved. .rels files become the relationships of their parts. Content
+        types come from contenttypes (a dict of part names to types), then
+        from the directory's [Content_Types].xml, then by extension.
+
+        With cache set the directory is only scanned once per process. Other
+        keyword arguments are passed to Package().'''
+        directory = os.path.abspath(directory)
+        key = (directory, tuple(sorted((contenttypes or {}).items())))
+        if cache and key in _templatecache:
+            entries = _templatecache[key]
+        else:
+            entries = _scandir(directory, contenttypes or {})
+            if cache:
+                _templatecache[key] = entries
+        package = cls(**kwargs)
+        for partname, content_type, path, relsxml in entries:
+            if partname == '':
+                package.rels = Relationships.fromxml(relsxml)
+                continue
+            part = package.add_part(Part(partname, content_type, path=path))
+            if relsxml is not None:
+                part.rels = Relationships.fromxml(relsxml)
+        return package
+
+class PackageWriter(object):
+    '''Writes a package into a zip while it is still being built.
+
+    Parts which are complete can be passed to write(), which puts them and
+    their relationships into the zip straight away, so that they need not
+    be kept in the package (or in memory). close() then writes the parts
+    of the package, its relationships and, last, [Content_Types].xml
+    covering everything. timestamp is as for Package.save().'''
+
+    def __init__(self, package, output, pretty_print=True, timestamp=None):
+        self.package = package
+        self.pretty_print = pretty_print
+        self.zf = ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED, timestamp=timestamp)
+        # Stand-ins for the parts written so far, for the content types
+        self.written = []
+        self._start = self.zf.fp.tell()
+
+    def tell(self):
+        '''Return the number of bytes written to the output so far.'''
+        return self.zf.fp.tell() - self._start
+
+    def write(self, part):
+        '''Write a part which isn't in the package, and its relationships.'''
+        part.write(self.zf, self.pretty_print)
+        if len(part.rels):
+            self.zf.writestr(relsname(part.partname), part.rels.toxml(self.pretty_print))
+        self.written.append(Part(part.partname, part.content_type))
+
+    def close(self, contenttypes=None):
+        '''Write the rest of the package and close the zip.'''
+        package = self.package
+        package.wait()
+        for part in package:
+            self.write(part)
+        if len(package.rels):
+            self.zf.writestr(relsname(''), package.rels.toxml(self.pretty_print))
+        if contenttypes is None:
+            contenttypes = package.contenttypes(self.written)
+        self.zf.writestr('[Content_Types].xml', etree.tostring(contenttypes,
+            xml_declaration=True, encoding='UTF-8', standalone=True, pretty_print=self.pretty_print))
+        self.zf.close()
+        return
+
+def _scandir(directory, contenttypes):
+    '''Return (partname, content type, path, rels xml) for the files of a
+    template directory. The package relationships have an empty part name.'''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename == '.DS_Store': # nuisance from some os's
+                continue
+            path = os.path.join(dirpath, filename)
+            files.append((path[len(directory)+1:].replace(os.sep, '/'), path))
+    overrides = {}
+    defaults = dict(defaultcontenttypes)
+    rels = {}
+    for partname, path in files:
+        if partname == '[Content_Types].xml':
+            for el in etree.parse(path).getroot():
+                if el.tag == '{%s}Override' % nsprefixes['ct']:
+                    overrides[el.get('PartName').lstrip('/')] = el.get('ContentType')
+                elif el.tag == '{%s}Default' % nsprefixes['ct']:
+                    defaults[el.get('Extension').lower()] = el.get('ContentType')
+        elif partname.endswith('.rels'):
+            f = open(path, 'rb')
+            try:
+                rels[partname] = f.read()
+            finally:
+                f.close()
+    overrides.update(contenttypes)
+    entries = []
+    if relsname('') in rels:
+        entries.append(('', None, None, rels[relsname('')]))
+    for partname, path in files:
+        if partname == '[Content_Types].xml' or partname.endswith('.rels'):
+            continue
+        content_type = overrides.get(partname, defaults.get(extension(partname),
+                                                            'application/octet-stream'))
+        entries.append((partname, content_type, path, rels.get(relsname(partname))))
+    return entries
@@ -11,11 +11,19 @@ except ImportError:
 import zipfile
 import shutil
 import re
+import io
+import copy
 import time
 import os
 from os.path import join
 import tempfile
 from namespaces import nsprefixes
+import opc
+import chart
+from imaging import ImagePolicy
+from limits import LimitedZipFile
+import mediacache
+from compact import escape, _attr
 from StringIO import StringIO
 
 log = logging.getLogger(__name__)
@@ -121,32 +129,35 @@ def picture(picname, slide_rels, picdescription='No Description', pixelwidth=Non
     # http://openxmldeveloper.org/articles/462.aspx
     # Create an image. Size may be specified, otherwise it will based on the
     # pixel size of image. Return a paragraph containing the picture'''
-    # Copy the file into the media dir
-
-    media_dir = join(template,'ppt','media')
-
-    if not os.path.isdir(media_dir):
-        os.mkdir(media_dir)
-    new_picname = join(media_dir,os.path.basename(picname))
-    shutil.copyfile(picname, new_picname)
-    picname = new_picname
-    
     # Check if the user has specified a size
     if not pixelwidth or not pixelheight:
         # If not, get info from the picture itself
         pixelwidth,pixelheight = Image.open(picname).size[0:2]
-    picname = os.path.basename(picname)
+    # The file isn't copied: the relationship stands for it until savepptx()
+    # reads it from where it is
+    target = opc.filetarget(picname)
+
+    if isinstance(slide_rels, opc.Relationships):
+        # A slide's relationships hand out their own ids, and give the
+        # same picture the same one
+        picrelid = slide_rels.add(nsprefixes['i'], target)
+    else:
+        # Set relationship ID to the first available
+        picid = len(slide_rels) + 1
+        picrelid = 'rId'+ str(picid)
+        slide_rels.append([nsprefixes['i'], target, str(picid)])
+
+    return slide_rels, pictureelement(picrelid, pixelwidth, pixelheight, scale)
+
+def pictureelement(picrelid, pixelwidth, pixelheight, scale=1):
+    '''Return a p:pic element showing the image with relationship id
+    picrelid, displayed at the given pixel size times scale'''
     # OpenXML measures on-screen objects in English Metric Units
     # 1cm = 36000 EMUs
     emuperpixel = 12667
     width = str(int(pixelwidth * emuperpixel * scale))
     height = str(int(pixelheight * emuperpixel * scale))
 
-    # Set relationship ID to the first available
-    picid = len(slide_rels) + 1 
-    picrelid = 'rId'+ str(picid)
-    slide_rels.append([nsprefixes['i'], '../media/' + picname, str(picid)])
-
     # There are 3 main elements inside a picture
     # 1. The Blipfill - specifies how the image fills the picture area (stretch, tile, etc.)
     blipfill = makeelement('blipFill')
@@ -180,50 +191,51 @@ def picture(picname, slide_rels, picdescription='No Description', pixelwidth=Non
     pic.append(blipfill)
     pic.append(sppr)
 
-    return slide_rels, pic
+    return pic
     
-def savepptx(document, output, slides, media_files, pptrelationships,
-                                    contenttypes=contenttypes(), template=template_dir):
-    '''Save a modified document'''
-    assert os.path.isdir(template)
-    docxfile = zipfile.ZipFile(output,mode='w',compression=zipfile.ZIP_DEFLATED)
-
-    # Serialize our trees into out zip file
-    '''
-    treesandfiles = {document:'ppt/presentation.xml',
-                     contenttypes:'[Content_Types].xml',
-                     pptrelationships:'ppt/_rels/presentation.xml.rels'}
-    for tree in treesandfiles:
-        log.info('Saving: '+treesandfiles[tree]    )
-        treestring = etree.tostring(tree, pretty_print=True)
-        docxfile.writestr(treesandfiles[tree],treestring)
-        '''
-    for slide in slides:
-        treestring = etree.tostring(slide.slide, pretty_print=True)
+class SlidePart(opc.Part):
+    '''A slide, whose element is serialized with redundant namespace
+    declarations cleaned out.'''
+
+    def blob(self, pretty_print=True):
+        treestring = etree.tostring(self.element)
         parser = etree.XMLParser(ns_clean=True)
         tree = etree.parse(StringIO(treestring), parser)
-        treestring = etree.tostring(tree, pretty_print=True)
-        docxfile.writestr('ppt/slides/slide' + str(slide.number) + '.xml', treestring)
-        rels_tree = etree.fromstring('''<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"></Relationships>''')
-        for rel in slide.relationships:
-            rel_el = (etree.Element('Relationship'))
-            rel_el.set('Id', 'rId' + rel[2])
-            rel_el.set('Type', rel[0])
-            rel_el.set('Target', rel[1])
-            rels_tree.append(rel_el)
-        rels_string = etree.tostring(rels_tree, pretty_print=True)
-        docxfile.writestr('ppt/slides/_rels/slide' + str(slide.number) + '.xml.rels',
-                                                                            rels_string)
-    # Add & compress support files
-    allowed = ['.xml', '.rels']
-    for dirpath, dirnames, filenames in os.walk(template):
-        for filename in filenames:
-            ext = os.path.splitext(filename)[1]
-            if ext in allowed or filename in allowed or filename in media_files:
-                doc_file = os.path.join(dirpath, filename)
-                archivename = doc_file[len(template)+1:]
-                docxfile.write(doc_file, archivename)
-    docxfile.close()
+        return etree.tostring(tree, xml_declaration=True, encoding='UTF-8',
+                              standalone=True, pretty_print=pretty_print)
+
+slidereltype = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide'
+slidecontenttype = 'application/vnd.openxmlformats-officedocument.presentationml.slide+xml'
+presentationcontenttype = 'application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml'
+
+def savepptx(document, output, slides, media_files=None, pptrelationships=None,
+                                    contenttypes=None, template=template_dir):
+    '''Save a modified document: the presentation tree, and a list of Slide
+    objects with their relationships. media_files and pptrelationships are
+    no longer needed (pictures added with picture() are read from their
+    source files) and content types are derived from the parts, unless a
+    contenttypes tree is given.'''
+    assert os.path.isdir(template)
+    package = opc.Package.fromdir(template, cache=template == template_dir)
+    presentation = package.get_part('ppt/presentation.xml')
+    presentation.element = document
+    for rid, reltype, target in list(presentation.rels):
+        if reltype == slidereltype:
+            presentation.rels.remove(rid)
+    # The slides' relationship ids are the ones the sldIdLst refers to
+    sldids = document.xpath('/p:presentation/p:sldIdLst/p:sldId', namespaces=nsprefixes)
+    for slide, sldid in zip(slides, sldids):
+        part = package.add_part(SlidePart('ppt/slides/slide' + str(slide.number) + '.xml',
+                                          slidecontenttype, element=slide.slide))
+        if isinstance(slide.relationships, opc.Relationships):
+            part.rels = slide.relationships
+        else:
+            for rel in slide.relationships:
+                part.rels.add(rel[0], rel[1], 'rId' + rel[2])
+        presentation.rels.add(slidereltype, 'slides/slide' + str(slide.number) + '.xml',
+                              sldid.get('{%s}id' % nsprefixes['r']))
+        package.add_files(part.partname, part.rels, 'ppt/media')
+    package.save(output, contenttypes=contenttypes)
     return
     
 def slide():
@@ -295,90 +307,343 @@ def text_box(text):
     sp.append(txbody)
     return sp
 
+_TABLE_OPEN = ('<p:graphicFrame xmlns:p="%s" xmlns:a="%s"><p:nvGraphicFramePr>'
+               '<p:cNvPr id="%%d" name="Table %%d"/><p:cNvGraphicFramePr>'
+               '<a:graphicFrameLocks noGrp="1"/></p:cNvGraphicFramePr><p:nvPr/>'
+               '</p:nvGraphicFramePr><p:xfrm><a:off x="%%d" y="%%d"/><a:ext cx="%%d" cy="%%d"/>'
+               '</p:xfrm><a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/table">'
+               '<a:tbl><a:tblPr firstRow="%%d" bandRow="1"/><a:tblGrid>' % (nsprefixes['p'], nsprefixes['a']))
+_TABLE_CLOSE = '</a:tbl></a:graphicData></a:graphic></p:graphicFrame>'
+_CELL_CLOSE = '</a:t></a:r></a:p></a:txBody><a:tcPr/></a:tc>'
+
+def _cellopen(align, fontsize, bold=False):
+    return ('<a:tc><a:txBody><a:bodyPr/><a:lstStyle/><a:p><a:pPr algn="%s"/><a:r>'
+            '<a:rPr lang="en-US" sz="%d"%s/><a:t>' % (_attr(align), int(fontsize * 100),
+                                                     ' b="1"' if bold else ''))
+
+def tablecolumn(values, format=None):
+    '''Return the cell texts for a column of values, escaped and encoded.
+    format may be a %-format string or a function applied to each value;
+    by default numbers are shown as unicode() shows them.'''
+    if hasattr(values, 'tolist'):
+        # NumPy: iterating over plain lists is much quicker
+        values = values.tolist()
+    if format is None:
+        texts = [v if isinstance(v, basestring) else unicode(v) for v in values]
+    elif callable(format):
+        texts = map(format, values)
+    else:
+        texts = [format % v for v in values]
+    return map(escape, texts)
+
+def tableframe(columns, headers, widths, rowheight, fontsize, aligns, shapeid, x, y):
+    '''Return the XML of a graphic frame holding a table, from columns of
+    cell texts as made by tablecolumn() and optional header texts. Sizes
+    and positions are in EMUs.'''
+    nrows = len(columns[0]) + (1 if headers else 0)
+    out = [_TABLE_OPEN % (shapeid, shapeid, x, y, sum(widths), rowheight * nrows,
+                          1 if headers else 0)]
+    for w in widths:
+        out.append('<a:gridCol w="%d"/>' % w)
+    out.append('</a:tblGrid>')
+    tropen = '<a:tr h="%d">' % rowheight
+    if headers:
+        out.append(tropen)
+        for align, text in zip(aligns, headers):
+            out.append(_cellopen(align, fontsize, True))
+            out.append(text)
+            out.append(_CELL_CLOSE)
+        out.append('</a:tr>')
+    opens = [_cellopen(align, fontsize) for align in aligns]
+    for row in zip(*columns):
+        out.append(tropen)
+        for cellopen, text in zip(opens, row):
+            out.append(cellopen)
+            out.append(text)
+            out.append(_CELL_CLOSE)
+        out.append('</a:tr>')
+    out.append(_TABLE_CLOSE)
+    return ''.join(out)
+
 class Slide(object):
     def __init__(self):
         self.slide = slide()
-        self.relationships = [
-                [nsprefixes['sl'], '../slideLayouts/slideLayout2.xml', '1']
-                ]
+        self.sptree = self.slide.xpath('/p:sld/p:cSld/p:spTree', namespaces=nsprefixes)[0]
+        self.relationships = opc.Relationships()
+        self.relationships.add(nsprefixes['sl'], '../slideLayouts/slideLayout2.xml')
         self.number = None
+        self.partname = None
         self.media_files = []
+        self.document = None
         return
 
     @classmethod
-    def create(cls, template_dir):
+    def create(cls, document=None):
         slide = cls()
-        slide.template_dir = template_dir
+        slide.document = document
         return slide
 
-    def add_picture(self, picname, *args, **kwargs):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Finish the slide when streaming, unless building it went wrong
+        if exc_type is None and self.document is not None:
+            self.document.finish_slide(self)
+        return False
+
+    def add_picture(self, picname, picdescription='No Description', pixelwidth=None,
+                    pixelheight=None, nochangeaspect=True, nochangearrowheads=True,
+                    align='center', scale=1, data=None, policy=None):
+        '''Add a picture from the file picname, or from data (a byte string
+        or file-like object) if given, in which case picname only supplies
+        the extension.
+
+        policy (by default the document's image_policy) is an ImagePolicy
+        to downscale and recompress the picture with, in the background.'''
         extension = os.path.splitext(picname)[1]
         if extension not in ['.jpg', '.jpeg', '.png']:
             raise ValueError
-        self.relationships, pic = picture(picname, slide_rels=self.relationships,
-                                        template=self.template_dir, *args, **kwargs)
-        self.slide.xpath('/p:sld/p:cSld/p:spTree', namespaces=nsprefixes)[0].append(pic)
-        self.media_files.append(os.path.basename(picname))
+        package = self.document.package
+        partname = package.add_media(picname, 'ppt/media', data)
+        picrelid = self.relationships.add(nsprefixes['i'], '../' + partname[len('ppt/'):])
+        part = package.get_part(partname)
+        # Check if the user has specified a size
+        if not pixelwidth or not pixelheight:
+            # If not, get info from the picture itself
+            pixelwidth,pixelheight = mediacache.size(part.media)
+        policy = policy or self.document.image_policy
+        if policy is not None:
+            part.prepare(policy, (pixelwidth * scale * chart.emuperpixel,
+                                  pixelheight * scale * chart.emuperpixel))
+        self.sptree.append(pictureelement(picrelid, pixelwidth, pixelheight, scale))
+        self.media_files.append(partname)
         return
 
     def add_text_box(self, text):
-        self.slide.xpath('/p:sld/p:cSld/p:spTree', namespaces=nsprefixes)[0].append(
-                                                                          text_box(text))
+        self.sptree.append(text_box(text))
         return
 
+    def add_table(self, columns, headers=None, formats=None, aligns=None, x=40, y=100,
+                  width=None, rowheight=20, fontsize=10, rows_per_slide=None):
+        '''Add a table from a list of columns (sequences or NumPy arrays of
+        equal length), at (x, y) pixels and width pixels wide (by default, as
+        wide as the slide allows). formats and aligns ('l', 'ctr' or 'r')
+        apply to whole columns; see tablecolumn().
+
+        Rows which don't fit on the slide (or beyond rows_per_slide) go on
+        new slides added to the end of the presentation, with the headers
+        repeated. Returns the
+        list of slides used.'''
+        emu = chart.emuperpixel
+        slidewidth, slideheight = self._size()
+        if not columns:
+            raise ValueError('A table needs at least one column')
+        formats = formats or [None] * len(columns)
+        aligns = aligns or ['l'] * len(columns)
+        texts = [tablecolumn(values, format) for values, format in zip(columns, formats)]
+        if len(set([len(column) for column in texts])) > 1:
+            raise ValueError('All the columns of a table must have the same length')
+        if headers:
+            headers = map(escape, headers)
+        if width is None:
+            width = slidewidth // emu - 2 * x
+        widths = [width * emu // len(columns)] * len(columns)
+        if rows_per_slide is None:
+            rows_per_slide = (slideheight // emu - y - x) // rowheight - (1 if headers else 0)
+        rows_per_slide = max(1, rows_per_slide)
+        slides = []
+        slide = self
+        start = 0
+        while True:
+            page = [column[start:start + rows_per_slide] for column in texts]
+            slide.sptree.append(etree.fromstring(tableframe(page, headers, widths,
+                rowheight * emu, fontsize, aligns, slide._nextshapeid(), x * emu, y * emu)))
+            slides.append(slide)
+            start += rows_per_slide
+            if start >= len(texts[0]):
+                return slides
+            slide = self.document.add_slide()
+
+    def _size(self):
+        '''The slide width and height in EMUs.'''
+        presentation = getattr(self.document, 'presentation', None)
+        if presentation is None:
+            return 9144000, 6858000
+        sldsz = presentation.find('{%s}sldSz' % nsprefixes['p'])
+        return int(sldsz.get('cx')), int(sldsz.get('cy'))
+
+    def _nextshapeid(self):
+        ids = [int(i) for i in self.sptree.xpath('.//p:cNvPr/@id', namespaces=nsprefixes)]
+        return max(ids + [1]) + 1
+
+    def add_line_chart(self, series, categories=None, title=None, x=100, y=140,
+                       width=600, height=360, legend=None):
+        '''Add a native line chart at (x, y), width x height pixels. series
+        is a sequence of numbers (e.g. a NumPy array), a list of them, or a
+        list of (name, values) pairs; see chart.chartspace().'''
+        self._add_chart('line', series, categories, title, x, y, width, height, legend=legend)
+        return
+
+    def add_bar_chart(self, series, categories=None, title=None, x=100, y=140,
+                      width=600, height=360, legend=None, horizontal=False):
+        '''Add a native bar chart; see add_line_chart().'''
+        self._add_chart('bar', series, categories, title, x, y, width, height,
+                        legend=legend, horizontal=horizontal)
+        return
+
+    def _add_chart(self, kind, series, categories, title, x, y, width, height, **kwargs):
+        package = self.document.package
+        partname = package.newpartname('ppt/charts/chart%d', '.xml')
+        package.add_part(opc.Part(partname, chart.chartcontenttype,
+            data=chart.chartspace(kind, series, categories, title, **kwargs)))
+        relid = self.relationships.add(chart.chartreltype, '../' + partname[len('ppt/'):])
+        number = int(partname[len('ppt/charts/chart'):-len('.xml')])
+        self.sptree.append(etree.fromstring(
+            chart.framexml(relid, number, self._nextshapeid(), x, y, width, height)))
+
 class Document(object):
-    def __init__(self):
-        self.relationshiplist = relationshiplist()
-        self.slide_rels = [] # Each member of this list will be a list of relationships for a particular slide. Each relationship is itself a list, whose first member is the Type of the relationship (a namespace) and whose second member is the Target for the relationship.
-        self.tmpdir = tempfile.mkdtemp()
-        self.template_dir = os.path.join(self.tmpdir, 'template')
-        shutil.copytree(template_dir, self.template_dir) # we copy our template files to a temp location
+    def __init__(self, memory_budget=None):
+        # Template parts are only referenced here, and read when we save
+        self.template_dir = template_dir
+        self.package = opc.Package.fromdir(template_dir, memory_budget=memory_budget)
+        self.relationshiplist = self.package.get_part('ppt/presentation.xml').rels
+        self.image_policy = None
+        self.writer = None
         return
     
     @classmethod
-    def create(cls):
-        doc = cls()
-        doc.presentation = makeelement('presentation')
-        master_id_list = makeelement('sldMasterIdLst')
-        master_id_list.append(makeelement('sldMasterId', attributes={'id': '2147483648',                                                '{'+nsprefixes['r']+'}' + 'id':'rId2'}))
-        doc.presentation.append(master_id_list)
-        doc.presentation.append(makeelement('sldIdLst'))
-        doc.presentation.append(makeelement('sldSz', attributes={'cx':'10080625',
-                                                                 'cy':'7559675'}))
-        doc.presentation.append(makeelement('notesSz', attributes={'cx':'7559675',
-                                                                   'cy':'10691812'})) 
+    def create(cls, memory_budget=None, verify_media=False, image_policy=None, output=None,
+               timestamp=None):
+        '''Create a new presentation with no slides. memory_budget is the
+        number of bytes of pictures to hold in memory before spilling them to
+        temporary files, see media.py. Picture files are read when the
+        presentation is saved; with verify_media set, saving raises IOError if
+        one has changed since it was added. image_policy is the ImagePolicy
+        to prepare pictures with, see imaging.py.
+
+        If output (a filename or file-like object) is given, the
+        presentation is streamed to it: each slide is written out, and its
+        tree freed, by finish_slide() or at the end of a `with` block, and
+        save() (with no filename) writes the rest. timestamp is then as for
+        save().'''
+        doc = cls(memory_budget)
+        doc.package.media.verify = verify_media
+        doc.image_policy = image_policy
+        part = doc.package.get_part('ppt/presentation.xml')
+        doc.presentation = etree.fromstring(part.blob())
+        part.element, part.path = doc.presentation, None
+        # The template comes with a slide; we start with none
+        doc.slide_list = doc.presentation.xpath('/p:presentation/p:sldIdLst',
+                                                namespaces=nsprefixes)[0]
+        for sldid in list(doc.slide_list):
+            doc.slide_list.remove(sldid)
+        for rid, reltype, target in list(doc.relationshiplist):
+            if reltype == slidereltype:
+                doc.relationshiplist.remove(rid)
         doc.slides = []
+        if output is not None:
+            if isinstance(output, basestring) and output[-5:] != '.pptx':
+                output = output + '.pptx'
+            doc.writer = opc.PackageWriter(doc.package, output, timestamp=timestamp)
         return doc
 
     def add_slide(self):
-        slide = Slide.create(template_dir=self.template_dir)
+        slide = Slide.create(self)
+        self._addslide(slide)
+        return slide
+
+    def clone_slide(self, slide, substitutions=None):
+        '''Add a copy of a slide (of this presentation) at the end, and
+        return it. Its pictures are shared with the original; charts are
+        copied.
+
+        substitutions maps pieces of text to their replacements in the
+        copy's text. They are all made in one pass over each text run;
+        text split over several runs isn't matched.'''
+        if slide.slide is None:
+            raise ValueError('Slide %d has been written out already: clone it before finishing it'
+                             % slide.number)
+        clone = copy.copy(slide)
+        clone.slide = copy.deepcopy(slide.slide)
+        clone.sptree = clone.slide.find('{%(p)s}cSld/{%(p)s}spTree' % nsprefixes)
+        clone.relationships = slide.relationships.copy()
+        clone.media_files = list(slide.media_files)
+        clone.document = self
+        for rid, reltype, target in list(clone.relationships):
+            if reltype == chart.chartreltype:
+                # A chart belongs to one slide: give the copy its own
+                original = self.package.get_part(opc.resolve(slide.partname, target))
+                partname = self.package.newpartname('ppt/charts/chart%d', '.xml')
+                self.package.add_part(opc.Part(partname, original.content_type,
+                                               data=original.blob()))
+                clone.relationships.remove(rid)
+                clone.relationships.add(reltype, '../' + partname[len('ppt/'):], rid)
+        if substitutions:
+            keys = sorted(substitutions, key=len, reverse=True)
+            search = re.compile('|'.join([re.escape(key) for key in keys]))
+            replace = lambda match: substitutions[match.group()]
+            for t in clone.slide.iter('{%s}t' % nsprefixes['a']):
+                if t.text:
+                    t.text = search.sub(replace, t.text)
+        self._addslide(clone)
+        return clone
+
+    def _addslide(self, slide):
+        '''Register a slide as the last one of the presentation.'''
         slide.number = len(self.slides) + 1
         self.slides.append(slide)
-        slide_list = self.presentation.xpath('/p:presentation/p:sldIdLst',
-                                                                namespaces=nsprefixes)[0]
-        slide_list.append(makeelement('sldId',
-            attributes={'id': str(256 + len(self.slides) - 1),
-               '{'+nsprefixes['r']+'}' + 'id': 'rId' + str(3 + len(self.slides) - 1)}))
-        return slide
+        slide.partname = 'ppt/slides/slide' + str(slide.number) + '.xml'
+        if self.writer is None:
+            part = self.package.add_part(SlidePart(slide.partname, slidecontenttype, element=slide.slide))
+            part.rels = slide.relationships
+        rid = self.relationshiplist.add(slidereltype, slide.partname[len('ppt/'):])
+        self.slide_list.append(makeelement('sldId',
+            attributes={'id': str(256 + slide.number - 1),
+               '{'+nsprefixes['r']+'}' + 'id': rid}))
 
-    def save(self, filename, *args, **kwargs):
-        media_files = []
-        for slide in self.slides:
-            media_files += slide.media_files
+    def finish_slide(self, slide):
+        '''When streaming (see create()), write a slide out and free its
+        tree; it can't be changed afterwards. Otherwise, do nothing.'''
+        if self.writer is None or slide.slide is None:
+            return
+        part = SlidePart(slide.partname, slidecontenttype, element=slide.slide)
+        part.rels = slide.relationships
+        # Pictures added with picture(), which are written with the others
+        self.package.add_files(part.partname, part.rels, 'ppt/media')
+        self.writer.write(part)
+        slide.slide = slide.sptree = None
+        return
+
+    def save(self, filename=None, contenttypes=None, timestamp=None):
+        '''Save the presentation to filename (or a file-like object). If a
+        timestamp (a datetime, or seconds since the epoch, e.g. opc.EPOCH)
+        is given, the zip entries all carry it, so that the same
+        presentation always gives the same bytes.'''
+        if self.writer is not None:
+            if filename is not None or timestamp is not None:
+                raise ValueError('A streamed presentation is written to the output (and with the '
+                                 'timestamp) given to create()')
+            for slide in self.slides:
+                self.finish_slide(slide)
+            self.writer.close(contenttypes)
+            return
         suffix = '.pptx'
-        if filename[-5:] != suffix: filename = filename + suffix
-        return savepptx(document=self.presentation, slides=self.slides,
-                        media_files=media_files, template=self.template_dir,
-                        output=filename,
-                        pptrelationships=pptrelationships(self.relationshiplist),
-                        *args, **kwargs)
+        if isinstance(filename, basestring) and filename[-5:] != suffix:
+            filename = filename + suffix
+        for slide in self.slides:
+            # Pictures added with picture()
+            self.package.add_files(slide.partname, slide.relationships, 'ppt/media')
+        self.package.save(filename, contenttypes=contenttypes, timestamp=timestamp)
+        return
 
     def get_file_object(self, *args, **kwargs):
         '''Get the document as a file-like object.'''
         filedir = tempfile.mkdtemp()
         filepath = os.path.join(filedir, 'rendered_pptx.pptx')
         self.save(filename=filepath)
-        f = open(filepath)
+        # open() in this module reads presentations: use the builtin
+        f = io.open(filepath, 'rb')
         shutil.rmtree(filedir)
         return f
         
@@ -386,4 +651,153 @@ class Document(object):
         return self.get_file_object(*args, **kwargs).read()
  
     def close(self):
-        shutil.rmtree(self.tmpdir)
+        '''Release the pictures held in memory or in temporary files.'''
+        self.package.close()
+        return
+
+class SlideReader(object):
+    '''A slide of a presentation opened with open(). Nothing is read until
+    the tree, relationships, text or pictures are asked for.'''
+
+    def __init__(self, presentation, number, partname):
+        self.presentation = presentation
+        self.number = number
+        self.partname = partname
+        self._tree = None
+        self._relationships = None
+
+    @property
+    def tree(self):
+        '''The p:sld element of the slide.'''
+        if self._tree is None:
+            self._tree = self.presentation._parse(self.partname)
+        return self._tree
+
+    @property
+    def relationships(self):
+        if self._relationships is None:
+            self._relationships = self.presentation._relationships(self.partname)
+        return self._relationships
+
+    def text(self):
+        '''Return the texts of the slide's runs, in document order.'''
+        return [t.text for t in self.tree.iter('{%s}t' % nsprefixes['a']) if t.text]
+
+    def pictures(self):
+        '''Return the part names of the slide's pictures.'''
+        embed = '{%s}embed' % nsprefixes['r']
+        pictures = []
+        for blip in self.tree.iter('{%s}blip' % nsprefixes['a']):
+            rid = blip.get(embed)
+            if rid in self.relationships:
+                pictures.append(opc.resolve(self.partname, self.relationships.get(rid)[1]))
+        return pictures
+
+class PresentationReader(object):
+    '''A presentation opened for reading with open(). Slides are numbered
+    from 1, in presentation order, and only read when they are used:
+
+        >>> deck = open('deck.pptx')
+        >>> deck[3].text()
+
+    iterslides() streams the text and pictures of every slide without
+    keeping any tree. With limits (a limits.Limits), everything read is
+    kept within them, for presentations which can't be trusted.'''
+
+    def __init__(self, file, limits=None):
+        self.limits = limits
+        if limits is None:
+            self.zip = zipfile.ZipFile(file)
+        else:
+            self.zip = LimitedZipFile(file, limits)
+        presentation = 'ppt/presentation.xml'
+        rid = '{%s}id' % nsprefixes['r']
+        self.partnames = []
+        try:
+            rels = self._relationships(presentation)
+            for event, sldid in self._iterparse(io.BytesIO(self.zip.read(presentation)),
+                                                '{%s}sldId' % nsprefixes['p']):
+                self.partnames.append(opc.resolve(presentation, rels.get(sldid.get(rid))[1]))
+        except:
+            self.zip.close()
+            raise
+
+    def _iterparse(self, source, tag):
+        if self.limits is None:
+            return etree.iterparse(source, tag=tag)
+        return self.limits.iterparse(source, tag)
+
+    def _parse(self, partname):
+        if self.limits is None:
+            return etree.fromstring(self.zip.read(partname))
+        return self.zip.parse(partname)
+
+    def _relationships(self, partname):
+        try:
+            return opc.Relationships.fromelement(self._parse(opc.relsname(partname)))
+        except KeyError:
+            return opc.Relationships()
+
+    def __len__(self):
+        return len(self.partnames)
+
+    def __getitem__(self, number):
+        '''Return slide number (counting from 1).'''
+        if not 1 <= number <= len(self.partnames):
+            raise IndexError('No slide %d: the presentation has %d slides'
+                             % (number, len(self.partnames)))
+        return SlideReader(self, number, self.partnames[number - 1])
+
+    def __iter__(self):
+        for number in range(1, len(self.partnames) + 1):
+            yield self[number]
+
+    def iterslides(self):
+        '''Yield (number, texts, pictures) for each slide, parsing each
+        slide incrementally and discarding it as it goes.'''
+        t = '{%s}t' % nsprefixes['a']
+        blip = '{%s}blip' % nsprefixes['a']
+        embed = '{%s}embed' % nsprefixes['r']
+        for number, partname in enumerate(self.partnames):
+            rels = self._relationships(partname)
+            texts = []
+            pictures = []
+            source = self.zip.open(partname)
+            try:
+                for event, element in self._iterparse(source, (t, blip)):
+                    if element.tag == t:
+                        if element.text:
+                            texts.append(element.text)
+                    elif element.get(embed) in rels:
+                        pictures.append(opc.resolve(partname, rels.get(element.get(embed))[1]))
+                    element.clear()
+            finally:
+                source.close()
+            yield number + 1, texts, pictures
+
+    def read(self, partname):
+        '''Return the content of a part, e.g. a picture.'''
+        return self.zip.read(partname)
+
+    def imagesize(self, partname):
+        '''Return the (width, height) of a picture, within max_pixels if
+        there are limits.'''
+        if self.limits is None:
+            return Image.open(io.BytesIO(self.zip.read(partname))).size
+        return self.zip.imagesize(partname)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def open(file, limits=None):
+    '''Open a .pptx file (a filename or a file-like object) for reading.
+    Only presentation.xml and its relationships are read here, to find the
+    slides; see PresentationReader.'''
+    return PresentationReader(file, limits)
@@ -0,0 +1,178 @@
+'''
+A cache of rendered documents, keyed by a digest of everything that went
+into building them, so that a report which is asked for again is served
+without being built again.
+
+    >>> cache = RenderCache('/var/cache/openxml/renders', ttl=3600)
+    >>> data = cache.render(('quarterly', region, figures), build)
+
+build() is only called if there is no copy of the result younger than ttl
+seconds, in memory (up to maxbytes, least recently used first out) or on
+disk under directory (up to maxdiskbytes, the same way). The inputs must
+be made of what JSON can hold, and must cover everything the result
+depends on; builds should be deterministic (saved with a timestamp, see
+opc.py) so that a cached copy is the same as a new one would be.
+'''
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from cache import LRUCache
+
+def digest(inputs):
+    '''Return the cache key for some build inputs.'''
+    # Sorted keys and no spaces, so equal inputs always give the same JSON
+    text = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text).hexdigest()
+
+class RenderCache(object):
+    '''Rendered documents by digest of their inputs; see the module
+    docstring. Either tier may be left out: directory=None keeps nothing on
+    disk, maxbytes=0 nothing in memory. It may be used from several
+    threads.'''
+
+    def __init__(self, directory=None, maxbytes=64 << 20, maxdiskbytes=None, ttl=None):
+        self.directory = directory
+        self.maxdiskbytes = maxdiskbytes
+        self.ttl = ttl
+        self.memory = LRUCache(maxbytes=maxbytes)
+        self.hits = 0
+        self.misses = 0
+        self._diskbytes = None
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Somebody else may have just made it
+                if not os.path.isdir(directory):
+                    raise
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.render')
+
+    def get(self, key):
+        '''Return the document for a key, or None.'''
+        entry = self.memory.get(key)
+        if entry is not None:
+            created, data = entry
+            if not self._expired(created):
+                self._count(True)
+                return data
+            self.memory.discard(key)
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                f = open(path, 'rb')
+            except IOError:
+                pass
+            else:
+                try:
+                    created = os.fstat(f.fileno()).st_mtime
+                    data = None if self._expired(created) else f.read()
+                finally:
+                    f.close()
+                if data is not None:
+                    # Access time orders the disk tier for eviction
+                    try:
+                        os.utime(path, (time.time(), created))
+                    except OSError:
+                        # Pruned meanwhile
+                        pass
+                    self.memory.put(key, (created, data), len(data))
+                    self._count(True)
+                    return data
+                self._remove(path)
+        self._count(False)
+        return None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key, data):
+        '''Keep a document.'''
+        self.memory.put(key, (time.time(), data), len(data))
+        if self.directory is None:
+            return
+        # Write to a temporary file first, so readers never see half a document
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp, self._path(key))
+        except:
+            self._remove(tmp)
+            raise
+        if self.maxdiskbytes is not None:
+            with self._lock:
+                if self._diskbytes is not None:
+                    self._diskbytes += len(data)
+                full = self._diskbytes is None or self._diskbytes > self.maxdiskbytes
+            if full:
+                self.prune()
+
+    def render(self, inputs, build):
+        '''Return the document for inputs from the cache, or from build()
+        (keeping it for next time).'''
+        key = digest(inputs)
+        data = self.get(key)
+        if data is None:
+            data = build()
+            self.put(key, data)
+        return data
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Somebody else got there first
+            pass
+
+    def prune(self):
+        '''Remove the expired documents from disk, and the least recently
+        used ones beyond maxdiskbytes.'''
+        if self.directory is None:
+            return
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.render'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if self._expired(st.st_mtime):
+                self._remove(path)
+            else:
+                entries.append((st.st_atime, st.st_size, path))
+        total = sum([size for atime, size, path in entries])
+        if self.maxdiskbytes is not None:
+            for atime, size, path in sorted(entries):
+                if total <= self.maxdiskbytes:
+                    break
+                self._remove(path)
+                total -= size
+        with self._lock:
+            self._diskbytes = total
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory is not None:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.render'):
+                    self._remove(os.path.join(self.directory, filename))
+        self._diskbytes = None
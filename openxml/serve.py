@@ -0,0 +1,442 @@
+'''
+A render server: documents are described in JSON, and built by a pool of
+worker processes which have already imported everything and loaded the
+templates, so a small document costs milliseconds rather than the start-up
+of a new Python.
+
+    python -m openxml.serve [--port 8765 | --socket PATH] [--workers N]
+                            [--max-pending N] [--max-body MB] [--pictures DIR]
+
+It speaks HTTP, on localhost or on a Unix socket:
+
+    POST /render    a JSON spec; the response is the .docx or .pptx
+    GET /health     {"status": "ok", "workers": ..., "pending": ...}
+    GET /stats      request, error, rejection and cache hit counts, latencies
+
+A spec for a .docx lists the body, one block per item:
+
+    {"type": "docx", "body": [
+        {"heading": "Results", "level": 1},
+        {"paragraph": "Some text", "style": "BodyText"},
+        {"table": [["Region", "Sales"], ["North", "12"]]},
+        {"picture": "logo.png"},
+        {"line_chart": {"series": [[1, 2, 3]], "categories": ["a", "b", "c"]}},
+        {"pagebreak": true}]}
+
+and one for a .pptx lists the slides:
+
+    {"type": "pptx", "slides": [
+        {"text": ["Results"], "pictures": ["logo.png"],
+         "table": {"columns": [["North"], [12]], "headers": ["Region", "Sales"]},
+         "bar_chart": {"series": [[1, 2, 3]]}}]}
+
+A picture is the name of a file under the --pictures directory (with no
+--pictures, file names are refused), or {"name": "logo.png", "data": BASE64}.
+
+Documents are saved with a fixed timestamp (see opc.py), or with
+"timestamp": SECONDS from the spec, so the same spec always gives the same
+bytes. With --cache-dir or --cache-size, rendered documents are kept (see
+rendercache.py) and a spec which has been rendered before, with the same
+picture files, is answered from the cache.
+
+Once --max-pending requests are waiting for a worker, new ones are turned
+away with 503 and a Retry-After header rather than queued without limit.
+A render which times out (--timeout) is answered with 504 but keeps its
+place until its worker has finished with it. A spec of more than --max-body
+MB is refused with 413 before it is read.
+'''
+
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import optparse
+import threading
+import collections
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+from StringIO import StringIO
+import opc
+import docx
+import pptx
+import rendercache
+
+log = logging.getLogger(__name__)
+
+contenttypes = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+# Directory picture names are looked up in, in the workers; None refuses them
+picturedir = None
+
+def _picture(picture):
+    '''Return (filename, data) for a picture in a spec.'''
+    if isinstance(picture, dict):
+        try:
+            return picture['name'], base64.b64decode(picture['data'])
+        except (KeyError, TypeError):
+            raise ValueError('A picture needs a name and base64 data')
+    if picturedir is None:
+        raise ValueError('Pictures must be given as data: the server has no picture directory')
+    path = os.path.realpath(os.path.join(picturedir, picture))
+    if not path.startswith(os.path.realpath(picturedir) + os.sep):
+        raise ValueError('Picture %r is outside the picture directory' % picture)
+    return path, None
+
+def _chart(add, options):
+    if not isinstance(options, dict) or 'series' not in options:
+        raise ValueError('A chart needs a series')
+    options = dict((str(key), value) for key, value in options.items())
+    add(**options)
+
+def renderdocx(spec):
+    doc = docx.Document.create(compact=spec.get('compact', True))
+    try:
+        for block in spec.get('body', []):
+            if 'heading' in block:
+                doc.add_heading(block['heading'], block.get('level', 1))
+            elif 'paragraph' in block:
+                doc.add_para(block['paragraph'], style=block.get('style', 'BodyText'),
+                             jc=block.get('align', 'left'))
+            elif 'table' in block:
+                doc.add_table(block['table'], heading=block.get('heading_row', True))
+            elif 'picture' in block:
+                filename, data = _picture(block['picture'])
+                doc.add_picture(filename, block.get('description', 'No Description'),
+                                block.get('width'), block.get('height'), data=data)
+            elif 'line_chart' in block:
+                _chart(doc.add_line_chart, block['line_chart'])
+            elif 'bar_chart' in block:
+                _chart(doc.add_bar_chart, block['bar_chart'])
+            elif 'pagebreak' in block:
+                doc.add_break()
+            else:
+                raise ValueError('Unknown block %r' % sorted(block))
+        output = StringIO()
+        doc.save(output, timestamp=spec.get('timestamp', opc.EPOCH))
+        return output.getvalue()
+    finally:
+        doc.close()
+
+def renderpptx(spec):
+    doc = pptx.Document.create()
+    try:
+        for item in spec.get('slides', []):
+            slide = doc.add_slide()
+            for text in item.get('text', []):
+                slide.add_text_box(text)
+            for picture in item.get('pictures', []):
+                filename, data = _picture(picture)
+                slide.add_picture(filename, data=data)
+            if 'table' in item:
+                table = item['table']
+                if not isinstance(table, dict) or 'columns' not in table:
+                    raise ValueError('A table needs columns')
+                slide.add_table(table['columns'], table.get('headers'), table.get('formats'),
+                                table.get('aligns'))
+            if 'line_chart' in item:
+                _chart(slide.add_line_chart, item['line_chart'])
+            if 'bar_chart' in item:
+                _chart(slide.add_bar_chart, item['bar_chart'])
+        output = StringIO()
+        doc.save(output, timestamp=spec.get('timestamp', opc.EPOCH))
+        return output.getvalue()
+    finally:
+        doc.close()
+
+def render(spec):
+    '''Build the document described by spec (see the module docstring) and
+    return its bytes. Raises ValueError if the spec is wrong.'''
+    if not isinstance(spec, dict) or spec.get('type') not in contenttypes:
+        raise ValueError('A spec is an object with "type": "docx" or "pptx"')
+    try:
+        if spec['type'] == 'docx':
+            return renderdocx(spec)
+        return renderpptx(spec)
+    except (KeyError, TypeError, AttributeError) as e:
+        # Items of the wrong shape
+        raise ValueError('Bad spec: %s: %s' % (e.__class__.__name__, e))
+
+def _render(spec):
+    '''Run render(spec) in a worker; return (None, bytes), or (error, None)
+    where error is (HTTP status, message), so that the pool always has a
+    result to pass to its callback.'''
+    try:
+        return None, render(spec)
+    except ValueError as e:
+        return (400, str(e)), None
+    except Exception as e:
+        return (500, '%s: %s' % (e.__class__.__name__, e)), None
+
+def _picturenames(spec):
+    '''Yield the picture file names in a spec.'''
+    items = spec.get('body') or spec.get('slides') or []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        pictures = [item.get('picture')] + list(item.get('pictures') or [])
+        for picture in pictures:
+            if isinstance(picture, basestring):
+                yield picture
+
+def _warm(directory):
+    '''Start a worker: everything is imported already; render a document of
+    each kind, so the templates are read and the caches filled.'''
+    global picturedir
+    picturedir = directory
+    render({'type': 'docx', 'body': [{'paragraph': 'warm'}]})
+    render({'type': 'pptx', 'slides': [{'text': ['warm']}]})
+
+class Stats(object):
+    '''Counts, and the latencies of the last `keep` renders.'''
+
+    def __init__(self, keep=1000):
+        self.started = time.time()
+        self.requests = self.errors = self.rejected = self.cached = 0
+        self.latencies = collections.deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def record(self, seconds=None, error=False, rejected=False, cached=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.rejected += rejected
+            self.cached += cached
+            if seconds is not None:
+                self.latencies.append(seconds)
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {'uptime': round(time.time() - self.started, 3),
+                      'requests': self.requests, 'errors': self.errors,
+                      'rejected': self.rejected, 'cached': self.cached}
+        if latencies:
+            at = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 6)
+            report['latency'] = {'count': len(latencies),
+                                 'mean': round(sum(latencies) / len(latencies), 6),
+                                 'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99),
+                                 'max': round(latencies[-1], 6)}
+        return report
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'openxml-serve/0.1'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        log.debug('%s %s', self.address_string(), format % args)
+
+    def reply(self, code, body, contenttype='application/json', headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/health':
+            self.reply(200, json.dumps({'status': 'ok', 'workers': server.workers,
+                                        'pending': server.pending}))
+        elif self.path == '/stats':
+            report = server.stats.report()
+            report['pending'] = server.pending
+            self.reply(200, json.dumps(report))
+        else:
+            self.reply(404, json.dumps({'error': 'Not found'}))
+
+    def do_POST(self):
+        server = self.server
+        if self.path != '/render':
+            self.reply(404, json.dumps({'error': 'Not found'}))
+            return
+        start = time.time()
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.reply(411, json.dumps({'error': 'Content-Length required'}))
+            return
+        if server.max_body is not None and length > server.max_body:
+            server.stats.record(error=True)
+            self.reply(413, json.dumps({'error': 'A spec may be at most %d bytes'
+                                                 % server.max_body}))
+            return
+        try:
+            spec = json.loads(self.rfile.read(length))
+            if not isinstance(spec, dict) or spec.get('type') not in contenttypes:
+                raise ValueError('A spec is an object with "type": "docx" or "pptx"')
+        except ValueError as e:
+            server.stats.record(time.time() - start, error=True)
+            self.reply(400, json.dumps({'error': str(e)}))
+            return
+        key = None
+        if server.cache is not None:
+            key = rendercache.digest(server.cacheinputs(spec))
+            result = server.cache.get(key)
+            if result is not None:
+                server.stats.record(time.time() - start, cached=True)
+                self.reply(200, result, contenttypes[spec['type']], headers=[('X-Cache', 'hit')])
+                return
+        if not server.acquire():
+            server.stats.record(rejected=True)
+            self.reply(503, json.dumps({'error': 'Too many pending renders'}),
+                       headers=[('Retry-After', '1')])
+            return
+        try:
+            # The place is given back when the worker is done with the
+            # render, which may be after we have stopped waiting for it
+            pending = server.pool.apply_async(_render, (spec,), callback=server.finished)
+        except:
+            server.release()
+            raise
+        try:
+            error, result = pending.get(server.render_timeout)
+        except multiprocessing.TimeoutError:
+            server.stats.record(time.time() - start, error=True)
+            self.reply(504, json.dumps({'error': 'Render timed out'}))
+            return
+        if error is not None:
+            server.stats.record(time.time() - start, error=True)
+            code, message = error
+            if code == 500:
+                log.error('Render failed: %s', message)
+            self.reply(code, json.dumps({'error': message}))
+            return
+        if key is not None:
+            server.cache.put(key, result)
+        server.stats.record(time.time() - start)
+        self.reply(200, result, contenttypes[spec['type']])
+
+class RenderServerMixin(SocketServer.ThreadingMixIn):
+    '''Hands renders to a pool of warm workers; see the module docstring.'''
+    daemon_threads = True
+
+    def setup(self, workers=None, max_pending=None, picturedir=None, timeout=None,
+              cache=None, max_body=16 << 20):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.picturedir = picturedir
+        self.cache = cache
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_body = max_body
+        self.render_timeout = timeout
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.stats = Stats()
+        self.pool = multiprocessing.Pool(self.workers, _warm, (picturedir,))
+
+    def cacheinputs(self, spec):
+        '''Return what a render of spec depends on: the spec, and the size
+        and modification time of the picture files it names.'''
+        pictures = []
+        for name in _picturenames(spec):
+            try:
+                st = os.stat(os.path.join(self.picturedir or '', name))
+                pictures.append([name, st.st_size, st.st_mtime])
+            except OSError:
+                pictures.append([name, None, None])
+        return ['openxml.serve', spec, pictures]
+
+    def acquire(self):
+        '''Take a place for a render, or return False if they are all taken.'''
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+
+    def finished(self, outcome):
+        '''Called by the pool when a worker has finished a render.'''
+        self.release()
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+class RenderServer(RenderServerMixin, BaseHTTPServer.HTTPServer):
+    pass
+
+class UnixRenderServer(RenderServerMixin, SocketServer.UnixStreamServer):
+    def server_close(self):
+        RenderServerMixin.server_close(self)
+        os.remove(self.server_address)
+
+def makeserver(port=8765, host='127.0.0.1', path=None, **kwargs):
+    '''Return a render server on host:port, or on a Unix socket at path if
+    that is given. kwargs are those of RenderServerMixin.setup().'''
+    if path is not None:
+        if os.path.exists(path):
+            # A socket left behind by a server which wasn't shut down
+            os.remove(path)
+        server = UnixRenderServer(path, RenderHandler)
+    else:
+        server = RenderServer((host, port), RenderHandler)
+    server.setup(**kwargs)
+    return server
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='python -m openxml.serve [options]')
+    parser.add_option('-p', '--port', type='int', default=8765,
+                      help='port to listen on, on localhost (default: 8765)')
+    parser.add_option('--host', default='127.0.0.1',
+                      help='address to listen on (default: 127.0.0.1)')
+    parser.add_option('-s', '--socket', default=None,
+                      help='Unix socket to listen on instead of a port')
+    parser.add_option('-w', '--workers', type='int', default=None,
+                      help='number of worker processes (default: one per CPU)')
+    parser.add_option('--max-pending', type='int', default=None,
+                      help='renders to accept at once before answering 503 (default: 4 per worker)')
+    parser.add_option('--max-body', type='int', default=16,
+                      help='MB of spec to accept before answering 413 (default: 16)')
+    parser.add_option('--pictures', default=None,
+                      help='directory picture names in specs refer to')
+    parser.add_option('--timeout', type='float', default=None,
+                      help='seconds to wait for a render before answering 504')
+    parser.add_option('--cache-size', type='int', default=None,
+                      help='MB of rendered documents to keep in memory')
+    parser.add_option('--cache-dir', default=None,
+                      help='directory to keep rendered documents in')
+    parser.add_option('--cache-disk-size', type='int', default=None,
+                      help='MB of rendered documents to keep in --cache-dir (default: no limit)')
+    parser.add_option('--cache-ttl', type='float', default=None,
+                      help='seconds to keep rendered documents for (default: no limit)')
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('unexpected arguments: %s' % ' '.join(args))
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    cache = None
+    if options.cache_size or options.cache_dir:
+        cache = rendercache.RenderCache(options.cache_dir, (options.cache_size or 64) << 20,
+            options.cache_disk_size and options.cache_disk_size << 20, options.cache_ttl)
+    server = makeserver(options.port, options.host, options.socket, workers=options.workers,
+                        max_pending=options.max_pending, picturedir=options.pictures,
+                        timeout=options.timeout, cache=cache,
+                        max_body=options.max_body and options.max_body << 20)
+    log.info('Serving on %s with %d workers',
+             options.socket or '%s:%d' % (options.host, options.port), server.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
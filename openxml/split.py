@@ -0,0 +1,291 @@
+'''
+Writers which split a huge output over several files, each within a budget,
+so that Word and PowerPoint can still open them:
+
+    >>> out = SplitDocument('report.docx', max_bytes=50 << 20, max_pages=500,
+    ...                     header=lambda doc: doc.add_heading('Quarterly report', 1))
+    >>> for region in regions:
+    ...     out.add_heading(region.name, 2)
+    ...     out.add_table(region.rows)
+    >>> out.close()
+    ['report.docx', 'report_part2.docx', 'report_part3.docx']
+
+The first file has the name given; the others add _part2, _part3 and so on.
+header, if given, is called with each new docx.Document (or pptx.Document)
+to add the content which starts every file. A file is saved, and its
+memory released, as soon as it is full, so memory use doesn't grow with the
+whole output.
+
+A document is split between blocks (paragraphs, headings, tables, pictures,
+charts or fragments), never inside one. max_bytes counts the document XML
+and the pictures and charts before compression, which makes up for the
+parts of the template (a few tens of KB) being left out; a block which
+would take a file over it starts the next file instead. max_pages counts
+page breaks: the break which would start page max_pages + 1 starts the
+next file instead. A single block bigger than the budget still goes in a
+file of its own. As a block may have to be added again, to the next file,
+streams given to the add_* methods are read, and iterators turned into
+lists, first.
+
+A presentation is split between slides and streamed (see
+pptx.Document.create()), each slide being written when the next is added.
+max_slides is checked as slides are added, not counting the slides the
+header adds, and max_bytes (the size written so far, plus pictures and
+charts to come, leaving out the template) as each slide is written, so a
+file may go over it by one slide. Slides which a table overflows onto are
+added straight to the current file.
+'''
+
+import os
+from lxml import etree
+import docx
+import pptx
+import opc
+
+def partfilename(filename, number, extension):
+    '''Return the name of file number (counting from 1) of a split output:
+    report.docx, report_part2.docx...'''
+    root, ext = os.path.splitext(filename)
+    if ext.lower() != extension:
+        root, ext = filename, extension
+    if number == 1:
+        return root + ext
+    return '%s_part%d%s' % (root, number, ext)
+
+def _replayable(value):
+    '''Return value in a form which can be used twice: the content of a
+    stream, or a list for an iterator (and for iterators in it, such as the
+    rows of a table).'''
+    if hasattr(value, 'read'):
+        return value.read()
+    try:
+        iterator = iter(value) is value
+    except TypeError:
+        return value
+    if iterator:
+        return [_replayable(item) for item in value]
+    return value
+
+def _partsize(part):
+    if isinstance(part, opc.MediaPart):
+        return part.media.size
+    if part.data is not None:
+        return len(part.data)
+    return 0
+
+class SplitDocument(object):
+    '''A .docx output split into files of at most max_bytes or max_pages;
+    see the module docstring. options are passed to docx.Document.create(),
+    and timestamp to save(). It has the add_* methods of a docx.Document.'''
+
+    def __init__(self, filename, max_bytes=None, max_pages=None, header=None, timestamp=None,
+                 **options):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.header = header
+        self.timestamp = timestamp
+        self.options = options
+        self.files = []
+        self.document = None
+        self._start()
+
+    def _start(self):
+        self.document = docx.Document.create(**self.options)
+        self.size = 0
+        self.pages = 1
+        # Blocks in the file beyond its header
+        self.blocks = 0
+        if self.header is not None:
+            parts = len(self.document.package.parts)
+            self.header(self.document)
+            self.size = self._blocksize(0) + self._newpartsize(parts)
+
+    def _bodylength(self):
+        if self.document.compact:
+            return len(self.document.body.nodes)
+        return len(self.document.body)
+
+    def _blocksize(self, start):
+        '''The size of the XML of the blocks from start on.'''
+        if self.document.compact:
+            out = []
+            for node in self.document.body.nodes[start:]:
+                node.write(out)
+            return sum([len(piece) for piece in out])
+        return sum([len(etree.tostring(element)) for element in self.document.body[start:]])
+
+    def _newparts(self, start):
+        return list(self.document.package)[start:]
+
+    def _newpartsize(self, start):
+        return sum([_partsize(part) for part in self._newparts(start)])
+
+    def _save(self):
+        filename = partfilename(self.filename, len(self.files) + 1, '.docx')
+        self.document.save(filename, timestamp=self.timestamp)
+        self.document.close()
+        self.document = None
+        self.files.append(filename)
+
+    def _add(self, method, *args, **kwargs):
+        '''Add a block with one of docx.Document's methods, starting the next
+        file instead if it doesn't fit in this one.'''
+        document = self.document
+        if document is None:
+            raise ValueError('The output has been closed')
+        # The block may have to be added again, to the next file
+        args = [_replayable(value) for value in args]
+        kwargs = dict([(key, _replayable(value)) for key, value in kwargs.items()])
+        length = self._bodylength()
+        parts = len(document.package.parts)
+        rids = len(document.relationshiplist)
+        fragments = set(document._fragmentrids)
+        getattr(document, method)(*args, **kwargs)
+        size = self._blocksize(length)
+        if len(document.package.parts) != parts:
+            size += self._newpartsize(parts)
+        if self.max_bytes is not None and self.blocks and self.size + size > self.max_bytes:
+            # Take the block out again, with whatever it added, and put it
+            # in the next file
+            if document.compact:
+                del document.body.nodes[length:]
+            else:
+                del document.body[length:]
+            for part in self._newparts(parts):
+                document.package.remove_part(part.partname)
+            for rid, reltype, target in list(document.relationshiplist)[rids:]:
+                document.relationshiplist.remove(rid)
+            for name in set(document._fragmentrids) - fragments:
+                del document._fragmentrids[name]
+            self._save()
+            self._start()
+            return self._add(method, *args, **kwargs)
+        self.size += size
+        self.blocks += 1
+
+    def add_para(self, *args, **kwargs):
+        self._add('add_para', *args, **kwargs)
+
+    def add_heading(self, *args, **kwargs):
+        self._add('add_heading', *args, **kwargs)
+
+    def add_table(self, *args, **kwargs):
+        self._add('add_table', *args, **kwargs)
+
+    def add_picture(self, *args, **kwargs):
+        self._add('add_picture', *args, **kwargs)
+
+    def add_line_chart(self, *args, **kwargs):
+        self._add('add_line_chart', *args, **kwargs)
+
+    def add_bar_chart(self, *args, **kwargs):
+        self._add('add_bar_chart', *args, **kwargs)
+
+    def add_fragment(self, *args, **kwargs):
+        self._add('add_fragment', *args, **kwargs)
+
+    def add_break(self, type='page', orient='portrait'):
+        '''Add a page or section break, or start the next file if this one
+        has max_pages pages.'''
+        if self.max_pages is not None and self.blocks and self.pages >= self.max_pages:
+            self._save()
+            self._start()
+            return
+        self._add('add_break', type, orient)
+        self.pages += 1
+
+    def close(self):
+        '''Save the last file; return the names of all the files.'''
+        if self.document is not None:
+            self._save()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.document is not None:
+            self.document.close()
+        return False
+
+class SplitPresentation(object):
+    '''A .pptx output split into files of at most max_slides slides (besides
+    those of the header) or max_bytes; see the module docstring. options are passed to
+    pptx.Document.create(), with timestamp.'''
+
+    def __init__(self, filename, max_slides=None, max_bytes=None, header=None, timestamp=None,
+                 **options):
+        self.filename = filename
+        self.max_slides = max_slides
+        self.max_bytes = max_bytes
+        self.header = header
+        self.timestamp = timestamp
+        self.options = options
+        self.files = []
+        self.document = None
+        self._start()
+
+    def _start(self):
+        self._current = partfilename(self.filename, len(self.files) + 1, '.pptx')
+        self.document = pptx.Document.create(output=self._current, timestamp=self.timestamp,
+                                             **self.options)
+        self._parts = len(self.document.package.parts)
+        if self.header is not None:
+            self.header(self.document)
+        # Slides which make up the header don't count as content
+        self._headerslides = len(self.document.slides)
+
+    def _finishslides(self):
+        for slide in self.document.slides:
+            self.document.finish_slide(slide)
+
+    def size(self):
+        '''The bytes written to the current file so far, plus its pictures
+        and charts, which are written at the end.'''
+        document = self.document
+        media = list(document.package)[self._parts:]
+        return document.writer.tell() + sum([_partsize(part) for part in media])
+
+    def _full(self):
+        slides = len(self.document.slides) - self._headerslides
+        if not slides:
+            return False
+        if self.max_slides is not None and slides >= self.max_slides:
+            return True
+        return self.max_bytes is not None and self.size() >= self.max_bytes
+
+    def _save(self):
+        self.document.save()
+        self.document.close()
+        self.document = None
+        self.files.append(self._current)
+
+    def add_slide(self):
+        '''Write out the slides so far, start the next file if this one is
+        full, and return a new slide.'''
+        if self.document is None:
+            raise ValueError('The output has been closed')
+        self._finishslides()
+        if self._full():
+            self._save()
+            self._start()
+        return self.document.add_slide()
+
+    def close(self):
+        '''Save the last file; return the names of all the files.'''
+        if self.document is not None:
+            self._save()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.document is not None:
+            self.document.close()
+        return False
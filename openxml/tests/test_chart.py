@@ -0,0 +1,45 @@
+'''
+Tests for the forms a chart's series may be given in.
+
+    python -m unittest openxml.tests.test_chart
+'''
+
+import io
+import unittest
+from lxml import etree
+from openxml import chart, docx
+
+def series(xml):
+    '''Return the (name, values) of each series in a chart part.'''
+    c = '{%s}' % docx.nsprefixes['c']
+    return [(ser.find('%stx/%sv' % (c, c)).text,
+             [float(v.text) for v in ser.iter('%sv' % c) if v.getparent().tag == c + 'pt'])
+            for ser in etree.fromstring(xml).iter(c + 'ser')]
+
+class SeriesTest(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(series(chart.chartspace('line', [1, 2])), [('Series 1', [1, 2])])
+
+    def test_rows(self):
+        self.assertEqual(series(chart.chartspace('bar', [(1, 2), (3, 4)])),
+                         [('Series 1', [1, 2]), ('Series 2', [3, 4])])
+
+    def test_named(self):
+        self.assertEqual(series(chart.chartspace('line', [('Sales', [1, 2]), (u'Co\xfbts', [3])])),
+                         [('Sales', [1, 2]), (u'Co\xfbts', [3])])
+
+    def test_numbers_as_names(self):
+        self.assertEqual(series(chart.chartspace('line', [(2020, [1, 2]), (2021, [3, 4])])),
+                         [('2020', [1, 2]), ('2021', [3, 4])])
+        self.assertEqual(series(chart.chartspace('bar', {2021: [3], 2020: [1]})),
+                         [('2020', [1]), ('2021', [3])])
+
+    def test_document(self):
+        d = docx.Document.create()
+        d.add_line_chart([(2020, [1, 2]), (2021, [3, 4])], categories=['H1', 'H2'])
+        d.save(io.BytesIO())
+        d.close()
+
+if __name__ == '__main__':
+    unittest.main()
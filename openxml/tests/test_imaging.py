@@ -0,0 +1,89 @@
+'''
+Tests for preparing pictures with an ImagePolicy: pictures which EXIF
+turns on their side are shown, and prepared, upright.
+
+    python -m unittest openxml.tests.test_imaging
+'''
+
+import io
+import os
+import struct
+import unittest
+import zipfile
+from lxml import etree
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+from openxml import docx, pptx, chart
+from openxml.imaging import ImagePolicy
+
+def exif(orientation):
+    '''Return an EXIF block holding just an orientation.'''
+    # A big-endian TIFF header, then one IFD with one SHORT entry
+    return ('Exif\0\0MM\0\x2a' + struct.pack('>I', 8) + struct.pack('>H', 1) +
+            struct.pack('>HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('>I', 0))
+
+def jpeg(size, orientation):
+    '''Return the bytes of a JPEG of random pixels with an EXIF orientation.'''
+    out = io.BytesIO()
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(
+        out, 'JPEG', quality=95, exif=exif(orientation))
+    return out.getvalue()
+
+def extents(z, partname):
+    '''Return the (cx, cy) of every picture in a part.'''
+    tree = etree.fromstring(z.read(partname))
+    return [(int(ext.get('cx')), int(ext.get('cy')))
+            for ext in tree.xpath('//*[local-name() = "pic"]//a:ext', namespaces=docx.nsprefixes)]
+
+def media(z):
+    '''Return the pixel sizes of the media parts of a package.'''
+    return [Image.open(io.BytesIO(z.read(name))).size for name in sorted(z.namelist())
+            if '/media/' in name]
+
+class OrientationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = jpeg((400, 200), 6)
+
+    def assertUpright(self, z, partname):
+        (cx, cy), = extents(z, partname)
+        self.assertEqual((cx, cy), (200 * chart.emuperpixel, 400 * chart.emuperpixel))
+        (width, height), = media(z)
+        self.assertTrue(height > width)
+        # The same shape as its frame, give or take rounding
+        self.assertAlmostEqual(float(width) / height, float(cx) / cy, 2)
+
+    def test_docx(self):
+        d = docx.Document.create(image_policy=ImagePolicy(dpi=72))
+        d.add_picture('rotated.jpg', data=self.data)
+        out = io.BytesIO()
+        d.save(out)
+        d.close()
+        self.assertUpright(zipfile.ZipFile(out), 'word/document.xml')
+
+    def test_pptx(self):
+        d = pptx.Document.create(image_policy=ImagePolicy(dpi=72))
+        with d.add_slide() as slide:
+            slide.add_picture('rotated.jpg', data=self.data)
+        out = io.BytesIO()
+        d.save(out)
+        d.close()
+        z = zipfile.ZipFile(out)
+        self.assertUpright(z, 'ppt/slides/slide1.xml')
+
+    def test_unprocessed(self):
+        # Left as it is, the picture is turned by whatever shows it
+        d = docx.Document.create()
+        d.add_picture('rotated.jpg', data=self.data)
+        out = io.BytesIO()
+        d.save(out)
+        d.close()
+        z = zipfile.ZipFile(out)
+        self.assertEqual(extents(z, 'word/document.xml'),
+                         [(200 * chart.emuperpixel, 400 * chart.emuperpixel)])
+        self.assertEqual(media(z), [(400, 200)])
+
+if __name__ == '__main__':
+    unittest.main()
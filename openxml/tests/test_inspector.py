@@ -0,0 +1,63 @@
+'''
+Tests for the package inspector: what it reports of the packages this
+library writes, and of a package with a relationship nothing uses.
+
+    python -m unittest openxml.tests.test_inspector
+'''
+
+import io
+import zipfile
+import unittest
+from openxml import docx, pptx, inspector
+
+def saved(document):
+    out = io.BytesIO()
+    document.save(out)
+    document.close()
+    return io.BytesIO(out.getvalue())
+
+class InspectorTest(unittest.TestCase):
+
+    def test_new_presentation(self):
+        # Layouts belong to their master without referring to it by id
+        report = inspector.inspectpackage(saved(pptx.Document.create()))
+        self.assertEqual(report['unused_relationships'], [])
+        self.assertEqual(report['missing_targets'], [])
+        self.assertEqual(report['unreferenced_parts'], [])
+
+    def test_presentation(self):
+        d = pptx.Document.create()
+        with d.add_slide() as slide:
+            slide.add_text_box('Results')
+            slide.add_bar_chart([1, 2, 3])
+        report = inspector.inspectpackage(saved(d))
+        self.assertEqual(report['unused_relationships'], [])
+        self.assertEqual(report['unreferenced_parts'], [])
+
+    def test_document(self):
+        d = docx.Document.create()
+        d.add_para('Results')
+        d.add_line_chart([1, 2, 3])
+        report = inspector.inspectpackage(saved(d))
+        self.assertEqual(report['unused_relationships'], [])
+        self.assertEqual(report['unreferenced_parts'], [])
+
+    def test_unused(self):
+        source = zipfile.ZipFile(saved(pptx.Document.create()))
+        out = io.BytesIO()
+        z = zipfile.ZipFile(out, 'w')
+        for info in source.infolist():
+            data = source.read(info.filename)
+            if info.filename == 'ppt/_rels/presentation.xml.rels':
+                data = data.replace('</Relationships>', '<Relationship Id="rId99" Type='
+                                    '"%s/slideMaster" Target="slideMasters/slideMaster1.xml"/>'
+                                    '</Relationships>' % docx.nsprefixes['r'])
+            z.writestr(info, data)
+        z.close()
+        report = inspector.inspectpackage(io.BytesIO(out.getvalue()))
+        unused = report['unused_relationships']
+        self.assertEqual([(entry['source'], entry['id']) for entry in unused],
+                         [('ppt/presentation.xml', 'rId99')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+'''
+Tests for the older picture() functions used with the relationships of a
+Document or a slide, which hand out their own ids.
+
+    python -m unittest openxml.tests.test_legacy
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from lxml import etree
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+from openxml import docx, pptx, opc
+
+def embeds(z, partname):
+    '''Return the (id, part name) of each picture a part shows, with None
+    for an id which has no relationship, or a target which isn't there.'''
+    rels = dict((rid, target) for rid, reltype, target
+                in opc.Relationships.fromxml(z.read(opc.relsname(partname))))
+    names = set(z.namelist())
+    result = []
+    for blip in etree.fromstring(z.read(partname)).iter('{%s}blip' % docx.nsprefixes['a']):
+        rid = blip.get('{%s}embed' % docx.nsprefixes['r'])
+        target = rels.get(rid)
+        target = target and opc.resolve(partname, target)
+        result.append((rid, target if target in names else None))
+    return result
+
+class LegacyPictureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.logo = os.path.join(self.dir, 'logo.png')
+        Image.new('RGB', (8, 8), 'red').save(self.logo)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_docx(self):
+        d = docx.Document.create(compact=False)
+        for n in range(2):
+            rels, para = docx.picture(d.relationshiplist, self.logo)
+            d.body.append(para)
+        out = io.BytesIO()
+        d.save(out)
+        d.close()
+        shown = embeds(zipfile.ZipFile(out), 'word/document.xml')
+        self.assertEqual(len(shown), 2)
+        # The same picture, under the same id
+        self.assertEqual(shown[0], shown[1])
+        self.assertNotEqual(shown[0][1], None)
+
+    def check_pptx(self, streamed):
+        path = os.path.join(self.dir, 'deck.pptx')
+        d = pptx.Document.create(output=path if streamed else None)
+        with d.add_slide() as slide:
+            for n in range(2):
+                rels, element = pptx.picture(self.logo, slide.relationships)
+                slide.sptree.append(element)
+        d.save(None if streamed else path)
+        d.close()
+        shown = embeds(zipfile.ZipFile(path), 'ppt/slides/slide1.xml')
+        self.assertEqual(len(shown), 2)
+        self.assertEqual(shown[0], shown[1])
+        self.assertNotEqual(shown[0][1], None)
+
+    def test_pptx(self):
+        self.check_pptx(False)
+
+    def test_pptx_streamed(self):
+        self.check_pptx(True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+'''
+Tests for searching the text index, with text which isn't all ASCII.
+
+    python -m unittest openxml.tests.test_textindex
+'''
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from openxml import docx
+from openxml.textindex import TextIndex
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = TextIndex(os.path.join(self.dir, 'index'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, name, paragraphs):
+        '''Save a .docx whose paragraphs have the given runs.'''
+        d = docx.Document.create(compact=False)
+        for runs in paragraphs:
+            d.add_para([(text, '') for text in runs])
+        path = os.path.join(self.dir, name)
+        d.save(path)
+        d.close()
+        return path
+
+    def test_unicode(self):
+        path = self.build('menu.docx', [[u'Caf\xe9 ', u'cr\xe8me'],
+                                        [u'\xc9CLAIR ', u'and ', u'caf\xe9']])
+        found = list(self.index.search([path], r'\bcaf\w\b', re.I))
+        self.assertEqual([number for path, number, text in found], [0, 1])
+        self.assertEqual(found[1][2], u'\xc9CLAIR and caf\xe9')
+        self.assertEqual(list(self.index.findall([path], u'\xe9clair|cr\w+', re.I)),
+                         [(path, 0, 1, u'cr\xe8me'), (path, 1, 0, u'\xc9CLAIR')])
+        # Runs after non-ASCII text are found by character, not byte
+        self.assertEqual(list(self.index.findall([path], u'and|caf\xe9$')),
+                         [(path, 1, 1, u'and'), (path, 1, 2, u'caf\xe9')])
+
+    def test_ascii(self):
+        path = self.build('plain.docx', [[u'Net ', u'profit'], [u'net loss']])
+        self.assertEqual(list(self.index.findall([path], r'net (profit|loss)', re.I)),
+                         [(path, 0, 0, u'Net profit'), (path, 1, 0, u'net loss')])
+
+if __name__ == '__main__':
+    unittest.main()
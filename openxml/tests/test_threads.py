@@ -0,0 +1,157 @@
+'''
+Stress test for building documents from several threads at once: each
+thread builds and saves docx and pptx documents (compact and lxml, streamed
+and not), forks of one shared document and documents made with the older
+picture() functions, and every output is checked for its text and for the
+content of each of its pictures.
+
+    python -m unittest openxml.tests.test_threads
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+from openxml import docx, pptx, opc
+
+THREADS = 8
+ROUNDS = 5
+
+imagereltype = docx.nsprefixes['i']
+
+def png(size, colour):
+    '''Return the bytes of a PNG of one colour.'''
+    out = io.BytesIO()
+    Image.new('RGB', size, colour).save(out, 'PNG')
+    return out.getvalue()
+
+def noise(size):
+    '''Return the bytes of a PNG of random pixels, which doesn't compress.'''
+    out = io.BytesIO()
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(out, 'PNG')
+    return out.getvalue()
+
+def docxpictures(path):
+    '''Return the content of each picture the body of a .docx refers to.'''
+    z = zipfile.ZipFile(path)
+    try:
+        rels = opc.Relationships.fromxml(z.read('word/_rels/document.xml.rels'))
+        return [z.read(opc.resolve('word/document.xml', target))
+                for rid, reltype, target in rels if reltype == imagereltype]
+    finally:
+        z.close()
+
+class ThreadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Two different pictures with the same file name
+        self.logos = []
+        for name, colour in (('a', 'red'), ('b', 'blue')):
+            os.mkdir(os.path.join(self.dir, name))
+            path = os.path.join(self.dir, name, 'logo.png')
+            with open(path, 'wb') as f:
+                f.write(png((8, 8), colour))
+            self.logos.append(path)
+        # A document to fork, whose pictures are all spilled to disk, and big
+        # enough to be read in several pieces
+        self.shared = docx.Document.create(compact=True, memory_budget=0)
+        self.sharedpictures = [noise((200 + n, 200)) for n in range(3)]
+        for n, data in enumerate(self.sharedpictures):
+            self.shared.add_picture('shared%d.png' % n, data=io.BytesIO(data))
+        self.shared.add_para('shared')
+
+    def tearDown(self):
+        self.shared.close()
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def output(self, name):
+        return os.path.join(self.dir, name)
+
+    def builddocx(self, n, k):
+        logo = self.logos[(n + k) % 2]
+        data = png((n + 1, k + 1), 'white')
+        d = docx.Document.create(compact=bool(k % 2))
+        d.add_para('docx %d %d' % (n, k))
+        d.add_picture(logo)
+        d.add_picture('data.png', data=data)
+        path = self.output('docx-%d-%d.docx' % (n, k))
+        d.save(path)
+        d.close()
+        self.assertEqual(list(docx.iterdocumenttext(path)), [u'docx %d %d' % (n, k)])
+        self.assertEqual(docxpictures(path), [self.read(logo), data])
+
+    def buildfork(self, n, k):
+        d = self.shared.fork()
+        d.add_para('fork %d %d' % (n, k))
+        path = self.output('fork-%d-%d.docx' % (n, k))
+        d.save(path)
+        d.close()
+        self.assertEqual(list(docx.iterdocumenttext(path)), [u'shared', u'fork %d %d' % (n, k)])
+        self.assertEqual(docxpictures(path), self.sharedpictures)
+
+    def buildlegacy(self, n, k):
+        document = docx.newdocument()
+        body = document.xpath('/w:document/w:body', namespaces=docx.nsprefixes)[0]
+        rels = docx.relationshiplist()
+        body.append(docx.paragraph('legacy %d %d' % (n, k)))
+        for logo in self.logos:
+            rels, para = docx.picture(rels, logo)
+            body.append(para)
+        path = self.output('legacy-%d-%d.docx' % (n, k))
+        docx.savedocx(document, path, docx.wordrelationships(rels))
+        self.assertEqual(list(docx.iterdocumenttext(path)), [u'legacy %d %d' % (n, k)])
+        self.assertEqual(docxpictures(path), [self.read(logo) for logo in self.logos])
+
+    def buildpptx(self, n, k):
+        path = self.output('pptx-%d-%d.pptx' % (n, k))
+        streamed = bool(k % 2)
+        d = pptx.Document.create(output=path if streamed else None)
+        data = png((k + 1, n + 1), 'black')
+        for number, logo in enumerate(self.logos):
+            with d.add_slide() as slide:
+                slide.add_text_box('pptx %d %d %d' % (n, k, number))
+                slide.add_picture(logo)
+                slide.add_picture('data.png', data=data)
+        d.save(None if streamed else path)
+        d.close()
+        deck = pptx.open(path)
+        try:
+            self.assertEqual(len(deck), 2)
+            for slide, logo in zip(deck, self.logos):
+                self.assertEqual(slide.text(), ['pptx %d %d %d' % (n, k, slide.number - 1)])
+                self.assertEqual([deck.read(picture) for picture in slide.pictures()],
+                                 [self.read(logo), data])
+        finally:
+            deck.close()
+
+    def test_threads(self):
+        builders = [self.builddocx, self.buildfork, self.buildlegacy, self.buildpptx]
+        failures = []
+        def run(n):
+            for k in range(ROUNDS):
+                for build in builders:
+                    try:
+                        build(n, k)
+                    except Exception as e:
+                        failures.append('%s(%d, %d): %r' % (build.__name__, n, k, e))
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+'''
+A persistent cache of the text of .docx and .pptx files, for searching the
+same archive over and over without unzipping or parsing anything.
+
+    >>> index = TextIndex('/var/cache/openxml')
+    >>> for path, number, text in index.search(paths, r'net (profit|loss)'):
+    ...     print path, number, text
+
+The text of each file is kept in a sidecar file in the index directory,
+named after the file's real path, size and modification time, so a file
+which changes gets a new sidecar and the old one is simply no longer used
+(prune() removes those). A sidecar holds, after a small header:
+
+    paragraph starts    uint32 * (paragraphs + 1), byte offsets into the text
+    piece starts        uint32 * pieces, byte offsets into the text
+    first pieces        uint32 * (paragraphs + 1), index of each paragraph's
+                        first piece
+    text                UTF-8, one paragraph per line
+
+all little-endian. The pieces of a paragraph are its runs of text (w:t
+elements, or tabs) for a .docx; for a .pptx each slide is a paragraph and
+its pieces are the slide's texts. Sidecars are memory mapped; a search
+decodes the text of each file in one go and runs the regular expression over
+it with re.UNICODE, so that \w, \b and re.IGNORECASE work on any letter, as
+they do for docx.search().
+'''
+
+import os
+import re
+import mmap
+import struct
+import bisect
+import hashlib
+import tempfile
+import docx
+import pptx
+
+MAGIC = 'OXTI\x01\x00\x00\x00'
+_header = struct.Struct('<8s3I')
+
+def paragraphs(path):
+    '''Yield the pieces of each paragraph of a .docx file, or of each slide
+    of a .pptx file.'''
+    if path.lower().endswith('.pptx'):
+        deck = pptx.open(path)
+        try:
+            for number, texts, pictures in deck.iterslides():
+                yield texts
+        finally:
+            deck.close()
+    else:
+        for pieces in docx.iterparagraphs(path):
+            yield pieces
+
+def writesidecar(path, output):
+    '''Extract the text of path and write it to output in sidecar format.'''
+    parastarts = [0]
+    piecestarts = []
+    firstpieces = [0]
+    text = []
+    pos = 0
+    for pieces in paragraphs(path):
+        for piece in pieces:
+            # Newlines separate paragraphs: don't let a piece contain one
+            piece = piece.replace(u'\n', u' ').encode('utf-8')
+            piecestarts.append(pos)
+            text.append(piece)
+            pos += len(piece)
+        text.append('\n')
+        pos += 1
+        parastarts.append(pos)
+        firstpieces.append(len(piecestarts))
+    output.write(_header.pack(MAGIC, len(parastarts) - 1, len(piecestarts), pos))
+    for offsets in (parastarts, piecestarts, firstpieces):
+        output.write(struct.pack('<%dI' % len(offsets), *offsets))
+    output.write(''.join(text))
+
+class TextFile(object):
+    '''The memory mapped sidecar of one file.'''
+
+    def __init__(self, sidecar):
+        f = open(sidecar, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, self.paragraphcount, self.piececount, size = _header.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError('%s is not a text index sidecar' % sidecar)
+        self._offsets = _header.size
+        self.textstart = self._offsets + 4 * (2 * self.paragraphcount + self.piececount + 2)
+        self.textend = self.textstart + size
+        self._parastarts = None
+        # Paragraph starts in characters, for the matches of finditer()
+        self._charstarts = None
+
+    def _array(self, index, count):
+        return struct.unpack_from('<%dI' % count, self.map, self._offsets + 4 * index)
+
+    def parastarts(self):
+        if self._parastarts is None:
+            self._parastarts = self._array(0, self.paragraphcount + 1)
+        return self._parastarts
+
+    def paragraph(self, number):
+        '''Return the text of a paragraph (counting from 0).'''
+        starts = self.parastarts()
+        return self.map[self.textstart + starts[number]:
+                        self.textstart + starts[number + 1] - 1].decode('utf-8')
+
+    def _piecestarts(self, number):
+        # The starts of the paragraph's pieces, then the end of its last one
+        first, last = self._array(self.paragraphcount + 1 + self.piececount + number, 2)
+        end = self.parastarts()[number + 1] - 1
+        return self._array(self.paragraphcount + 1 + first, last - first) + (end,)
+
+    def pieces(self, number):
+        '''Return the pieces (runs) of a paragraph.'''
+        starts = self._piecestarts(number)
+        return [self.map[self.textstart + a:self.textstart + b].decode('utf-8')
+                for a, b in zip(starts, starts[1:])]
+
+    def text(self):
+        '''Return the text of every paragraph, one to a line.'''
+        return self.map[self.textstart:self.textend].decode('utf-8')
+
+    def _paragraphchars(self, text):
+        if len(text) == self.textend - self.textstart:
+            # All ASCII: characters and bytes are the same
+            return self.parastarts()
+        starts = [0]
+        for line in text.split(u'\n')[:-1]:
+            starts.append(starts[-1] + len(line) + 1)
+        return starts
+
+    def finditer(self, pattern):
+        '''Yield (paragraph number, match) for each match of a compiled
+        unicode pattern in text(). Match offsets are in characters from the
+        start of text().'''
+        text = self.text()
+        for match in pattern.finditer(text):
+            if self._charstarts is None:
+                self._charstarts = self._paragraphchars(text)
+            yield bisect.bisect_right(self._charstarts, match.start()) - 1, match
+
+    def run(self, number, match):
+        '''Return the index, within paragraph number, of the piece in which
+        a match from finditer() starts.'''
+        starts = [self._charstarts[number]]
+        for piece in self.pieces(number):
+            starts.append(starts[-1] + len(piece))
+        return bisect.bisect_right(starts, match.start()) - 1
+
+    def close(self):
+        self.map.close()
+
+def _compile(pattern, flags):
+    if isinstance(pattern, str):
+        pattern = pattern.decode('utf-8')
+    return re.compile(pattern, flags | re.UNICODE)
+
+class TextIndex(object):
+    '''Sidecars of text for files, kept in directory. See the module
+    docstring.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Somebody else may have just made it
+                if not os.path.isdir(directory):
+                    raise
+
+    def sidecar(self, path):
+        '''Return the sidecar path for the current version of a file.'''
+        st = os.stat(path)
+        key = '%s\0%d\0%r' % (os.path.realpath(path), st.st_size, st.st_mtime)
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.oxti')
+
+    def get(self, path):
+        '''Return the TextFile for a file, extracting its text first if
+        there is no sidecar for this version of it.'''
+        sidecar = self.sidecar(path)
+        if not os.path.exists(sidecar):
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            f = os.fdopen(fd, 'wb')
+            try:
+                writesidecar(path, f)
+            except:
+                f.close()
+                os.remove(tmp)
+                raise
+            f.close()
+            os.rename(tmp, sidecar)
+        return TextFile(sidecar)
+
+    def search(self, paths, pattern, flags=0):
+        '''Yield (path, paragraph number, paragraph text) for each paragraph
+        of the files in paths which matches pattern, a regular expression
+        (UTF-8 if it is a byte string).'''
+        pattern = _compile(pattern, flags)
+        for path in paths:
+            textfile = self.get(path)
+            try:
+                last = None
+                for number, match in textfile.finditer(pattern):
+                    if number != last:
+                        yield path, number, textfile.paragraph(number)
+                        last = number
+            finally:
+                textfile.close()
+
+    def findall(self, paths, pattern, flags=0):
+        '''Yield (path, paragraph number, piece number, text) for each match
+        of pattern in the files in paths. Like AdvSearch(), matches may span
+        several pieces; the piece number is that of the first.'''
+        pattern = _compile(pattern, flags)
+        for path in paths:
+            textfile = self.get(path)
+            try:
+                for number, match in textfile.finditer(pattern):
+                    yield path, number, textfile.run(number, match), match.group()
+            finally:
+                textfile.close()
+
+    def prune(self, paths):
+        '''Remove the sidecars which don't belong to the current version of
+        one of paths.'''
+        keep = set([os.path.basename(self.sidecar(path)) for path in paths])
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.oxti') and filename not in keep:
+                os.remove(os.path.join(self.directory, filename))
@@ -0,0 +1,284 @@
+'''
+Create Open XML Spreadsheet documents (.xlsx, spreadsheetML), streamed
+straight into the file so that memory use doesn't grow with the number of
+rows:
+
+    >>> book = Workbook.create('export.xlsx')
+    >>> sheet = book.add_sheet('Data', headers=['Date', 'Region', 'Sales'])
+    >>> sheet.write_rows(cursor)            # any iterable of rows
+    >>> book.add_sheet('Totals').write_columns([regions, totals])   # or NumPy arrays
+    >>> book.save()
+
+Numbers (including NumPy scalars) and booleans are written as typed cells,
+dates and datetimes as numbers formatted as dates, and None, NaN and
+infinities as empty cells. Strings go into the shared strings table, which
+is written at the end; with shared_strings=False they are written inline
+in the cells instead, which keeps memory constant even when most strings
+are distinct.
+'''
+
+import os
+import re
+import math
+import datetime
+import itertools
+from os.path import join
+from lxml import etree
+from namespaces import nsprefixes
+from compact import escape
+import opc
+
+template_dir = join(os.path.dirname(__file__), 'xlsx_template')
+
+worksheetreltype = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+worksheetcontenttype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+sharedstringsreltype = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+sharedstringscontenttype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'
+
+# Cell styles (indexes of cellXfs in the template's styles.xml)
+DATE, DATETIME, BOLD = 1, 2, 3
+
+# Limits of a worksheet
+maxrows = 1048576
+maxcolumns = 16384
+
+# Bytes of XML to gather before handing them to the compressor
+BUFFER = 1 << 16
+
+_badsheetchars = re.compile(r'[\[\]:*?/\\]')
+_epoch = datetime.datetime(1899, 12, 30)
+
+def columnname(number):
+    '''Return the letters of a column, counting from 0: A, B, ..., AA, ...'''
+    name = ''
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+def serial(value):
+    '''Return a date or datetime as an Excel serial number.'''
+    if not isinstance(value, datetime.datetime):
+        return (value - _epoch.date()).days
+    delta = value.replace(tzinfo=None) - _epoch
+    return delta.days + (delta.seconds + delta.microseconds / 1e6) / 86400.0
+
+def _tstring(text):
+    text = escape(text)
+    if text[:1].isspace() or text[-1:].isspace():
+        return '<t xml:space="preserve">%s</t>' % text
+    return '<t>%s</t>' % text
+
+class SharedStrings(object):
+    '''The shared strings table of a workbook: each distinct string once.'''
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+        self.count = 0
+
+    def add(self, text):
+        '''Return the index of a string, adding it if need be.'''
+        self.count += 1
+        try:
+            return self.index[text]
+        except KeyError:
+            # Check it now, rather than find out at the end
+            escape(text)
+            n = self.index[text] = len(self.strings)
+            self.strings.append(text)
+            return n
+
+    def write(self, entry):
+        entry.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<sst xmlns="%s" count="%d" uniqueCount="%d">'
+                    % (nsprefixes['x'], self.count, len(self.strings)))
+        buf = []
+        size = 0
+        for text in self.strings:
+            si = '<si>%s</si>' % _tstring(text)
+            buf.append(si)
+            size += len(si)
+            if size > BUFFER:
+                entry.write(''.join(buf))
+                buf = []
+                size = 0
+        buf.append('</sst>')
+        entry.write(''.join(buf))
+
+class Worksheet(object):
+    '''A worksheet being written. Rows go straight into the zip; once the
+    next sheet is added, or the workbook saved, the sheet is finished and
+    can't be written to any more.'''
+
+    def __init__(self, workbook, name, partname, entry, widths=None):
+        self.workbook = workbook
+        self.name = name
+        self.partname = partname
+        self.rows = 0
+        self._entry = entry
+        self._buf = []
+        self._size = 0
+        self._columns = []
+        entry.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="%s" xmlns:r="%s">' % (nsprefixes['x'], nsprefixes['r']))
+        if widths:
+            entry.write('<cols>%s</cols>' % ''.join(
+                ['<col min="%d" max="%d" width="%r" customWidth="1"/>' % (n, n, float(width))
+                 for n, width in enumerate(widths, 1) if width]))
+        entry.write('<sheetData>')
+
+    def _cell(self, ref, value, style):
+        '''Return the XML of one cell, or '' for an empty one.'''
+        if value is None:
+            return ''
+        if isinstance(value, basestring):
+            if self.workbook.sharedstrings is not None:
+                return '<c r="%s" t="s"%s><v>%d</v></c>' % (
+                    ref, style, self.workbook.sharedstrings.add(value))
+            return '<c r="%s" t="inlineStr"%s><is>%s</is></c>' % (ref, style, _tstring(value))
+        if isinstance(value, bool):
+            return '<c r="%s" t="b"%s><v>%d</v></c>' % (ref, style, value)
+        if isinstance(value, (int, long)):
+            return '<c r="%s"%s><v>%d</v></c>' % (ref, style, value)
+        if isinstance(value, float):
+            if math.isnan(value) or math.isinf(value):
+                return ''
+            return '<c r="%s"%s><v>%r</v></c>' % (ref, style, value)
+        if isinstance(value, datetime.datetime):
+            return '<c r="%s" s="%d"><v>%r</v></c>' % (ref, DATETIME, serial(value))
+        if isinstance(value, datetime.date):
+            return '<c r="%s" s="%d"><v>%d</v></c>' % (ref, DATE, serial(value))
+        if hasattr(value, 'item'):
+            # A NumPy scalar
+            return self._cell(ref, value.item(), style)
+        return self._cell(ref, unicode(value), style)
+
+    def write_row(self, row, style=None):
+        '''Write a row of values; see the module docstring for how they are
+        written. style is one of the cell styles (e.g. BOLD) for the whole
+        row.'''
+        if self._entry is None:
+            raise ValueError('Worksheet %r is finished: rows must be written before the next '
+                             'sheet is added' % self.name)
+        if self.rows >= maxrows:
+            raise ValueError('A worksheet holds at most %d rows' % maxrows)
+        if hasattr(row, 'tolist'):
+            # A NumPy array: converting it all at once is much faster
+            row = row.tolist()
+        self.rows += 1
+        number = str(self.rows)
+        columns = self._columns
+        style = ' s="%d"' % style if style else ''
+        cells = []
+        for n, value in enumerate(row):
+            if n >= len(columns):
+                if n >= maxcolumns:
+                    raise ValueError('A worksheet holds at most %d columns' % maxcolumns)
+                columns.append(columnname(n))
+            cells.append(self._cell(columns[n] + number, value, style))
+        xml = '<row r="%s">%s</row>' % (number, ''.join(cells))
+        self._buf.append(xml)
+        self._size += len(xml)
+        if self._size > BUFFER:
+            self._entry.write(''.join(self._buf))
+            self._buf = []
+            self._size = 0
+
+    def write_rows(self, rows, style=None):
+        '''Write each of an iterable of rows (e.g. a database cursor, or a
+        2-D NumPy array).'''
+        for row in rows:
+            self.write_row(row, style)
+
+    def write_columns(self, columns, style=None):
+        '''Write rows made up from a list of columns (sequences or NumPy
+        arrays of equal length).'''
+        columns = [column.tolist() if hasattr(column, 'tolist') else column
+                   for column in columns]
+        if len(set([len(column) for column in columns])) > 1:
+            raise ValueError('All the columns must have the same length')
+        self.write_rows(itertools.izip(*columns), style)
+
+    def finish(self):
+        '''Write the end of the sheet and close its zip entry.'''
+        if self._entry is None:
+            return
+        self._buf.append('</sheetData></worksheet>')
+        self._entry.write(''.join(self._buf))
+        self._entry.close()
+        self._entry = None
+        self._buf = []
+
+class Workbook(object):
+    '''A workbook streamed to a file; see the module docstring.'''
+
+    def __init__(self, output, shared_strings=True, timestamp=None):
+        self.template_dir = template_dir
+        self.package = opc.Package.fromdir(template_dir)
+        part = self.package.get_part('xl/workbook.xml')
+        self.workbook = etree.fromstring(part.blob())
+        part.element, part.path = self.workbook, None
+        self.relationshiplist = part.rels
+        self.sheet_list = self.workbook.find('{%s}sheets' % nsprefixes['x'])
+        self.sharedstrings = SharedStrings() if shared_strings else None
+        if isinstance(output, basestring) and output[-5:] != '.xlsx':
+            output = output + '.xlsx'
+        self.writer = opc.PackageWriter(self.package, output, timestamp=timestamp)
+        self.sheets = []
+        return
+
+    @classmethod
+    def create(cls, output, shared_strings=True, timestamp=None):
+        '''Create a workbook with no sheets, to be written to output (a
+        filename or a file-like object which can seek). If a timestamp (a
+        datetime, or seconds since the epoch, e.g. opc.EPOCH) is given, the
+        zip entries all carry it, so that the same data always gives the
+        same bytes.'''
+        return cls(output, shared_strings, timestamp)
+
+    def add_sheet(self, name=None, headers=None, widths=None):
+        '''Finish the current sheet, if any, and start a new one. name
+        defaults to Sheet1, Sheet2...; headers, if given, are written as a
+        bold first row; widths are column widths in characters.'''
+        if self.writer is None:
+            raise ValueError('The workbook has been saved')
+        if self.sheets:
+            self.sheets[-1].finish()
+        number = len(self.sheets) + 1
+        if name is None:
+            name = 'Sheet%d' % number
+        if not name or len(name) > 31 or _badsheetchars.search(name):
+            raise ValueError('Sheet names are 1 to 31 characters, not including []:*?/\\')
+        if name.lower() in [sheet.name.lower() for sheet in self.sheets]:
+            raise ValueError('There is already a sheet called %r' % name)
+        partname = 'xl/worksheets/sheet%d.xml' % number
+        entry = opc.ZipEntryWriter(self.writer.zf, partname)
+        self.writer.written.append(opc.Part(partname, worksheetcontenttype))
+        sheet = Worksheet(self, name, partname, entry, widths)
+        self.sheets.append(sheet)
+        rid = self.relationshiplist.add(worksheetreltype, partname[len('xl/'):])
+        etree.SubElement(self.sheet_list, '{%s}sheet' % nsprefixes['x'],
+                         {'name': name, 'sheetId': str(number),
+                          '{%s}id' % nsprefixes['r']: rid})
+        if headers:
+            sheet.write_row(headers, BOLD)
+        return sheet
+
+    def save(self):
+        '''Finish the last sheet and write the rest of the workbook.'''
+        if not self.sheets:
+            # Excel won't open a workbook without sheets
+            self.add_sheet()
+        self.sheets[-1].finish()
+        if self.sharedstrings is not None and self.sharedstrings.strings:
+            partname = 'xl/sharedStrings.xml'
+            entry = opc.ZipEntryWriter(self.writer.zf, partname)
+            self.sharedstrings.write(entry)
+            entry.close()
+            self.writer.written.append(opc.Part(partname, sharedstringscontenttype))
+            self.relationshiplist.add(sharedstringsreltype, partname[len('xl/'):])
+        self.writer.close()
+        self.writer = None
+        return
@@ -11,7 +11,7 @@ for scheme in INSTALL_SCHEMES.values():
 setup(name='python-openxml',
       version='0.1',
       requires=['lxml'],
-      description='Create .pptx and .docx files from Python',
+      description='Create .pptx, .docx and .xlsx files from Python',
       author='Tom Scrace',
       author_email='tom.scrace@timetric.com',
       url='http://github.com/timetric/python-openxml',
@@ -23,5 +23,10 @@ setup(name='python-openxml',
           ('openxml/docx_template/word/theme', glob('docx_template/word/theme/*.*')),
           ('openxml/pptx_template/_rels', glob('pptx_template/_rels/.*')),
           ('openxml/pptx_template/ppt', glob('pptx_template/ppt/*.xml')),
+          ('openxml/xlsx_template', glob('xlsx_template/*.xml')),
+          ('openxml/xlsx_template/_rels', glob('xlsx_template/_rels/.*')),
+          ('openxml/xlsx_template/docProps', glob('xlsx_template/docProps/*.xml')),
+          ('openxml/xlsx_template/xl', glob('xlsx_template/xl/*.xml')),
+          ('openxml/xlsx_template/xl/_rels', glob('xlsx_template/xl/_rels/*.rels')),
           ],
       )